@@ -4,4 +4,6 @@ __version__ = importlib.metadata.version('desc-wfmon')
 from .mondb import MonDbReader
 from .fundata import FunctionData
 from .perfstat import PerfStatLogReader
+from .collection import MonDbCollection
 from .test_fundata import TestFunctionData
+from .test_mondb import TestMonDbReaderLocal
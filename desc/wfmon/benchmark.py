@@ -0,0 +1,231 @@
+# benchmark.py
+#
+# David Adams
+# October 2026
+
+"""
+Timing benchmarks for the desc.wfmon processing steps.
+"""
+
+import os
+import glob
+import time
+import sqlite3
+import tempfile
+import tracemalloc
+import numpy
+import pandas
+from desc.wfmon import MonDbReader, FunctionData, PerfStatLogReader
+from desc.wfmon.fundata import function_data_logs, log_ids
+from desc.wfmon.synthetic import make_rundir
+
+def bench_sampling_offsets(ntask=10000, nsam_max=40, dt=5.0, jitter=0.3, seed=1, ntask_loop=1000, memory=True, dbg=1):
+    """
+    Compare the times and peak memory to find the sampling offsets used in the taskproc
+    tables with the interval evaluation and the stepping search. Use a large dt (e.g. 3600)
+    and many tasks to check the memory does not grow with dt.
+    Arguments:
+      ntask - Number of tasks.
+      nsam_max - Maximum number of samples for each task.
+      dt - Sampling interval.
+      jitter - Fractional variation in the spacing between samples.
+      seed - Random number seed.
+      ntask_loop - Number of tasks for the stepping search called once for each task as
+                   in the original taskproc. The time is scaled to ntask.
+      memory - If true, the peak memory of the interval and step methods is recorded.
+      dbg - 0 for silent
+    Returns a dataframe indexed by method with the time [sec] and peak memory [MB]. The
+    memory is None for step_per_task and if memory is false.
+    """
+    myname = 'bench_sampling_offsets'
+    rng = numpy.random.default_rng(seed)
+    nsams = rng.integers(1, nsam_max + 1, ntask)
+    starts = numpy.concatenate([[0], numpy.cumsum(nsams)[:-1]])
+    tims = numpy.concatenate([rng.uniform(0, 1000) + numpy.cumsum(dt*(1 + jitter*(rng.uniform(size=nsam) - 0.5)))
+                              for nsam in nsams])
+    times = {}
+    peaks = {}
+    (toffs, found), times['interval'], peaks['interval'] = measure(
+        lambda: MonDbReader.sampling_offsets(tims, starts, dt, 'interval'), memory)
+    (stoffs, sfound), times['step'], peaks['step'] = measure(
+        lambda: MonDbReader.sampling_offsets(tims, starts, dt, 'step'), memory)
+    nloop = min(ntask_loop, ntask)
+    t0 = time.perf_counter()
+    for itsk in range(nloop):
+        i1 = starts[itsk]
+        MonDbReader.sampling_offsets(tims[i1:i1+nsams[itsk]], [0], dt, 'step')
+    times['step_per_task'] = (time.perf_counter() - t0)*ntask/max(nloop, 1)
+    peaks['step_per_task'] = None
+    ndif = int((numpy.abs(toffs - stoffs) > 1.e-9).sum() + (found != sfound).sum())
+    if dbg:
+        print(f"{myname}: {ntask} tasks with {len(tims)} samples, dt = {dt}, {int((~found).sum())} without offset")
+        for nam, tim in times.items():
+            smem = '' if peaks[nam] is None else f"  peak {peaks[nam]:10.1f} MB"
+            print(f"{myname}: {nam:>15}: {tim:10.4f} sec  speedup {tim/times['interval']:8.1f}{smem}")
+        if ndif: print(f"{myname}: WARNING: Methods differ for {ndif} tasks.")
+    return pandas.DataFrame({'time': times, 'memory': peaks})
+
+def measure(fun, memory=True):
+    """
+    Call fun() and return (result, time in seconds, peak memory in MB).
+    The peak is that of the memory allocated by python and numpy during the call as
+    reported by tracemalloc. It is None if memory is false.
+    """
+    if memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        res = fun()
+        tim = time.perf_counter() - t0
+    finally:
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]/2**20
+            tracemalloc.stop()
+    return res, tim, peak
+
+# Steps timed by bench_scaling.
+scaling_steps = ['read', 'fix_runs', 'fix_workflows', 'fix_times', 'fix_tasks', 'fix_try', 'build_procsum_nodelta',
+                 'build_procsum', 'taskcounts', 'chaintasks', 'FunctionData', 'PerfStatLogReader']
+
+def bench_scaling(ntasks=(1000, 10000, 100000), dts=(5.0,), nrun=1, nworker=256, tmean=30.0, fail_frac=0.01,
+                  delt=10.0, workdir=None, steps=None, memory=True, seed=1, dbg=1):
+    """
+    Time and memory-profile the MonDbReader, FunctionData and PerfStatLogReader steps
+    for synthetic run directories written with synthetic.make_rundir for each number of
+    tasks in ntasks and each sampling interval in dts.
+    Arguments:
+      ntasks - Numbers of tasks in each run.
+      dts - Resource sampling intervals [sec].
+      nrun - Number of runs in each DB. The steps are run for the first.
+      nworker, tmean, fail_frac - Passed to make_rundir.
+      delt - Time spacing for taskcounts.
+      workdir - Directory for the run directories. Existing run directories are reused.
+                If None, a temporary directory is used and removed at the end.
+      steps - Steps to run (default is scaling_steps). The fix steps are always run.
+      memory - If true, the peak memory for each step is recorded. This slows the steps.
+      seed - Random number seed.
+      dbg - 0 for silent
+    Returns a dataframe with one row per scale and step with the columns ntask, dt, nsample,
+    step, time [sec] and peak memory [MB].
+    """
+    myname = 'bench_scaling'
+    if steps is None: steps = scaling_steps
+    tmpdir = None
+    if workdir is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        workdir = tmpdir.name
+    rows = []
+    try:
+        for ntask in ntasks:
+            for dt in dts:
+                rundir = os.path.join(workdir, f"run{ntask}-dt{dt:g}-w{nworker}-s{seed}")
+                dbnam = os.path.join(rundir, 'runinfo', 'monitoring.db')
+                if not os.path.exists(dbnam):
+                    t0 = time.perf_counter()
+                    make_rundir(rundir, ntask, nrun, dt, nworker, tmean, fail_frac, seed=seed, dbg=max(dbg - 1, 0))
+                    if dbg: print(f"{myname}: Wrote {rundir} in {time.perf_counter() - t0:.1f} sec")
+                with sqlite3.connect(dbnam) as con:
+                    run_id = con.execute("select run_id from workflow").fetchone()[0]
+                    nsam = con.execute("select count(*) from resource where run_id=?", [run_id]).fetchone()[0]
+                dbr = None
+                def run_step(step):
+                    if step == 'read': return MonDbReader(dbnam, fix=False, run_id=run_id)
+                    if step.startswith('fix_'): return getattr(dbr, step)()
+                    if step == 'build_procsum_nodelta': return dbr.build_procsum(False)
+                    if step == 'build_procsum': return dbr.build_procsum(True)
+                    if step == 'taskcounts': return dbr.taskcounts(delt=delt)
+                    if step == 'chaintasks': return dbr.chaintasks()
+                    if step == 'FunctionData': return FunctionData(rundir + '/')
+                    if step == 'PerfStatLogReader': return PerfStatLogReader().read_mondb_logs(dbr)
+                    raise Exception(f"{myname}: Invalid step: {step}")
+                for step in scaling_steps:
+                    if step not in steps and step != 'read' and not step.startswith('fix_'): continue
+                    res, tim, peak = measure(lambda: run_step(step), memory)
+                    if step == 'read': dbr = res
+                    rows.append({'ntask': ntask, 'dt': dt, 'nsample': nsam, 'step': step, 'time': tim, 'memory': peak})
+                    if dbg: print(f"{myname}: {ntask:>8} tasks dt={dt:<5g} {step:>22}: {tim:9.3f} sec"
+                                  + ('' if peak is None else f" {peak:9.1f} MB"))
+                del dbr
+    finally:
+        if tmpdir is not None: tmpdir.cleanup()
+    return pandas.DataFrame(rows)
+
+def function_data_rowwise(fnams):
+    """
+    Return the function data table for log files fnams built as in the original FunctionData
+    with .loc assignment of each row to a preallocated object table. Used for comparison.
+    """
+    data = None
+    nent = 0
+    for fnam in fnams:
+        stid = os.path.basename(os.path.dirname(fnam))
+        while len(stid) > 1 and stid[0] == '0': stid = stid[1:]
+        mymap = {'taskid': int(stid)}
+        with open(fnam) as fin:
+            for line in fin:
+                wrds = line.rstrip().split()
+                if len(wrds) == 2: mymap[wrds[1].lower()] = float(wrds[0])
+        df = pandas.DataFrame(mymap, index=[nent])
+        if data is None:
+            data = pandas.DataFrame(columns=mymap.keys(), index=range(len(fnams)))
+        data.loc[nent] = mymap
+        nent += 1
+    return data
+
+def bench_function_data(ntask=10000, nworker=None, workdir=None, seed=1, dbg=1):
+    """
+    Compare the time to build the FunctionData table reading the logs in this thread and in
+    thread and process pools with that for the original row-wise construction for a
+    synthetic run directory with ntask tasks. The times to find the logs with glob and
+    function_data_logs are also compared.
+    Arguments:
+      ntask - Number of tasks.
+      nworker - Number of threads or processes in the pools.
+      workdir - Directory for the run directory. An existing run directory is reused.
+                If None, a temporary directory is used and removed at the end.
+      seed - Random number seed.
+      dbg - 0 for silent
+    Returns a dictionary of times in seconds indexed by method.
+    """
+    myname = 'bench_function_data'
+    tmpdir = None
+    if workdir is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        workdir = tmpdir.name
+    try:
+        rundir = os.path.join(workdir, f"fundata{ntask}-s{seed}")
+        if not os.path.exists(os.path.join(rundir, 'runinfo')):
+            make_rundir(rundir, ntask, nworker=256, perfstat=False, seed=seed)
+        prefix = rundir + '/'
+        times = {}
+        # Find the logs and their IDs with glob as done for a non-default pattern.
+        t0 = time.perf_counter()
+        fnams = sorted(glob.glob(prefix + 'runinfo/???/function_data/*/log'))
+        [log_ids(fnam) + (fnam,) for fnam in fnams]
+        times['find_glob'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        list(function_data_logs(prefix))
+        times['find_scandir'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        fdat = FunctionData(prefix)
+        times['columnar'] = time.perf_counter() - t0
+        for pool in ['thread', 'process']:
+            t0 = time.perf_counter()
+            FunctionData(prefix, pool=pool, nworker=nworker)
+            times[pool] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        rdat = function_data_rowwise(fnams)
+        times['rowwise'] = time.perf_counter() - t0
+    finally:
+        if tmpdir is not None: tmpdir.cleanup()
+    # The row-wise table is in path order.
+    rdat = rdat.astype(numpy.float64).sort_values('taskid', kind='stable')
+    same = numpy.array_equal(fdat.data.drop(columns=['run']).to_numpy(dtype=numpy.float64), rdat.to_numpy())
+    if dbg:
+        print(f"{myname}: {ntask} tasks")
+        for nam, tim in times.items():
+            tref = times['find_glob'] if nam.startswith('find_') else times['rowwise']
+            print(f"{myname}: {nam:>15}: {tim:10.4f} sec  speedup {tref/tim:8.1f}")
+        if not same: print(f"{myname}: WARNING: Tables differ.")
+    return times
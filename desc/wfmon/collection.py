@@ -0,0 +1,206 @@
+# collection.py
+#
+# David Adams
+# October 2026
+
+"""
+Read and fix the runs in many monitoring DBs in parallel and concatenate the tables.
+"""
+
+import os
+import sqlite3
+import time
+import urllib.parse
+import concurrent.futures
+import numpy
+import pandas
+from desc.wfmon import MonDbReader
+
+def db_run_ids(filename):
+    """Return the list of run IDs in the workflow table of monitoring DB filename."""
+    uri = 'file:' + urllib.parse.quote(os.path.abspath(filename)) + '?mode=ro'
+    con = sqlite3.connect(uri, uri=True)
+    try:
+        return [row[0] for row in con.execute("select run_id from workflow order by rowid")]
+    finally:
+        con.close()
+
+def _load_run(filename, run_id, reader_args):
+    """
+    Read and fix one run with MonDbReader and return a dictionary with the tables, the
+    reader data members saved in its cache and the stage table. This is run in the worker
+    processes so that only these results are sent back.
+    """
+    t0 = time.perf_counter()
+    try:
+        dbr = MonDbReader(filename, fix=True, run_id=run_id, **reader_args)
+        res = {nam: getattr(dbr, nam) for nam in MonDbReader.cache_members}
+        res['tables'] = dbr._tables
+        res['stages'] = dbr.stage_table()
+        if dbr._con is not None: dbr._con.close()
+    except Exception as exc:
+        res = {'error': f"{type(exc).__name__}: {exc}"}
+    res['wall'] = time.perf_counter() - t0
+    return res
+
+class MonDbCollection:
+
+    def __init__(self, filenames, run_ids=None, nproc=None, reader_args=None, dbg=0):
+        """
+        Reads and fixes each run in a list of monitoring DBs with MonDbReader and
+        concatenates the fixed tables. The runs are read in parallel in a process pool.
+        Arguments:
+          filenames: List of monitoring DB file names (or a single name).
+          run_ids: Run IDs to read. If None, all runs in each DB are read. Otherwise a list
+                   with a list of run IDs (or None for all) for each DB.
+          nproc: Number of processes. If None, one for each core available to this
+                 process. With 1, the runs are read in this process.
+          reader_args: Dictionary of additional MonDbReader constructor arguments, e.g.
+                       dict(dodelta=True, compact=True, access='immutable').
+          dbg: 0 for silent
+        Each run is assigned a global run index in the order of the DBs and then the runs in
+        each DB. In the concatenated tables (see table), column run_idx is replaced with the
+        global run index and column db_idx gives the index of the DB. Task indices are
+        replaced with global indices for the names in self.task_names. Times are relative to
+        the start of each run as in MonDbReader and the offsets are in self.t0s.
+        Runs that fail to read are reported and listed in self.errors.
+        """
+        myname = self.__class__.__name__ + "::ctor"
+        if isinstance(filenames, str): filenames = [filenames]
+        self.filenames = list(filenames)   # DB file names.
+        self.dbg = dbg
+        self.reader_args = {} if reader_args is None else dict(reader_args)
+        for nam in ['filename', 'fix', 'run_id']:
+            if nam in self.reader_args: raise Exception(f"{myname}: Reader argument {nam} is set by the collection.")
+        if run_ids is None: run_ids = len(self.filenames)*[None]
+        if len(run_ids) != len(self.filenames):
+            raise Exception(f"{myname}: Run ID list count {len(run_ids)} != DB count {len(self.filenames)}")
+        # Find the runs.
+        self.sources = []       # (db_idx, filename, run_id) for each run.
+        for idb, fnam in enumerate(self.filenames):
+            rids = db_run_ids(fnam) if run_ids[idb] is None else list(run_ids[idb])
+            if len(rids) > 1 and self.reader_args.get('cache', False):
+                raise Exception(f"{myname}: Cache cannot be used for DB {fnam} with {len(rids)} runs.")
+            for rid in rids:
+                self.sources.append((idb, fnam, rid))
+        self.nrun = len(self.sources)      # Number of runs.
+        if nproc is None:
+            nproc = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        self.nproc = nproc
+        self.errors = {}        # Error message for each run index that failed.
+        self.run_ids = []       # Run ID for each run index.
+        self.db_idxs = []       # DB index for each run index.
+        self.t0s = []           # Time offset (sec) for each run index.
+        self.workflow_time_ranges = []   # Time range in seconds for each run index.
+        self.task_names = []    # Task name for each global task index.
+        self.task_index_maps = []   # Array mapping the reader task index to the global one for each run.
+        self.task_logs = []     # Log file for each task in each run.
+        self.load_times = []    # Wall time (sec) to read and fix each run.
+        self._tables = {}
+        self._stages = None
+        if dbg: print(f"{myname}: Reading {self.nrun} runs from {len(self.filenames)} DBs with {self.nproc} processes.")
+        fnams = [src[1] for src in self.sources]
+        rids = [src[2] for src in self.sources]
+        rargs = self.nrun*[self.reader_args]
+        if self.nproc == 1 or self.nrun <= 1:
+            results = map(_load_run, fnams, rids, rargs)
+            self._add_results(results)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.nproc, self.nrun)) as pool:
+                # Map returns results in the order of the runs.
+                self._add_results(pool.map(_load_run, fnams, rids, rargs))
+        if dbg: print(f"{myname}: Read {self.nrun - len(self.errors)} runs with {len(self.errors)} errors.")
+
+    def _add_results(self, results):
+        """Record the results from _load_run for each run and concatenate the tables."""
+        myname = self.__class__.__name__ + "::ctor"
+        tabs = {}
+        aliases = {}
+        stages = []
+        for irun, res in enumerate(results):
+            idb, fnam, rid = self.sources[irun]
+            self.run_ids.append(rid)
+            self.db_idxs.append(idb)
+            self.load_times.append(res['wall'])
+            if 'error' in res:
+                print(f"{myname}: ERROR: Unable to read run {rid} from {fnam}: {res['error']}")
+                self.errors[irun] = res['error']
+                self.t0s.append(None)
+                self.workflow_time_ranges.append(None)
+                self.task_index_maps.append(numpy.zeros(0, dtype=numpy.int64))
+                self.task_logs.append([])
+                continue
+            if self.dbg >= 2: print(f"{myname}: Read run {irun} {rid} from {fnam} in {res['wall']:.2f} sec")
+            self.t0s.append(res['t0'])
+            self.workflow_time_ranges.append(res['workflow_time_ranges'][0])
+            self.task_logs.append(res['task_logs'])
+            # Map the task indices for this run to the global ones.
+            tidxs = []
+            for tnam in res['task_names']:
+                if tnam not in self.task_names: self.task_names.append(tnam)
+                tidxs.append(self.task_names.index(tnam))
+            tmap = numpy.array(tidxs, dtype=numpy.int64)
+            self.task_index_maps.append(tmap)
+            tnams = {}
+            for tnam, tab in res['tables'].items():
+                # Aliases, e.g. procsum, are set after concatenation.
+                if id(tab) in tnams:
+                    aliases[tnam] = tnams[id(tab)]
+                    continue
+                tnams[id(tab)] = tnam
+                if 'run_idx' in tab.columns:
+                    tab['run_idx'] = irun
+                else:
+                    tab.insert(0, 'run_idx', irun)
+                tab.insert(0, 'db_idx', idb)
+                if 'task_idx' in tab.columns:
+                    vals = tab['task_idx'].to_numpy(dtype=numpy.float64)
+                    good = ~numpy.isnan(vals) & (vals >= 0)
+                    gvals = numpy.full(len(vals), -1, dtype=numpy.int64)
+                    gvals[good] = tmap[vals[good].astype(numpy.int64)]
+                    tab['task_idx'] = gvals
+                tabs.setdefault(tnam, []).append(tab)
+            stab = res['stages'].copy()
+            stab.insert(0, 'run_idx', irun)
+            stab.insert(0, 'db_idx', idb)
+            stages.append(stab)
+        for tnam, tablist in tabs.items():
+            tab = pandas.concat(tablist, ignore_index=True)
+            # Categories differ between runs so the concatenated columns are rebuilt.
+            for cnam in tablist[0].columns:
+                if isinstance(tablist[0][cnam].dtype, pandas.CategoricalDtype) and not isinstance(tab[cnam].dtype, pandas.CategoricalDtype):
+                    tab[cnam] = tab[cnam].astype('category')
+            self._tables[tnam] = tab
+        for tnam, anam in aliases.items():
+            if tnam not in self._tables: self._tables[tnam] = self._tables[anam]
+        self._stages = pandas.concat(stages, ignore_index=True) if len(stages) else None
+
+    def __getitem__(self, tnam):
+        return self.table(tnam)
+
+    def __len__(self):
+        return self.nrun
+
+    def table_names(self):
+        """Return the names of the concatenated tables."""
+        return list(self._tables.keys())
+
+    def table(self, tnam):
+        """Return the concatenated table tnam or None if no run has that table."""
+        return self._tables.get(tnam)
+
+    def run_table(self):
+        """Return a dataframe with the DB index, file name, run ID, start time, task count and load time for each run."""
+        return pandas.DataFrame({
+            'db_idx': self.db_idxs,
+            'filename': [self.filenames[idb] for idb in self.db_idxs],
+            'run_id': self.run_ids,
+            't0': self.t0s,
+            'ntask': [len(logs) for logs in self.task_logs],
+            'load_time': self.load_times,
+            'error': [self.errors.get(irun) for irun in range(self.nrun)],
+        })
+
+    def stage_table(self):
+        """Return the stage tables (see MonDbReader.stage_table) for all runs with db_idx and run_idx."""
+        return self._stages
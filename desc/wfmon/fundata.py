@@ -9,55 +9,438 @@ Read parsl function_data into a DataFrame.
 
 import os
 import glob
+import pickle
+import concurrent.futures
+import numpy
 import pandas
+from desc.wfmon import __version__
+from desc.wfmon.stagetimer import StageTimer
+
+# Pattern for the function_data logs found by function_data_logs.
+default_pattern = 'runinfo/???/function_data/*/log'
+
+def _dir_number(name):
+    """Return the integer for a directory name of decimal digits, e.g. 0012, or None for other names."""
+    return int(name) if name.isascii() and name.isdigit() else None
+
+def log_ids(fnam):
+    """
+    Return (run, taskid) for log <rundir>/function_data/<taskid>/log.
+    The run is the number of the run directory (e.g. 0 for runinfo/000) or -1 if that is not
+    a number. The task ID is None if its directory name is not a number.
+    """
+    tdir = os.path.dirname(fnam)
+    run = _dir_number(os.path.basename(os.path.dirname(os.path.dirname(tdir))))
+    return -1 if run is None else run, _dir_number(os.path.basename(tdir))
+
+def function_data_logs(prefix="./", rundirs=None):
+    """
+    Generator of (run, taskid, path) for the function_data logs matching
+    <prefix>runinfo/???/function_data/*/log found with os.scandir.
+    Run directories are in numeric order and the logs for each run are in numeric order of
+    task ID so consumers can process the logs as they are found. Task directories whose
+    names are not numbers follow with taskid None. See log_ids for the run number.
+    The log is not checked to exist so that each is only opened (or stat'ed) when it is
+    read. A task directory without a log, or an entry that is not a directory, gives a
+    path that cannot be read.
+    If rundirs is not None, only the run directories in that list of names (e.g. '000') or
+    numbers are searched.
+    """
+    idir = os.path.join(prefix, 'runinfo')
+    try:
+        rents = [ent for ent in os.scandir(idir) if len(ent.name) == 3 and ent.name[0] != '.' and ent.is_dir()]
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    if rundirs is not None:
+        rnams = {rdir if isinstance(rdir, str) else f"{int(rdir):03d}" for rdir in rundirs}
+        rents = [ent for ent in rents if ent.name in rnams]
+    runs = [_dir_number(ent.name) for ent in rents]
+    for irun in sorted(range(len(rents)), key=lambda irun: (runs[irun] is None, runs[irun] or 0, rents[irun].name)):
+        try:
+            tents = [(ent.name, ent.path) for ent in os.scandir(os.path.join(rents[irun].path, 'function_data'))
+                     if ent.name[0] != '.']
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        run = -1 if runs[irun] is None else runs[irun]
+        # Sort the task directories with numeric names and then the others.
+        tnums = sorted((int(tnam), tnam, tpath) for tnam, tpath in tents if tnam.isascii() and tnam.isdigit())
+        tothers = sorted((None, tnam, tpath) for tnam, tpath in tents if not (tnam.isascii() and tnam.isdigit()))
+        for taskid, tnam, tpath in tnums + tothers:
+            yield run, taskid, tpath + os.sep + 'log'
+
+def read_function_data_log(fnam, taskid=None, dbg=0):
+    """
+    Read the function_data log fnam with lines "<time> <state>".
+    If taskid is None, the task ID is taken from the name of the directory holding the log.
+    Returns (taskid, states) where states is a dictionary of times indexed by the lower-case
+    state name. Lines that do not have two words are skipped.
+    """
+    myname = 'read_function_data_log'
+    if taskid is None:
+        taskid = log_ids(fnam)[1]
+        if taskid is None: raise Exception(f"Unable to extract task from path {fnam}")
+    if dbg >= 4: print(f"{myname}:     taskid: {taskid}")
+    states = {}
+    with open(fnam) as fin:
+        for line in fin:
+            wrds = line.split()
+            if len(wrds) == 2:
+                tim = float(wrds[0])
+                nam = wrds[1].lower()
+                states[nam] = tim
+                if dbg >= 4: print(f"{myname}:     {nam} : {tim}")
+    return taskid, states
+
+def _log_stat(fnam):
+    """Return (size, mtime_ns) for log fnam or None if it is not found."""
+    try:
+        fst = os.stat(fnam)
+    except OSError:
+        return None
+    return fst.st_size, fst.st_mtime_ns
+
+def _read_log_or_error(fnam, taskid=None, dbg=0):
+    """
+    Return (taskid, states, None, stat) from read_function_data_log and _log_stat (taken
+    before the read) or (None, None, message, stat) if it fails. The stat is None if the log
+    is not found.
+    """
+    fstat = _log_stat(fnam)
+    if fstat is None: return None, None, None, None
+    try:
+        return read_function_data_log(fnam, taskid, dbg) + (None, fstat)
+    except Exception as exc:
+        return None, None, str(exc), fstat
 
 class FunctionData:
 
-    def __init__(self, prefix="./", pattern='runinfo/???/function_data/*/log', dbg=0):
+    def __init__(self, prefix="./", pattern=default_pattern, pool=None, nworker=None,
+                 cache=False, rundirs=None, dbg=0):
         """
         Function data is extracted from files matching
         <prefix><pattern>/function_data/<taskid>/log
-        Result is in dataframe self.table.
+        With the default pattern, the files are found with function_data_logs and rundirs
+        may be used to select run directories. Otherwise they are found with glob.
+        Result is in dataframe self.data with columns taskid and run (int64, see log_ids) and
+        a float64 column holding the time for each state. The state columns are in order of
+        first appearance and the time is NaN for tasks whose log does not have the state.
+        Rows are ordered by run and task ID.
+        The logs are read
+          pool=None - in this thread.
+          pool='thread' - in a pool of nworker threads. Use this for file systems with slow
+                          opens, e.g. Lustre or GPFS.
+          pool='process' - in a pool of nworker processes. Use this if parsing is the limit.
+        If nworker is None, the executor default is used.
+        If cache is true, the parsed logs are saved in a manifest file (see manifest_name) and
+        only logs that are new or have changed size or modification time are read when the
+        same logs are read again. A string gives the manifest file name.
+        Call rescan() to update the table with the logs added or changed since it was built.
+        Logs that cannot be read are listed in self.errors as (file name, message).
+        The time for each stage (scandir or glob, stat and read) is in self.stage_timer. The
+        logs are only stat'ed before they are read if the manifest has entries to compare.
         """
         myname = 'FunctionData:ctor'
+        if rundirs is not None and pattern != default_pattern:
+            raise Exception(f"{myname}: Run directories can only be selected with the default pattern.")
+        self.prefix = prefix          # Prefix for the log pattern.
+        self.pattern = pattern        # Log file pattern.
+        self.rundirs = rundirs        # Run directories to search. If None, all are searched.
+        self.pool = pool              # Pool used to read the logs: None, thread or process.
+        self.nworker = nworker        # Number of threads or processes in the pool.
+        self.dbg = dbg
         self.data = None
-        patpat = prefix + pattern
-        fnams = glob.glob(patpat)
-        fnams.sort()
+        self.errors = []
+        self.manifest = {}            # (size, mtime_ns, taskid, states) for each parsed log indexed by path.
+        self.manifest_name = None     # Name of the manifest file if cached.
+        self.nread = 0                # Number of logs read in the last scan.
+        self.nreuse = 0               # Number of logs taken from the manifest in the last scan.
+        self.stage_timer = StageTimer({'class': self.__class__.__name__, 'prefix': prefix, 'pattern': pattern})
+        if cache:
+            self.manifest_name = cache if isinstance(cache, str) else os.path.join(prefix, 'function_data.wfmon', 'manifest.pkl')
+            self.load_manifest()
+        self.rescan()
+
+    def rescan(self):
+        """
+        Find the logs and rebuild the table reading only the logs that are not in the
+        manifest or have changed size or modification time since they were read.
+        Returns the number of logs read.
+        """
+        myname = 'FunctionData:rescan'
+        dbg = self.dbg
+        patpat = self.prefix + self.pattern
         if dbg: print(f"{myname}: Search pattern is {patpat}")
-        if dbg: print(f"{myname}: File count is {len(fnams)}")
-        nent = 0
-        for fnam in fnams:
-            if dbg >= 2: print(f"{myname}: Reading {fnam}")
-            errmsg = ''
-            nline = 0
-            fin = open(fnam)
-            stid = os.path.basename(os.path.dirname(fnam))
-            while len(stid) > 1 and stid[0] == '0': stid = stid[1:]
-            try:
-                taskid = int(stid)
-            except:
-                errmsg = f"Unable to extract task from path {fnam}"
-            if len(errmsg) == 0:
-                mymap = {'taskid':taskid}
-                if dbg >= 4: print(f"{myname}:     taskid: {taskid}")
-                for line in fin:
-                    wrds = line.rstrip().split()
-                    if len(wrds) == 2:
-                        tim = float(wrds[0])
-                        nam = wrds[1].lower()
-                        mymap[nam] = tim
-                        if dbg >= 4: print(f"{myname}:     {nam} : {tim}")
-                        nline += 1
-                    else:
-                        msg = f"Unexpected line {nline} in file {fnam}: line.rstrip()"
-            if len(errmsg):
-                print(f"{myname}: ERROR: {errmsg}")
-            else:
-                df = pandas.DataFrame(mymap, index=[nent])
-                if self.data is None:
-                    self.data = pandas.DataFrame(columns=mymap.keys(), index=range(len(fnams)))
-                self.data.loc[nent] = mymap
-                nent += 1
-            if dbg >= 3: print(f"{myname}:   Line read count: {nline}")
+        if self.pattern == default_pattern:
+            with self.stage_timer.stage('scandir', patpat) as rec:
+                logs = list(function_data_logs(self.prefix, self.rundirs))
+                rec['rows_out'] = len(logs)
+        else:
+            with self.stage_timer.stage('glob', patpat) as rec:
+                logs = [log_ids(fnam) + (fnam,) for fnam in sorted(glob.glob(patpat))]
+                rec['rows_out'] = len(logs)
+        if dbg: print(f"{myname}: File count is {len(logs)}")
+        # Find the logs that must be read. The size and modification time of each log are
+        # compared with the manifest only if it has entries. Otherwise all logs are read and
+        # these are taken when the log is read.
+        if len(self.manifest):
+            with self.stage_timer.stage('stat', patpat, len(logs)) as rec:
+                stats = dict(zip([log[2] for log in logs], self._stat_logs([log[2] for log in logs], self.pool, self.nworker)))
+                stats = {fnam: fstat for fnam, fstat in stats.items() if fstat is not None}
+                rlogs = [log for log in logs if log[2] in stats and self.manifest.get(log[2], (None, None))[0:2] != stats[log[2]]]
+                rec['rows_out'] = len(rlogs)
+        else:
+            stats = {}
+            rlogs = logs
+        rnams = [log[2] for log in rlogs]
+        with self.stage_timer.stage('read', patpat, len(rnams)) as rec:
+            changed = len(rnams) > 0 or len(set(self.manifest) - set(stats)) > 0
+            self.manifest = {fnam: ent for fnam, ent in self.manifest.items() if fnam in stats}
+            self.errors = []
+            nmiss = 0
+            results = self._read_logs(rnams, [log[1] for log in rlogs], self.pool, self.nworker, dbg)
+            for fnam, (taskid, states, errmsg, fstat) in zip(rnams, results):
+                if fstat is None:
+                    nmiss += 1
+                    self.manifest.pop(fnam, None)
+                    continue
+                if errmsg is not None:
+                    self.errors.append((fnam, errmsg))
+                    self.manifest.pop(fnam, None)
+                    continue
+                if dbg >= 3: print(f"{myname}:   Line read count for {fnam}: {len(states)}")
+                self.manifest[fnam] = fstat + (taskid, states)
+            if len(self.errors):
+                print(f"{myname}: WARNING: Unable to read {len(self.errors)} of {len(rnams)} logs. See self.errors.")
+            self.nread = len(rnams) - nmiss - len(self.errors)
+            self.nreuse = len(stats) - len(rlogs) if len(stats) else 0
+            if dbg: print(f"{myname}: Read {self.nread} logs and reused {self.nreuse}.")
+            # Accumulate the task IDs, runs and a list of times for each state.
+            taskids = []
+            runs = []
+            cols = {}
+            for run, taskid, fnam in logs:
+                ent = self.manifest.get(fnam)
+                if ent is not None:
+                    self._add_row(taskids, cols, ent[2], ent[3])
+                    runs.append(run)
+            self.data = self._build_table(taskids, runs, cols)
+            rec['rows_out'] = len(taskids)
+        if self.manifest_name is not None and changed: self.save_manifest()
+        return self.nread
+
+    def load_manifest(self):
+        """Read the manifest from file manifest_name. Returns True if it was read."""
+        myname = 'FunctionData:load_manifest'
+        if not os.path.exists(self.manifest_name): return False
+        with open(self.manifest_name, 'rb') as fin:
+            man = pickle.load(fin)
+        if man.get('version') != __version__:
+            if self.dbg: print(f"{myname}: Ignoring out-of-date manifest {self.manifest_name}")
+            return False
+        self.manifest = man['logs']
+        if self.dbg: print(f"{myname}: Read {len(self.manifest)} logs from {self.manifest_name}")
+        return True
 
+    def save_manifest(self):
+        """Write the manifest to file manifest_name. Returns 0 for success."""
+        myname = 'FunctionData:save_manifest'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifest_name)), exist_ok=True)
+            tmpnam = self.manifest_name + '.tmp'
+            with open(tmpnam, 'wb') as fout:
+                pickle.dump({'version': __version__, 'logs': self.manifest}, fout)
+            os.replace(tmpnam, self.manifest_name)
+        except OSError as exc:
+            print(f"{myname}: WARNING: Unable to write manifest {self.manifest_name}: {exc}")
+            return 1
+        if self.dbg: print(f"{myname}: Wrote {len(self.manifest)} logs to {self.manifest_name}")
+        return 0
+
+    @staticmethod
+    def _read_logs(fnams, taskids, pool, nworker, dbg):
+        """
+        Return an iterable over the _read_log_or_error results for the logs fnams with task IDs
+        taskids (None to take them from the path) in the same order.
+        """
+        myname = 'FunctionData:rescan'
+        if len(fnams) == 0: return []
+        if pool is None:
+            def read(fnam, taskid):
+                if dbg >= 2: print(f"{myname}: Reading {fnam}")
+                return _read_log_or_error(fnam, taskid, dbg)
+            return map(read, fnams, taskids)
+        if pool == 'thread':
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nworker) as exe:
+                return list(exe.map(_read_log_or_error, fnams, taskids))
+        if pool == 'process':
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nworker) as exe:
+                # Send the names in chunks to limit the interprocess overhead.
+                nproc = nworker if nworker is not None else os.cpu_count() or 1
+                return list(exe.map(_read_log_or_error, fnams, taskids, chunksize=max(1, len(fnams)//(4*nproc))))
+        raise Exception(f"{myname}: Invalid pool: {pool}")
+
+    @staticmethod
+    def _stat_logs(fnams, pool, nworker):
+        """
+        Return the _log_stat result for each of the logs fnams. These are evaluated in a pool
+        of nworker threads if pool is not None.
+        """
+        if pool is None or len(fnams) == 0: return [_log_stat(fnam) for fnam in fnams]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nworker) as exe:
+            return list(exe.map(_log_stat, fnams))
+
+    @staticmethod
+    def _add_row(taskids, cols, taskid, states):
+        """Append the task ID and state times for one log to taskids and the state columns cols."""
+        nent = len(taskids)
+        for nam in states:
+            if nam not in cols: cols[nam] = nent*[numpy.nan]
+        for nam, vals in cols.items():
+            vals.append(states.get(nam, numpy.nan))
+        taskids.append(taskid)
+
+    @staticmethod
+    def _build_table(taskids, runs, cols):
+        """Return the typed table for the accumulated task IDs, runs and state columns or None if there are none."""
+        if len(taskids) == 0: return None
+        tab = {'taskid': numpy.array(taskids, dtype=numpy.int64), 'run': numpy.array(runs, dtype=numpy.int64)}
+        for nam, vals in cols.items():
+            tab[nam] = numpy.array(vals, dtype=numpy.float64)
+        tab = pandas.DataFrame(tab)
+        # Order by run and task ID. Logs for the same task keep the order in which they were found.
+        order = numpy.lexsort((tab['taskid'].to_numpy(), tab['run'].to_numpy()))
+        if (order != numpy.arange(len(order))).any():
+            tab = tab.iloc[order].reset_index(drop=True)
+        return tab
+
+    def state_names(self):
+        """Return the names of the state columns of the table in the order they appear."""
+        if self.data is None: return []
+        return [cnam for cnam in self.data.columns if cnam not in ['taskid', 'run']]
+
+    # Columns from the MonDbReader task and try tables added to the table from join_mondb
+    # indexed by the new names. The function_data states fall between running and returned.
+    mondb_times_before = {'invoked': 'task_time_invoked', 'launched': 'task_try_time_launched',
+                          'running': 'task_try_time_running'}
+    mondb_times_after = {'returned': 'task_try_time_returned', 'result': 'task_time_returned'}
+
+    def join_mondb(self, dbr, runs=None):
+        """
+        Return a table with one row for each task in the fixed task table of MonDbReader dbr
+        holding the times of the task stages and the latencies between them. The columns are
+          run_idx, task_id, task_idx - From the task table.
+          try_id, ntry - ID of the last try for the task and the number of tries.
+          invoked, launched, running - Task invoke and last try launch and running times.
+          <state> - Time of each state in the function_data log.
+          returned, result - Last try return and task return times.
+          dt_<stage> - Time from the preceding stage to <stage> for each of the above
+                       stages after invoked, e.g. dt_launched = launched - invoked.
+        All times are in seconds relative to the same origin as the MonDbReader tables (t0s[0]).
+        The function_data run number for each run index is taken from the workflow rundir
+        or from the list runs if it is not None. An exception is raised if runs is None and
+        the rundir does not give a run number for every run. Use -1 in runs for runs without
+        function_data logs. Stage times are NaN if there is no record, e.g. no function_data
+        log for the task.
+        """
+        myname = 'FunctionData:join_mondb'
+        if 'tasks' not in dbr.fixed or 'times' not in dbr.fixed or 'try' not in dbr.fixed:
+            raise Exception(f"{myname}: The MonDbReader task, time and try fixes must be applied.")
+        tsk = dbr.table('task')
+        ttry = dbr.table('try')
+        nrun = dbr.nrun
+        if runs is None:
+            wkf = dbr.table('workflow')
+            runs = nrun*[-1]
+            if 'rundir' in wkf.columns:
+                for irun, rdir in zip(wkf['run_idx'], wkf['rundir']):
+                    if isinstance(rdir, str):
+                        irdir = _dir_number(os.path.basename(os.path.normpath(rdir)))
+                        if irdir is not None: runs[irun] = irdir
+            nomaps = [irun for irun in range(nrun) if runs[irun] < 0]
+            if len(nomaps):
+                raise Exception(f"{myname}: No function_data run number from the workflow rundir for run indices {nomaps}. Use runs=.")
+        if len(runs) != nrun: raise Exception(f"{myname}: Run count {len(runs)} != MonDbReader run count {nrun}.")
+        # Position of each task in the output is its offset in its run plus the task ID.
+        tsk_runs = tsk['run_idx'].to_numpy(dtype=numpy.int64)
+        tsk_ids = tsk['task_id'].to_numpy(dtype=numpy.int64)
+        counts = numpy.bincount(tsk_runs, minlength=nrun)
+        offs = numpy.concatenate([[0], numpy.cumsum(counts)])
+        ntsk = len(tsk)
+        def positions(run_idxs, task_ids):
+            """Return the positions for the run indices and task IDs or -1 if the task is not in the task table."""
+            good = (run_idxs >= 0) & (run_idxs < nrun)
+            irun = numpy.where(good, run_idxs, 0)
+            good &= (task_ids >= 0) & (task_ids < counts[irun])
+            return numpy.where(good, offs[irun] + task_ids, -1)
+        out = {
+            'run_idx': numpy.zeros(ntsk, dtype=numpy.int64),
+            'task_id': numpy.zeros(ntsk, dtype=numpy.int64),
+            'task_idx': numpy.zeros(ntsk, dtype=numpy.int64),
+        }
+        tpos = positions(tsk_runs, tsk_ids)
+        out['run_idx'][tpos] = tsk_runs
+        out['task_id'][tpos] = tsk_ids
+        out['task_idx'][tpos] = tsk['task_idx'].to_numpy(dtype=numpy.int64)
+        def take(pos, vals):
+            """Return an array with vals at positions pos (last value for repeated positions) and NaN elsewhere."""
+            col = numpy.full(ntsk, numpy.nan)
+            sel = pos >= 0
+            col[pos[sel]] = vals[sel]
+            return col
+        # Last try for each task.
+        try_pos = positions(ttry['run_idx'].to_numpy(dtype=numpy.int64), ttry['task_id'].to_numpy(dtype=numpy.int64))
+        try_ids = ttry['try_id'].to_numpy(dtype=numpy.int64)
+        order = numpy.lexsort((try_ids, try_pos))
+        last = order[numpy.append(try_pos[order][1:] != try_pos[order][:-1], True)] if len(order) else order
+        out['try_id'] = take(try_pos[last], try_ids[last].astype(numpy.float64))
+        out['ntry'] = numpy.bincount(try_pos[try_pos >= 0], minlength=ntsk)[0:ntsk]
+        stages = []
+        def add_mondb_times(times):
+            """Add the task or last try time columns with names and sources in dictionary times."""
+            for nam, cnam in times.items():
+                if cnam.startswith('task_time'):
+                    out[nam] = take(tpos, tsk[cnam].to_numpy(dtype=numpy.float64))
+                else:
+                    out[nam] = take(try_pos[last], ttry[cnam].to_numpy(dtype=numpy.float64)[last])
+                stages.append(nam)
+        add_mondb_times(self.mondb_times_before)
+        # Function data states.
+        fdat = self.data
+        if fdat is not None:
+            run_map = {run: irun for irun, run in enumerate(runs) if run is not None and run >= 0}
+            fd_runs = fdat['run'].to_numpy()
+            fd_ridx = numpy.array([run_map.get(run, -1) for run in fd_runs], dtype=numpy.int64) if len(fd_runs) else fd_runs
+            fd_pos = positions(fd_ridx, fdat['taskid'].to_numpy(dtype=numpy.int64))
+            t0 = dbr.t0s[0]
+            for nam in self.state_names():
+                out[nam] = take(fd_pos, fdat[nam].to_numpy(dtype=numpy.float64) - t0)
+                stages.append(nam)
+        add_mondb_times(self.mondb_times_after)
+        for nam1, nam2 in zip(stages[:-1], stages[1:]):
+            out['dt_' + nam2] = out[nam2] - out[nam1]
+        return pandas.DataFrame(out)
+
+    @staticmethod
+    def latency_summary(tab, percentiles=(50, 90, 99), task_names=None):
+        """
+        Return a table of latency percentiles for each task index and stage from a table
+        returned by join_mondb. The columns are task_idx, task_name (if task_names, e.g.
+        MonDbReader.task_names, is given), stage, count, mean and p<percentile> for each of
+        the percentiles. Rows for task_idx -1 summarize all tasks.
+        """
+        dtcols = [cnam for cnam in tab.columns if cnam.startswith('dt_')]
+        # One row for each task and stage. The stage is categorical to keep the column order.
+        lats = tab.melt(id_vars=['task_idx'], value_vars=dtcols, var_name='stage', value_name='dt')
+        lats['stage'] = pandas.Categorical(lats['stage'], categories=dtcols)
+        sums = []
+        for grp in [lats.groupby(['task_idx', 'stage'], observed=True)['dt'],
+                    lats.assign(task_idx=-1).groupby(['task_idx', 'stage'], observed=True)['dt']]:
+            stab = pandas.DataFrame({'count': grp.count(), 'mean': grp.mean()})
+            for pct in percentiles:
+                stab[f"p{pct:g}"] = grp.quantile(0.01*pct)
+            sums.append(stab)
+        summ = pandas.concat(sums).reset_index()
+        summ['stage'] = summ['stage'].astype(str).str[3:]
+        if task_names is not None:
+            summ.insert(1, 'task_name', [task_names[itsk] if itsk >= 0 else 'all' for itsk in summ['task_idx']])
+        return summ
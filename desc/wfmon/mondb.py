@@ -8,13 +8,20 @@
 import pandas
 import numpy
 import sys
+import os
+import pickle
+import urllib.parse
 import datetime
 from IPython.display import display
+from desc.wfmon import __version__
+from desc.wfmon.stagetimer import StageTimer, staged
 
 class MonDbReader:
     filename = "monitoring.db"
 
-    def __init__(self, filename ='./monitoring.db', fix=True, dodelta=False, run_id=None, dbg=0):
+    def __init__(self, filename ='./monitoring.db', fix=True, dodelta=False, run_id=None,
+                 lazy=False, columns=None, cache=False, chunksize=None, procsum_backend='pandas',
+                 compact=False, access='ro', index_copy=False, dbg=0):
         """
         MuonDbReader provides access to a parsl monitoring database which has information
         about workflows and their tasks including start and stop times and process information.
@@ -22,6 +29,30 @@ class MonDbReader:
           filename: Name of the MySQL file holding the minotoring data.
                fix: if True, the tables are "fixed".
                dodelta: if True, deltas are evaluated when the procsum table is constructed.
+               run_id: If not None, only rows with this run ID are read.
+               lazy: if True, each table is read from the DB on first access.
+               columns: Optional dictionary of column lists indexed by table name. Only those
+                        columns (plus any of run_id, task_id and try_id) are read for the
+                        listed tables. If fix is True, the columns used by fix (see
+                        fix_columns) are added.
+               cache: if True and fix is True, the fixed tables are read from the cache
+                      directory <filename>.wfmon if it is valid for this DB file and package
+                      version. Otherwise they are built and written there.
+               chunksize: If not None, procsum without deltas is built reading the resource
+                          table in chunks of this many rows. With lazy=True, the full
+                          resource table is then never held in memory.
+               procsum_backend: Backend used to build procsum without deltas:
+                                pandas - Resource table is read and binned with pandas.
+                                sql - Binning is done in the DB and only the bins are read.
+               compact: if True and fix is True, table columns are converted to types that use
+                        less memory after fixing. See compact().
+               access: How the DB file is opened:
+                         rw - Read-write as with sqlite3.connect(filename).
+                         ro - Read-only. The DB may be written by another process (parsl).
+                         immutable - Read-only without locking. The DB must not change while
+                                     it is open.
+               index_copy: if True, the DB is read from a copy in the cache directory that has
+                           indexes for the per-task and time queries. See update_index_copy().
                dbg: Debugging level:
                       0 - Quiet.
                       1 - Single line indicating methods that are run plus warning messages.
@@ -38,6 +69,8 @@ class MonDbReader:
         self.task_name_counts = []      # List of the number tasks for each task index.
         self.taskIndexFromName = {}     # Task index for each task name.
         self.task_index = []            # Task index for each run index and task ID.
+        self._task_index_lookup = numpy.zeros(0, dtype=numpy.int64)  # Task index for all runs and task IDs.
+        self._task_index_offsets = numpy.zeros(1, dtype=numpy.int64)  # Offset in the above for each run.
         self.task_logs = []             # Log file for task and try
         self.fixed = []                 # List of properties that have been fixed: workflows, times, ...
         self.remove_counts = {}         # Number of rows removed from each table.
@@ -45,35 +78,62 @@ class MonDbReader:
         self.t0s = []                   # Time offset (sec) for each run.
         self.monitoring_interval = None
         self.taskprocs = [[], []]       # Dictionary of nodelta,delta taskproc tables for each run index.
+        self._taskproc_tables = [None, None]  # Nodelta,delta taskproc tables for all tasks.
+        self._task_groups = {}          # Task group index for each table. See task_group_index.
+        self._taskproc_found = None     # Flag for each task in the taskproc tables that a sampling offset was found.
+        self._try_status = None         # Status counts and times for each try. See _status_counts.
         self._taskcount_delt = 0        # Time spacing for the task count tables.
         self._taskcounts = []           # Run-indexed array of task-indexed arrays of time:state dfs.
+        self._procsum_interp_delt = None  # Grid spacing for the interpolated procsum table.
+        self._time_orders = {}          # Time-ordered row positions for each table and time column.
         self._con = None
-        self._tables = {}
-        self.nwarnNoOffset = 0
+        self._tables = {}               # Tables read into memory indexed by name.
+        self._db_table_names = []       # Names of the tables in the DB.
+        self._run_id = None             # Run ID used to select rows.
+        self._rowid_max = {}            # Largest SQLite rowid read for each table.
+        self.lazy = lazy                # If true, tables are read on first access.
+        self.select_columns = {} if columns is None else {tnam: list(cnams) for tnam, cnams in columns.items()}  # Columns read for each table.
+        self.nwarnNoOffset = 0          # Number of tasks for which no sampling offset was found.
         self._chain_prompt_count = None # Number of worker chains that start before any tries end
         self._chain_late_count = None   # Number of worker chains that start after a try has ended
         self.select_run_ids = []
+        self._dodelta = dodelta         # Delta flag used in fix.
+        self._request_run_id = run_id   # Run ID requested in the constructor.
+        self.chunksize = chunksize      # Row count for chunked reading of the resource table.
+        self.procsum_backend = procsum_backend  # Backend for procsum without deltas: pandas or sql.
+        self._compact = compact         # Compact flag used in the constructor.
+        self._memory_before = {}        # Memory (bytes) used by each table before compact.
+        self.access = access            # DB access mode: rw, ro or immutable.
+        self.index_copy = index_copy    # If true, the DB is read from the indexed copy.
+        # Timing of the processing stages. See stage_table.
+        self.stage_timer = StageTimer({'class': self.__class__.__name__, 'filename': filename, 'version': __version__})
+        self._refresh_stage_start = None  # Number of stage records before the first refresh.
 
         """Construct from the path to the monitoring DB file [monitoring.db]."""
         if len(filename): self.filename = filename
+        if fix: self._add_fix_columns(dodelta)
+        if fix and cache:
+            if self.load_cache(): return
         self._connect(run_id)
         if fix: self.fix(dodelta)
+        if fix and compact: self.compact()
+        if fix and cache and 'runs' in self.fixed: self.save_cache()
 
     def __getitem__(self, tnam):
         return self.table(tnam, 0)
 
     def __len__(self):
         """len(obj) returns the number of tables."""
-        return len(self._tables)
+        return len(self.table_names())
 
+    @staged('connect', rows_out=lambda self, res: self.loaded_row_count())
     def _connect(self, run_id=None, reconnect=False):
         """Connect to DB and read tables (if needed) and return connection string."""
         myname = self.__class__.__name__ + "::_connect"
         if self._con is None or reconnect:
-           import sqlite3
            self._tables = {}
            try:
-               self._con = sqlite3.connect(self.filename)
+               self._con = self._open_db()
            except:
                print(f"""{myname}: ERROR: Unable to open file {self.filename}""")
                print(sys.exc_info()[1])
@@ -102,15 +162,272 @@ class MonDbReader:
                    if nwk > 1:
                        print(f"{myname}: The full list is at self.select_run_ids")
                        return
-           tnams = list(pandas.read_sql_query("select name from sqlite_master where type='table'", self._con)['name'])
-           for tnam in tnams:
-               qry = f"select * from {tnam}"
-               if run_id is not None:
-                   qry += f" where run_id='{run_id}'"
-               self._tables[tnam] = pandas.read_sql_query(qry, self._con)
+           self._run_id = run_id
+           self._db_table_names = self._read_table_names()
+           for tnam in self._db_table_names:
                self.remove_counts[tnam] = 0
+               if not self.lazy:
+                   self._tables[tnam] = self._read_table(tnam)
         return self._con       
 
+    # Bytes of the DB file that SQLite may map into memory.
+    sqlite_mmap_size = 2**30
+    # Size (KiB) of the SQLite page cache.
+    sqlite_cache_kib = 2**18
+    # Indexes added to the indexed copy of the DB.
+    index_columns = {
+        'resource': [['run_id', 'task_id', 'try_id', 'timestamp'], ['run_id', 'timestamp']],
+        'status': [['run_id', 'task_id', 'try_id', 'timestamp'], ['run_id', 'timestamp']],
+        'try': [['run_id', 'task_id', 'try_id']],
+    }
+
+    def _sqlite_connect(self, fnam, access):
+        """Open SQLite DB fnam with access rw, ro or immutable."""
+        import sqlite3
+        if access == 'rw': return sqlite3.connect(fnam)
+        if access not in ['ro', 'immutable']:
+            raise Exception(f"{self.__class__.__name__}::_sqlite_connect: Invalid access: {access}")
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(fnam)) + '?mode=ro'
+        if access == 'immutable': uri += '&immutable=1'
+        return sqlite3.connect(uri, uri=True)
+
+    def _open_db(self):
+        """Return a connection to the DB (or its indexed copy) with the access mode and pragmas for this reader."""
+        fnam = self.filename
+        if self.index_copy: fnam = self.update_index_copy()
+        con = self._sqlite_connect(fnam, self.access)
+        con.execute(f"pragma mmap_size={int(self.sqlite_mmap_size)}")
+        con.execute(f"pragma cache_size={-int(self.sqlite_cache_kib)}")
+        if self.access != 'rw': con.execute("pragma query_only=1")
+        return con
+
+    def _read_table_names(self):
+        """Return the names of the monitoring tables in the DB."""
+        qry = "select name from sqlite_master where type='table' and name not like 'sqlite_%' and name not like 'wfmon_%'"
+        return list(pandas.read_sql_query(qry, self._con)['name'])
+
+    def index_copy_name(self):
+        """Return the name of the indexed copy of the DB."""
+        return os.path.join(self.cache_dir(), 'indexed.db')
+
+    def update_index_copy(self):
+        """
+        Create or update the copy of the DB in the cache directory that has the indexes
+        in index_columns. These let SQLite find the rows for a task or a time range without
+        scanning the full tables. Rows added to the DB since the copy was made are copied
+        (workflow, task and try are copied in full because they are updated in place) so the
+        copy can be used with refresh. The copy is made with the SQLite backup API and so is
+        consistent even if parsl is writing the DB.
+        Returns the name of the copy.
+        """
+        myname = self.__class__.__name__ + "::update_index_copy"
+        fnam = self.index_copy_name()
+        fst = os.stat(self.filename)
+        key = (fst.st_size, fst.st_mtime)
+        src = self._sqlite_connect(self.filename, 'ro')
+        srcnames = list(pandas.read_sql_query("select name from sqlite_master where type='table'", src)['name'])
+        src.close()
+        if os.path.exists(fnam):
+            # Open with a URI so the DB can be attached read-only.
+            import sqlite3
+            con = sqlite3.connect('file:' + urllib.parse.quote(os.path.abspath(fnam)) + '?mode=rw', uri=True)
+            try:
+                oldkey = con.execute("select size, mtime from wfmon_source").fetchone()
+                names = [row[0] for row in con.execute("select name from sqlite_master where type='table'")]
+            except Exception:
+                oldkey = None
+            if oldkey is not None and tuple(oldkey) == key:
+                con.close()
+                return fnam
+            if oldkey is not None and all(tnam in names for tnam in srcnames):
+                if self.dbg: print(f"{myname}: Updating {fnam}")
+                con.execute("attach database ? as src", ['file:' + urllib.parse.quote(os.path.abspath(self.filename)) + '?mode=ro'])
+                for tnam in srcnames:
+                    if tnam[0:7] == 'sqlite_': continue
+                    cols = ', '.join(f'"{row[1]}"' for row in con.execute(f"pragma src.table_info('{tnam}')"))
+                    if tnam in self.refresh_full_tables:
+                        con.execute(f'delete from main."{tnam}"')
+                        con.execute(f'insert into main."{tnam}" (rowid, {cols}) select rowid, {cols} from src."{tnam}"')
+                    else:
+                        con.execute(f'insert into main."{tnam}" (rowid, {cols}) select rowid, {cols} from src."{tnam}"'
+                                    f' where rowid > (select coalesce(max(rowid), 0) from main."{tnam}")')
+                con.execute("update wfmon_source set size=?, mtime=?", key)
+                con.commit()
+                con.execute("detach database src")
+                con.close()
+                return fnam
+            con.close()
+        if self.dbg: print(f"{myname}: Creating {fnam}")
+        os.makedirs(self.cache_dir(), exist_ok=True)
+        tmpnam = fnam + '.tmp'
+        if os.path.exists(tmpnam): os.remove(tmpnam)
+        src = self._sqlite_connect(self.filename, 'ro')
+        con = self._sqlite_connect(tmpnam, 'rw')
+        src.backup(con)
+        src.close()
+        for tnam, icols in self.index_columns.items():
+            if tnam not in srcnames: continue
+            dbcols = [row[1] for row in con.execute(f"pragma table_info('{tnam}')")]
+            for cols in icols:
+                if not all(cnam in dbcols for cnam in cols): continue
+                inam = 'wfmon_' + tnam + '_' + '_'.join(cols)
+                con.execute(f'create index if not exists "{inam}" on "{tnam}" ({", ".join(cols)})')
+        con.execute("create table wfmon_source (size integer, mtime real)")
+        con.execute("insert into wfmon_source values (?, ?)", key)
+        con.execute("analyze")
+        con.commit()
+        con.close()
+        os.replace(tmpnam, fnam)
+        return fnam
+
+    @staged('read', label=lambda self, tnam, *args, **kwargs: tnam, rows_out=lambda self, res: len(res))
+    def _read_table(self, tnam, rowid_min=None, where=None, wparams=()):
+        """
+        Read table tnam from the DB keeping the selected columns and rows for the selected run.
+        If rowid_min is not None, only rows with larger SQLite rowid are read.
+        If where is not None, only rows satisfying that SQL condition with parameters wparams
+        are read and the table is not recorded as read.
+        Any fixes already applied to the other tables are applied to the new table.
+        """
+        myname = self.__class__.__name__ + "::_read_table"
+        dbcols = list(pandas.read_sql_query(f"pragma table_info('{tnam}')", self._con)['name'])
+        scol = '*'
+        if tnam in self.select_columns:
+            cols = [cnam for cnam in ['run_id', 'task_id', 'try_id'] if cnam in dbcols]
+            for cnam in self.select_columns[tnam]:
+                if cnam not in dbcols: raise Exception(f"{myname}: Column {cnam} not found in table {tnam}.")
+                if cnam not in cols: cols.append(cnam)
+            scol = ', '.join(f'"{cnam}"' for cnam in cols)
+        # The rowid is read to record the last row read.
+        qry = f"select rowid as _wfmon_rowid, {scol} from {tnam}"
+        conds = []
+        params = []
+        if self._run_id is not None and 'run_id' in dbcols:
+            conds.append("run_id=?")
+            params.append(self._run_id)
+        if rowid_min is not None:
+            conds.append("rowid>?")
+            params.append(int(rowid_min))
+        if where is not None:
+            conds.append(f"({where})")
+            params += list(wparams)
+        if len(conds): qry += " where " + " and ".join(conds)
+        if self.dbg >= 2: print(f"""{myname}: Reading table {tnam}: {qry}""")
+        tab = pandas.read_sql_query(qry, self._con, params=params)
+        if where is None:
+            if len(tab):
+                self._rowid_max[tnam] = int(tab['_wfmon_rowid'].max())
+            elif rowid_min is None:
+                self._rowid_max[tnam] = 0
+            if rowid_min is None: self.remove_counts[tnam] = 0
+        # An index scan may return rows out of table order.
+        if where is not None: tab.sort_values('_wfmon_rowid', inplace=True, ignore_index=True)
+        tab.drop(columns=['_wfmon_rowid'], inplace=True)
+        if 'runs' in self.fixed: self._fix_runs_table(tnam, tab)
+        if 'workflows' in self.fixed and tnam == 'workflow': self._fix_workflows_table(tab)
+        if 'times' in self.fixed: self._fix_times_table(tnam, tab)
+        if 'tasks' in self.fixed and tnam != 'task': self._fix_tasks_table(tnam, tab)
+        if 'compact' in self.fixed: self._compact_table(tnam, tab)
+        return tab
+
+    # Data members saved in the cache in addition to the tables.
+    cache_members = [
+        'nrun', 'workflow_names', 'workflow_time_ranges', 'run_ids', 'task_names',
+        'task_name_counts', 'taskIndexFromName', 'task_index', '_task_index_lookup',
+        '_task_index_offsets', 'task_logs', 'fixed', 'remove_counts', 't0', 't0s',
+        'monitoring_interval', 'nwarnNoOffset', 'select_run_ids', '_db_table_names', '_run_id',
+        '_rowid_max', '_memory_before', '_try_status',
+    ]
+
+    def cache_dir(self):
+        """Return the name of the directory holding the cached tables."""
+        return self.filename + '.wfmon'
+
+    def _cache_key(self):
+        """Return the dictionary that identifies the DB and options used to build the cache."""
+        fst = os.stat(self.filename)
+        return {
+            'filename': os.path.abspath(self.filename),
+            'size': fst.st_size,
+            'mtime': fst.st_mtime,
+            'version': __version__,
+            'run_id': self._request_run_id,
+            'columns': self.select_columns,
+            'dodelta': self._dodelta,
+            'compact': self._compact,
+        }
+
+    def save_cache(self):
+        """
+        Write the tables in memory and the reader data to the cache directory.
+        Returns 0 for success.
+        """
+        myname = self.__class__.__name__ + "::save_cache"
+        cdir = self.cache_dir()
+        try:
+            os.makedirs(cdir, exist_ok=True)
+            # Remove the metadata first so a partial write is not used.
+            mfnam = os.path.join(cdir, 'meta.pkl')
+            if os.path.exists(mfnam): os.remove(mfnam)
+            for fnam in os.listdir(cdir):
+                if fnam.endswith('.tab.pkl'): os.remove(os.path.join(cdir, fnam))
+            # Tables such as procsum that refer to another table are recorded as aliases.
+            tnams = {}
+            aliases = {}
+            for tnam, tab in self._tables.items():
+                if id(tab) in tnams:
+                    aliases[tnam] = tnams[id(tab)]
+                    continue
+                tnams[id(tab)] = tnam
+                tab.to_pickle(os.path.join(cdir, tnam + '.tab.pkl'))
+            meta = {
+                'key': self._cache_key(),
+                'tables': list(tnams.values()),
+                'aliases': aliases,
+                'members': {nam: getattr(self, nam) for nam in self.cache_members},
+            }
+            with open(mfnam, 'wb') as fout:
+                pickle.dump(meta, fout)
+        except OSError:
+            print(f"{myname}: WARNING: Unable to write cache {cdir}")
+            print(sys.exc_info()[1])
+            return 1
+        if self.dbg: print(f"{myname}: Wrote {len(self._tables)} tables to {cdir}")
+        return 0
+
+    @staged('load_cache', rows_out=lambda self, res: self.loaded_row_count())
+    def load_cache(self):
+        """
+        Read the tables and reader data from the cache directory if it is valid for the
+        current DB file, options and package version.
+        Returns True if the cache was used.
+        """
+        myname = self.__class__.__name__ + "::load_cache"
+        cdir = self.cache_dir()
+        mfnam = os.path.join(cdir, 'meta.pkl')
+        if not os.path.exists(mfnam) or not os.path.exists(self.filename): return False
+        with open(mfnam, 'rb') as fin:
+            meta = pickle.load(fin)
+        if meta['key'] != self._cache_key():
+            if self.dbg: print(f"{myname}: Ignoring out-of-date cache {cdir}")
+            return False
+        for nam, val in meta['members'].items():
+            setattr(self, nam, val)
+        self._tables = {}
+        for tnam in meta['tables']:
+            self._tables[tnam] = pandas.read_pickle(os.path.join(cdir, tnam + '.tab.pkl'))
+        for tnam, anam in meta.get('aliases', {}).items():
+            self._tables[tnam] = self._tables[anam]
+        for itp in range(2):
+            self.taskprocs[itp] = [{} for irun in range(len(self.workflow_time_ranges))]
+        # Tables not in the cache are read (and fixed) from the DB.
+        self._con = self._open_db()
+        if not self.lazy:
+            for tnam in self._db_table_names:
+                self.table(tnam)
+        if self.dbg: print(f"{myname}: Read {len(meta['tables'])} tables from {cdir}")
+        return True
+
     @staticmethod
     def time_from_string(stim):
         """Convert DB time string to int holding unix time."""
@@ -127,6 +444,35 @@ class MonDbReader:
             tim = tim + float('0.' + stimarr[1])
         return tim
 
+    @staticmethod
+    def times_from_strings(stims):
+        """
+        Convert a series of DB time strings to float unix times.
+        Values are the same as those from time_from_string but the parsing is done
+        for the whole column at once. None (or NaN) is returned as NaN.
+        """
+        stims = pandas.Series(stims, dtype=object)
+        tims = numpy.full(len(stims), numpy.nan)
+        isval = stims.notna().to_numpy()
+        if not isval.any(): return pandas.Series(tims, index=stims.index)
+        sarr = stims[isval].str.split('.', n=1, expand=True)
+        # Seconds since the epoch treating the date and time as UTC.
+        dtims = pandas.to_datetime(sarr[0], format='%Y-%m-%d %H:%M:%S')
+        utims = (dtims - pandas.Timestamp(1970, 1, 1)).dt.total_seconds().to_numpy()
+        # Add the local time offset as datetime.timestamp() does. This is constant within a minute.
+        mins = numpy.floor(utims/60.0)
+        umins, imins = numpy.unique(mins, return_inverse=True)
+        offs = numpy.array([(datetime.datetime(1970, 1, 1) + datetime.timedelta(minutes=umin)).timestamp() - 60.0*umin
+                            for umin in umins])
+        vals = utims + offs[imins.reshape(-1)]
+        # Add the fractional seconds. Integer division reproduces float('0.' + digits).
+        if sarr.shape[1] > 1:
+            sfrac = sarr[1].fillna('0')
+            fracs = pandas.to_numeric(sfrac).to_numpy()/numpy.power(10.0, sfrac.str.len().to_numpy())
+            vals = vals + fracs
+        tims[isval] = vals
+        return pandas.Series(tims, index=stims.index)
+
     @staticmethod
     def string_from_time(itim):
         """Convert unix time to DB time string."""
@@ -143,27 +489,35 @@ class MonDbReader:
         return None
 
     def table_names(self):
-        """Return the table names."""
+        """Return the table names including those not yet read in lazy mode."""
+        return self._db_table_names + [tnam for tnam in self._tables if tnam not in self._db_table_names]
+
+    def loaded_table_names(self):
+        """Return the names of the tables that have been read into memory."""
         return list(self._tables.keys())
 
     def tables(self, lev=0):
         """Fetch the dictionary of all tables or display info about the tables.
           lev = 0: Return table distionary.
-          lev = 1: Display table names.
+          lev = 1: Display table names, sizes and memory use (before and after compact).
           lev = 2: Columns are displayed.
           lev = 3: Columns and content are displayed.
+        In lazy mode, this reads all the tables.
         """
+        for tnam in self.table_names(): self.table(tnam)
         if lev > 0:
             print(f"""DB {self.filename} has {len(self._tables)} tables""")
         line = '*******************************************************'
         add_closing_line = False
-        if lev==1: print(f"{'Table':>15}{'Nrow':>10}{'Ncol':>10}")
+        if lev==1: print(f"{'Table':>15}{'Nrow':>10}{'Ncol':>10}{'MB':>10}{'MB before':>12}")
         for tnam in self.table_names():
             if lev == 1:
                 tab = self._tables[tnam]
                 nrow = len(tab.index)
                 ncol = len(tab.columns)
-                print(f"{tnam:>15}{nrow:>10}{ncol:>10}")
+                mem = self.table_memory(tnam)/1.e6
+                smem = f"{self._memory_before[tnam]/1.e6:12.3f}" if tnam in self._memory_before else ''
+                print(f"{tnam:>15}{nrow:>10}{ncol:>10}{mem:10.3f}{smem}")
             elif lev > 1:
                 print(line)
                 add_closing_line = True
@@ -171,6 +525,91 @@ class MonDbReader:
         if add_closing_line: print(line)
         if lev==0: return self._tables
 
+    def loaded_row_count(self):
+        """Return the total number of rows in the tables that have been read or built."""
+        tabs = {id(tab): tab for tab in self._tables.values()}
+        return sum(len(tab) for tab in tabs.values())
+
+    def stage_table(self):
+        """
+        Return a dataframe with the wall time, CPU time, peak memory growth and row counts
+        for each stage (read of a table, fix step, ...) run so far. See StageTimer.
+        Use self.stage_timer.to_json(fnam) to write the records to a file.
+        """
+        return self.stage_timer.table()
+
+    def table_memory(self, tnam):
+        """Return the memory in bytes used by table tnam including the content of strings."""
+        tab = self._tables.get(tnam)
+        if tab is None: return 0
+        return int(tab.memory_usage(index=True, deep=True).sum())
+
+    # In compact mode, object columns with at most this fraction of distinct values
+    # are made categorical.
+    compact_category_fraction = 0.5
+    # In compact mode, float columns for process metrics are made float32 if the largest
+    # relative change is at most this. The cumulative counters in _fix_delta_columns are
+    # kept float64 because rounding them would change their differences.
+    compact_float_rtol = 1.e-6
+
+    @staged('compact', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
+    def compact(self):
+        """
+        Convert the columns of the tables in memory (and any read later) to types that
+        use less memory:
+          Integer columns (IDs, indices, counts) with values in range are made int32.
+          Float process metrics (psutil_*) are made float32 where that is precise enough.
+          The cumulative counters (CPU times, disk read and write, ...) are kept float64.
+          Object and string columns with repeated strings (task_status_name, hostname, ...) are
+          made categorical.
+        Times are kept as float64. Use tables(1) to see the memory before and after.
+        """
+        myname = self.__class__.__name__ + "::compact"
+        if 'compact' in self.fixed:
+            if self.dbg: print(f"""{myname}: Tables are already compact.""")
+            return
+        if self.dbg: print(f"""{myname}: Compacting tables.""")
+        done = {}
+        for tnam in self.loaded_table_names():
+            tab = self._tables[tnam]
+            # Tables such as procsum may refer to another table.
+            if id(tab) in done:
+                self._memory_before[tnam] = self._memory_before[done[id(tab)]]
+                continue
+            self._compact_table(tnam, tab)
+            done[id(tab)] = tnam
+        self._task_groups = {}
+        self.fixed.append('compact')
+
+    def _compact_table(self, tnam, tab):
+        """Convert the columns of table tab in place to types that use less memory."""
+        myname = self.__class__.__name__ + "::compact"
+        if tnam not in self._memory_before:
+            self._memory_before[tnam] = int(tab.memory_usage(index=True, deep=True).sum())
+        i32 = numpy.iinfo(numpy.int32)
+        for cnam in tab.columns:
+            col = tab[cnam]
+            newcol = None
+            if pandas.api.types.is_integer_dtype(col.dtype) and col.dtype.itemsize > 4:
+                if len(col) == 0 or (col.min() >= i32.min and col.max() <= i32.max):
+                    newcol = col.astype(numpy.int32)
+            elif col.dtype == numpy.float64 and cnam[0:7] == 'psutil_' and cnam not in self._fix_delta_columns:
+                vals = col.to_numpy()
+                with numpy.errstate(over='ignore', invalid='ignore'):
+                    newvals = vals.astype(numpy.float32)
+                    difs = numpy.abs(newvals.astype(numpy.float64) - vals)
+                    ok = numpy.all((difs <= self.compact_float_rtol*numpy.abs(vals)) | (numpy.isnan(vals) & numpy.isnan(newvals)))
+                if ok: newcol = pandas.Series(newvals, index=tab.index)
+            elif (pandas.api.types.is_object_dtype(col.dtype) or pandas.api.types.is_string_dtype(col.dtype)) and len(col):
+                nval = col.nunique(dropna=False)
+                if nval <= self.compact_category_fraction*len(col) and col.dropna().map(lambda val: isinstance(val, str)).all():
+                    newcol = col.astype('category')
+            if newcol is not None:
+                if self.dbg >= 3: print(f"""{myname}: Converting {tnam}.{cnam} from {col.dtype} to {newcol.dtype}.""")
+                tab[cnam] = newcol
+        if self.dbg >= 2:
+            print(f"""{myname}: Table {tnam} memory reduced from {self._memory_before[tnam]} to {self.table_memory(tnam)} bytes.""")
+
     def table(self, tnam, lev=0):
         """
         Fetch table tnam or display info about it according to lev.
@@ -178,7 +617,10 @@ class MonDbReader:
         lev = 1: Size or message shown if table does not exist.
         lev = 2: Columns are displayed.
         lev = 3: Columns and content are displayed.
+        In lazy mode, the table is read from the DB on first access.
         """
+        if tnam not in self._tables and tnam in self._db_table_names:
+            self._tables[tnam] = self._read_table(tnam)
         if tnam not in self._tables:
             if lev > 0:
                 print(f"""Table {tnam} does not exist.""")
@@ -195,6 +637,7 @@ class MonDbReader:
         if lev > 2:
             display(tab)
 
+    @staged('fix_runs', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
     def fix_runs(self):
         """Replace run IDs with indices. Drop rows for IDs that dot not appear in task table."""
         myname = self.__class__.__name__ + "::fix_runs"
@@ -212,25 +655,30 @@ class MonDbReader:
         if col not in cols: raise Exception(f"{myname}: Column {col} not found in table {tnam}.")
         self.run_ids = list(dict.fromkeys(self[tnam][col]))  # Removes duplicates and maintains order.
         if len(self.run_ids) == 0: raise Exception(f"{myname}: No run IDs found in column {col} of table {tnam}.")
+        for tnam in self.loaded_table_names():
+            self._fix_runs_table(tnam, self.table(tnam))
+        self.fixed.append('runs')
+
+    def _fix_runs_table(self, tnam, tab):
+        """Replace run IDs with indices in table tab. Drop rows for IDs that do not appear in task table."""
+        col = 'run_id'
+        if col not in tab.columns: return
         nrid = len(self.run_ids)
         runIdToIndex = {}
         for idx in range(nrid):
             runIdToIndex[self.run_ids[idx]] = str(idx)
-        for tnam in self.table_names():
-            tab = self.table(tnam)
-            if 'run_id' not in tab.columns: continue
-            nrow = len(tab)
-            # Remove rows with run_id not in task.
-            qry = col + ' in ' + str(self.run_ids)
-            tab.query(qry, inplace=True)
-            nrem = nrow - len(tab)
-            if nrem > 0:
-                self.remove_counts[tnam] += nrem
-                tab.reset_index(inplace=True)
-            tab['run_idx'] = pandas.to_numeric(tab[col].replace(runIdToIndex))
-            tab.drop(columns=[col], inplace=True)
-        self.fixed.append('runs')
+        nrow = len(tab)
+        # Remove rows with run_id not in task.
+        qry = col + ' in ' + str(self.run_ids)
+        tab.query(qry, inplace=True)
+        nrem = nrow - len(tab)
+        if nrem > 0:
+            self.remove_counts[tnam] += nrem
+            tab.reset_index(inplace=True)
+        tab['run_idx'] = pandas.to_numeric(tab[col].replace(runIdToIndex))
+        tab.drop(columns=[col], inplace=True)
 
+    @staged('fix_workflows', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
     def fix_workflows(self):
         """Replace workflow names with indices and fill sel.workflow_names with those names."""
         myname = self.__class__.__name__ + "::fix_workflows"
@@ -238,21 +686,25 @@ class MonDbReader:
         if 'workflows' in self.fixed:
             print(f"""{myname}: Workflows are already fixed.""")
             return
+        self._fix_workflows_table(self.table('workflow'))
+        self.fixed.append('workflows')
+
+    def _fix_workflows_table(self, tab):
+        """Replace workflow names with indices in workflow table tab."""
         col = 'workflow_name'
-        tab = self.table('workflow')
         nameToIdx = {}
         for wnam in tab[col]:
             if wnam not in self.workflow_names:
-                nameToIdx[wnam] = str(len(self.workflow_names))
                 self.workflow_names.append(wnam)
+            nameToIdx[wnam] = str(self.workflow_names.index(wnam))
         tab['wf_idx'] = pandas.to_numeric(tab[col].replace(nameToIdx))
         tab.drop(columns=[col], inplace=True)
         # Drop the workflow version. It is just the start time.
         col = 'workflow_version'
         if col in tab.columns.values.tolist():
             tab.drop(columns=[col], inplace=True)
-        self.fixed.append('workflows')
 
+    @staged('fix_times', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
     def fix_times(self):
         """Replace time strings with unix seconds. None is left as None."""
         myname = self.__class__.__name__ + "::fix_times"
@@ -270,24 +722,32 @@ class MonDbReader:
         for iwkf in range(nwkf):
             self.t0s[iwkf] = self.time_from_string(wkf.at[iwkf, 'time_began'])
         self.t0 = self.time_from_string(wkf.at[0, 'time_began'])
-        for tnam in self.table_names():
-            t0 = None
-            tab=self.table(tnam)
-            for cnam in tab.columns:
-                if cnam[0:4]=='time' or cnam[0:9]=='task_time' or cnam[0:13]=='task_try_time':
-                    if self.dbg >=2: print(f"""{myname}: Fixing column {cnam} in table {tnam}""")
-                    tab[cnam] = tab[cnam].apply(lambda x: x if (x is None) else self.time_from_string(x) - self.t0s[0])
+        for tnam in self.loaded_table_names():
+            self._fix_times_table(tnam, self.table(tnam))
+        self._set_workflow_time_ranges()
+        for iwkf in range(0, nwkf):
+            for itp in range(2):
+                self.taskprocs[itp].append({})
+        # Set flag.
+        self.fixed.append('times')
+
+    def _set_workflow_time_ranges(self):
+        """Fill self.workflow_time_ranges from the fixed workflow table."""
+        myname = self.__class__.__name__ + "::fix_times"
+        wkf = self.table('workflow')
+        nwkf = len(wkf)
+        self.workflow_time_ranges = []
         # If any workflow end times have not been recorded, use the last entry in the resource table.
         # Also add each worflow time range to self.workflow_time_ranges
         # 17may2022 - Use task table if resource table is empty.
         cwkf = 'time_completed'
-        tbl = self.table('resource')
-        cend = 'timestamp'
-        if len(tbl) == 0:
-            tbl = self.table('task')
-            cend = 'task_time_returned'
         for iwkf in range(0, nwkf):
             if wkf[cwkf][iwkf] is None:
+                tbl = self.table('resource')
+                cend = 'timestamp'
+                if len(tbl) == 0:
+                    tbl = self.table('task')
+                    cend = 'task_time_returned'
                 tmax = max(tbl[cend])
                 if iwkf+1 < nwkf:
                     qry = cend + '<' + str(wkf['time_began'][iwkf+1])
@@ -307,11 +767,17 @@ class MonDbReader:
                 t2 = tmax
             if self.dbg >= 3: print(f"""{myname}: Time range for run {iwkf} is [{t1}, {t2}].""")
             self.workflow_time_ranges.append((t1, t2))
-            for itp in range(2):
-                self.taskprocs[itp].append({})
-        # Set flag.
-        self.fixed.append('times')
 
+    def _fix_times_table(self, tnam, tab):
+        """Replace time strings with seconds since the start of the first run in table tab."""
+        myname = self.__class__.__name__ + "::fix_times"
+        for cnam in tab.columns:
+            if cnam[0:4]=='time' or cnam[0:9]=='task_time' or cnam[0:13]=='task_try_time':
+                if self.dbg >=2: print(f"""{myname}: Fixing column {cnam} in table {tnam}""")
+                if tab[cnam].isna().all(): continue
+                tab[cnam] = self.times_from_strings(tab[cnam]) - self.t0s[0]
+
+    @staged('fix_tasks', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
     def fix_tasks(self):
         """
         Task function names are assigned indices and the following members are filled:
@@ -327,114 +793,293 @@ class MonDbReader:
             return
         if not len(self.run_ids): self.fix_runs()
         if self.dbg: print(f"""{myname}: Fixing tasks.""")
-        self.task_names = []
-        self.task_name_counts = []
-        self.task_logs = []
-        task_idxs = []   # New column
-        tab = self.table('task')
-        for dum in self.run_ids: self.task_index.append([])
-        run_idx = 0
-        task_id = 0
-        for row in tab.itertuples():
-            tnam = row.task_func_name
-            if row.run_idx != run_idx:
-                run_idx = row.run_idx
-                task_id = 0
-            assert( task_id == row.task_id )   # Assume task_id numbering follws that of rows
-            if tnam not in self.task_names:
-                idx = len(self.task_names)
-                self.task_names.append(tnam)
-                self.task_name_counts.append(1)
-                self.taskIndexFromName[tnam] = idx
-            else:
-                idx = self.taskIndexFromName[tnam]
-                self.task_name_counts[idx] = self.task_name_counts[idx] + 1
-            task_idxs.append(idx)
-            assert( len(self.task_index[run_idx]) == task_id)
-            self.task_index[run_idx].append(idx)
-            self.task_logs.append(row.task_stderr)
-            task_id = task_id + 1
+        self._index_tasks(self.table('task'))
+        # Add 'run_idx' to all the other tables thaat have 'run_id'.
+        for tnam in self.loaded_table_names():
+            if tnam != 'task': self._fix_tasks_table(tnam, self.table(tnam))
+        # set flag indicating tasks have been fixed.
+        self.fixed.append('tasks')
+
+    def _index_tasks(self, tab):
+        """Assign task indices for task table tab and fill the task members (see fix_tasks)."""
+        # Assign task indices in order of first appearance of each task function name.
+        task_idxs, names = pandas.factorize(tab['task_func_name'])
+        self.task_names = list(names)
+        self.task_name_counts = numpy.bincount(task_idxs, minlength=len(names)).tolist()
+        self.taskIndexFromName = {tnam: idx for idx, tnam in enumerate(self.task_names)}
+        self.task_logs = list(tab['task_stderr'])
+        # Assume task_id numbering follows that of the rows in each run.
+        run_idxs = tab['run_idx'].to_numpy()
+        assert( (tab['task_id'].to_numpy() == tab.groupby('run_idx').cumcount().to_numpy()).all() )
+        nrun = len(self.run_ids)
+        counts = numpy.bincount(run_idxs, minlength=nrun) if len(tab) else numpy.zeros(nrun, dtype=int)
+        self._task_index_offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        self._task_index_lookup = numpy.zeros(len(tab), dtype=task_idxs.dtype)
+        self._task_index_lookup[self._task_index_offsets[run_idxs] + tab['task_id'].to_numpy()] = task_idxs
+        self.task_index = [self._task_index_lookup[self._task_index_offsets[irun]:self._task_index_offsets[irun+1]].tolist()
+                           for irun in range(nrun)]
         # In 'task' replace column task_func_name with task_idx
         cnam = 'task_func_name'
         icol = tab.columns.get_loc(cnam)
-        tab.insert(icol, 'task_idx', pandas.Series(task_idxs))
+        tab.insert(icol, 'task_idx', pandas.Series(task_idxs, index=tab.index))
         tab.drop(labels=cnam, axis=1, inplace=True)
-        # Add 'run_idx' to all the other tables thaat have 'run_id'.
-        for tnam in self.table_names():
-            tab = self.table(tnam)
-            cnams = tab.columns.values.tolist()
-            if tnam != 'task' and 'task_id' in cnams:
-                if self.dbg > 1: print(f"""{myname}: Adding task_idx to table {tnam}""")
-                assert('run_idx' in cnams)    # fix_runs should have added this
-                vals = []
-                for row in tab.itertuples():
-                    run_idx = row.run_idx
-                    task_id = row.task_id
-                    if task_id < len(self.task_index[run_idx]):
-                        vals.append(self.task_index[run_idx][task_id])
-                    else:
-                        vals.append(-1.0)
-                        print(f"({myname}: WARNING: Ignoring unknown task {task_id} in table {tnam}")
-                icol = tab.columns.get_loc('task_id') + 1
-                tab.insert(icol, 'task_idx', pandas.Series(vals))
-            else:
-                if self.dbg > 2: print(f"""{myname}: NOT adding task_id in table {tnam}""")
-        # set flag indicating tasks have been fixed.
-        self.fixed.append('tasks')
 
+    def _fix_tasks_table(self, tnam, tab):
+        """Add task indices ('task_idx') to table tab if it has task IDs ('task_id')."""
+        myname = self.__class__.__name__ + "::fix_tasks"
+        cnams = tab.columns.values.tolist()
+        if 'task_id' in cnams:
+            if self.dbg > 1: print(f"""{myname}: Adding task_idx to table {tnam}""")
+            assert('run_idx' in cnams)    # fix_runs should have added this
+            vals = self.task_indices(tab['run_idx'], tab['task_id'])
+            nbad = (vals < 0).sum()
+            if nbad:
+                bad_ids = tab['task_id'][vals < 0].unique()
+                print(f"{myname}: WARNING: Ignoring {nbad} rows with {len(bad_ids)} unknown tasks in table {tnam}: {bad_ids[:10].tolist()}")
+                vals = vals.astype(numpy.float64)
+            icol = tab.columns.get_loc('task_id') + 1
+            tab.insert(icol, 'task_idx', pandas.Series(vals, index=tab.index))
+        else:
+            if self.dbg > 2: print(f"""{myname}: NOT adding task_id in table {tnam}""")
+
+    def task_indices(self, run_idxs, task_ids):
+        """
+        Return an array of task indices for the given arrays of run indices and task IDs.
+        The value is -1 for tasks that do not appear in the task table.
+        """
+        run_idxs = numpy.asarray(run_idxs, dtype=numpy.int64)
+        task_ids = numpy.asarray(task_ids, dtype=numpy.int64)
+        offs = self._task_index_offsets
+        nrun = len(offs) - 1
+        good = (run_idxs >= 0) & (run_idxs < nrun)
+        irun = numpy.where(good, run_idxs, 0)
+        good &= (task_ids >= 0) & (task_ids < offs[irun+1] - offs[irun])
+        vals = numpy.full(len(task_ids), -1, dtype=numpy.int64)
+        vals[good] = self._task_index_lookup[offs[irun[good]] + task_ids[good]]
+        return vals
+
+    @staged('fix_try', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
     def fix_try(self):
         """
         Transfer timestamps from the status table (one entry per try state) to new columns
         in the try table.
+        Tries with no or multiple entries for a state are given NaN and the numbers of
+        such tries are reported.
         """
-        myname = self.__class__.__name__ + "::fix_tasks"
         if 'try' in self.fixed: return
+        self._try_status = self._status_counts(self.table('status'))
+        self._set_try_status(self._try_status)
+        self.fixed.append('try')
+
+    # Map of the try table columns added by fix_try indexed by status labels.
+    try_status_columns = {
+        'pending':'status_pending',
+        'launched':'status_launched',
+        'running':'status_running',
+        'running_ended':'status_rundone',
+        'exec_done':'status_alldone',
+    }
+
+    def _status_counts(self, tsta):
+        """
+        Return a dataframe indexed by run index, task ID and try ID with the number of
+        entries (count) and the first timestamp (timestamp) in status table tsta for each
+        state in try_status_columns.
+        """
+        keys = ['run_idx', 'task_id', 'try_id']
+        tsel = tsta[tsta['task_status_name'].isin(list(self.try_status_columns))]
+        grp = tsel.groupby(keys + ['task_status_name'], observed=True)['timestamp']
+        return pandas.DataFrame({'count': grp.size(), 'timestamp': grp.first()}).unstack('task_status_name')
+
+    def _merge_status_counts(self, stas, newstas):
+        """
+        Return the status counts stas (see _status_counts) updated with those newstas for
+        status rows added after the ones used to build stas.
+        """
+        counts = stas['count'].add(newstas['count'], fill_value=0)
+        tims = stas['timestamp'].combine_first(newstas['timestamp'])
+        return pandas.concat({'count': counts, 'timestamp': tims}, axis=1)
+
+    def _set_try_status(self, stas):
+        """Insert the status timestamp columns into the try table from status counts stas."""
+        myname = self.__class__.__name__ + "::fix_try"
         ttry = self.table('try')
-        tsta = self.table('status')
-        # Map of new column named indexed by status lables.
         ntry = len(ttry)
-        cnams = {
-          'pending':'status_pending',
-          'launched':'status_launched',
-          'running':'status_running',
-          'running_ended':'status_rundone',
-          'exec_done':'status_alldone',
+        # Align with the try table.
+        keys = ['run_idx', 'task_id', 'try_id']
+        tryidx = pandas.MultiIndex.from_frame(ttry[keys])
+        stas = stas.reindex(tryidx)
+        for snam, cnam in self.try_status_columns.items():
+            if ('count', snam) in stas.columns:
+                counts = stas[('count', snam)].fillna(0).to_numpy()
+                tims = stas[('timestamp', snam)].to_numpy(dtype=numpy.float64)
+            else:
+                counts = numpy.zeros(ntry)
+                tims = numpy.full(ntry, numpy.nan)
+            nmiss = (counts == 0).sum()
+            nmult = (counts > 1).sum()
+            if nmiss:
+                print(f"{myname}: WARNING: {nmiss}/{ntry} tries not found in {snam} status table.")
+            if nmult:
+                print(f"{myname}: WARNING: {nmult}/{ntry} tries with multiple matches in {snam} status table.")
+            # Insert the timestamp column into the try table.
+            if ntry and (counts == 1).any():
+                ttry[cnam] = numpy.where(counts == 1, tims, numpy.nan)
+            else:
+                ttry[cnam] = ntry*[None]
+
+    # Column used to order the rows for each task in the task group index of each table.
+    task_group_order = {'resource': 'timestamp', 'status': 'timestamp', 'try': 'try_id'}
+
+    def task_group_index(self, tnam):
+        """
+        Return the task group index for table tnam (resource, try or status). This is a
+        dictionary with:
+          table - Copy of the table ordered by run index, task ID and then timestamp (try ID
+                  for try) with index reset.
+          order - Position in the original table for each row of the above.
+          run_idx, task_id - Run index and task ID for each group of rows.
+          starts, ends - Range of rows for each group in the ordered table.
+        The index is built on first use and again if the table changes.
+        """
+        myname = self.__class__.__name__ + "::task_group_index"
+        tab = self.table(tnam)
+        if tab is None: raise Exception(f"{myname}: Table {tnam} not found.")
+        key = (id(tab), len(tab), tuple(tab.columns))
+        grp = self._task_groups.get(tnam)
+        if grp is not None and grp['key'] == key: return grp
+        if self.dbg >= 2: print(f"""{myname}: Building task group index for table {tnam}.""")
+        runidxs = tab['run_idx'].to_numpy()
+        taskids = tab['task_id'].to_numpy()
+        order = numpy.lexsort((tab[self.task_group_order[tnam]].to_numpy(), taskids, runidxs))
+        runidxs = runidxs[order]
+        taskids = taskids[order]
+        nrow = len(order)
+        isnew = numpy.ones(nrow, dtype=bool)
+        isnew[1:] = (runidxs[1:] != runidxs[:-1]) | (taskids[1:] != taskids[:-1])
+        starts = numpy.flatnonzero(isnew)
+        grp = {
+            'key': key,
+            'table': tab.take(order).reset_index(drop=True),
+            'order': order,
+            'run_idx': runidxs[starts],
+            'task_id': taskids[starts],
+            'starts': starts,
+            'ends': numpy.append(starts[1:], nrow),
         }
-        snams = cnams.keys()
-        # Build arrays holding the times for each state.
-        tims = {}
-        tsstas = {}
-        for snam in snams:
-            tims[snam] = [None]*ntry
-            tsstas[snam] = tsta.query(f"task_status_name=='{snam}'")
-        itry = 0
-        not_found_max = 20
-        not_found_count = 0
-        not_found_suppressed = 0
-        for idx, row in ttry.iterrows():
-            sqry = f"run_idx=={row.run_idx} and task_id=={row.task_id} and try_id=={row.try_id}"
-            for snam in snams:
-                tsssta = tsstas[snam].query(sqry)
-                if len(tsssta) == 0:
-                    not_found_count += 1
-                    if not_found_count < not_found_max:
-                        print(f"{myname}: WARNING: Not found in {snam} status table: {sqry}")
-                    else:
-                        not_found_suppressed += 1
-                        if not_found_count ==not_found_max:
-                            print(f"{myname}: WARNING: Suppressing not found in status table errors.")
-                elif len(tsssta) > 1:
-                    print(f"{myname}: WARNING: Multiple matches found in {snam} status table: {sqry}")
-                else:
-                    tims[snam][itry] = tsssta.timestamp.iat[0]
-            itry += 1
-        if not_found_suppressed:
-            print(f"{myname}: WARNING: Suppressed {not_found_suppressed}/{not_found_count} not found in status table errors.")
-        # Insert the timestamp columns into the try table.
-        for snam in snams:
-            cnam = cnams[snam]
-            ttry[cnam] = tims[snam]
-        self.fixed.append('tasks')
+        self._task_groups[tnam] = grp
+        return grp
+
+    def task_row_range(self, tnam, run_idx, task_id):
+        """Return the range (i1, i2) of rows for a task in the ordered table of the task group index for tnam."""
+        grp = self.task_group_index(tnam)
+        gruns = grp['run_idx']
+        ig1 = numpy.searchsorted(gruns, run_idx, 'left')
+        ig2 = numpy.searchsorted(gruns, run_idx, 'right')
+        igrp = ig1 + numpy.searchsorted(grp['task_id'][ig1:ig2], task_id, 'left')
+        if igrp >= ig2 or grp['task_id'][igrp] != task_id: return 0, 0
+        return int(grp['starts'][igrp]), int(grp['ends'][igrp])
+
+    def task_rows(self, tnam, run_idx, task_id):
+        """
+        Return the rows of table tnam (resource, try or status) for run index run_idx and
+        task ID task_id. This is a slice of the ordered table in the task group index and
+        should not be modified.
+        """
+        i1, i2 = self.task_row_range(tnam, run_idx, task_id)
+        return self.task_group_index(tnam)['table'].iloc[i1:i2]
+
+    @staticmethod
+    def _group_keys(runidxs, taskids):
+        """Return a key for each run index and task ID that orders as the task group index."""
+        return (numpy.asarray(runidxs, dtype=numpy.int64) << 32) | numpy.asarray(taskids, dtype=numpy.int64)
+
+    @staticmethod
+    def _range_positions(starts, lens):
+        """Return the positions in each range [start, start + len) in turn."""
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        lens = numpy.asarray(lens, dtype=numpy.int64)
+        offs = numpy.cumsum(lens) - lens
+        return numpy.repeat(starts - offs, lens) + numpy.arange(int(lens.sum()))
+
+    def _update_task_group_index(self, tnam, grp, nold, keys=None):
+        """
+        Update the task group index grp for table tnam after rows were appended at positions
+        nold and beyond. Only the groups with new rows or with the keys (see _group_keys) are
+        ordered again. The other groups keep their rows from grp.
+        Returns the position in grp of each group in the new index or -1 for the groups
+        ordered again.
+        """
+        tab = self._tables[tnam]
+        nrow = len(tab)
+        runidxs = tab['run_idx'].to_numpy()
+        taskids = tab['task_id'].to_numpy()
+        oldkeys = self._group_keys(grp['run_idx'], grp['task_id'])
+        oldstarts = grp['starts']
+        oldlens = grp['ends'] - oldstarts
+        tkeys = self._group_keys(runidxs[nold:], taskids[nold:])
+        if keys is not None: tkeys = numpy.concatenate([tkeys, keys])
+        tkeys = numpy.unique(tkeys)
+        igrps = numpy.searchsorted(oldkeys, tkeys)
+        isold = igrps < len(oldkeys)
+        isold[isold] = oldkeys[igrps[isold]] == tkeys[isold]
+        igrps = igrps[isold]
+        # Order the old and new rows of the touched groups as in task_group_index.
+        rows = numpy.concatenate([grp['order'][self._range_positions(oldstarts[igrps], oldlens[igrps])],
+                                  numpy.arange(nold, nrow)])
+        rkeys = self._group_keys(runidxs[rows], taskids[rows])
+        rord = numpy.lexsort((rows, tab[self.task_group_order[tnam]].to_numpy()[rows], rkeys))
+        rows = rows[rord]
+        rkeys = rkeys[rord]
+        isnew = numpy.ones(len(rows), dtype=bool)
+        isnew[1:] = rkeys[1:] != rkeys[:-1]
+        tstarts = numpy.flatnonzero(isnew)
+        tlens = numpy.diff(numpy.append(tstarts, len(rows)))
+        # Merge the touched groups with the others.
+        keep = numpy.ones(len(oldkeys), dtype=bool)
+        keep[igrps] = False
+        ikeeps = numpy.flatnonzero(keep)
+        gkeys = numpy.concatenate([oldkeys[ikeeps], rkeys[tstarts]])
+        srcs = numpy.concatenate([oldstarts[ikeeps], len(grp['order']) + tstarts])
+        lens = numpy.concatenate([oldlens[ikeeps], tlens])
+        oldgroups = numpy.concatenate([ikeeps, numpy.full(len(tstarts), -1, dtype=ikeeps.dtype)])
+        gord = numpy.argsort(gkeys, kind='stable')
+        gkeys = gkeys[gord]
+        lens = lens[gord]
+        order = numpy.concatenate([grp['order'], rows])[self._range_positions(srcs[gord], lens)]
+        ends = numpy.cumsum(lens)
+        self._task_groups[tnam] = {
+            'key': (id(tab), nrow, tuple(tab.columns)),
+            'table': tab.take(order).reset_index(drop=True),
+            'order': order,
+            'run_idx': (gkeys >> 32).astype(runidxs.dtype),
+            'task_id': (gkeys & 0xffffffff).astype(taskids.dtype),
+            'starts': ends - lens,
+            'ends': ends,
+        }
+        return oldgroups[gord]
+
+    def _merge_taskproc_table(self, dodelta, oldgrp, oldgroups):
+        """
+        Update the taskproc table after the resource task group index was updated from oldgrp.
+        The rows are evaluated again for the groups with oldgroups -1 (see
+        _update_task_group_index) and taken from the existing table for the others.
+        Returns the sampling offset flags (see _taskproc_rows) for the former.
+        """
+        grp = self._task_groups['resource']
+        olddf = self._taskproc_tables[dodelta]
+        lens = grp['ends'] - grp['starts']
+        isold = oldgroups >= 0
+        itchs = numpy.flatnonzero(~isold)
+        rows = self._range_positions(grp['starts'][itchs], lens[itchs])
+        tstarts = numpy.cumsum(lens[itchs]) - lens[itchs]
+        tchdf, tchfound = self._taskproc_rows(grp['table'].take(rows).reset_index(drop=True), tstarts, dodelta)
+        srcs = numpy.zeros(len(oldgroups), dtype=numpy.int64)
+        srcs[isold] = oldgrp['starts'][oldgroups[isold]]
+        srcs[~isold] = len(olddf) + tstarts
+        newdf = pandas.concat([olddf, tchdf], ignore_index=True)
+        self._taskproc_tables[dodelta] = newdf.take(self._range_positions(srcs, lens)).reset_index(drop=True)
+        return tchfound
 
     def taskproc(self, runidx, taskid, dodelta=True, build=True):
         """
@@ -456,11 +1101,166 @@ class MonDbReader:
         if runidx >= len(self.workflow_time_ranges):
             if self.dbg: print(f"""{myname}: ERROR: Run index {runidx} is out of range.""")
             return None
-        if self.dbg >= 2: print(f"{myname}: Building taskproc table for run {runidx} task {taskidx}.")
+        # Build the taskproc table for all tasks and select the rows for this task.
+        if self._taskproc_tables[dodelta] is None:
+            if not build: return None
+            self.build_taskproc_table(dodelta)
+        irow1, irow2 = self.task_row_range('resource', runidx, taskid)
+        if irow2 == irow1:
+            if self.dbg: print(f"""{myname}: ERROR: No resouce entries match run_idx=={runidx} and task_id=={taskid}.""")
+            return None
+        if self.dbg >= 2: print(f"{myname}: Selecting taskproc table for run {runidx} task {taskid}.")
+        newdf = self._taskproc_tables[dodelta].iloc[irow1:irow2].reset_index(drop=True)
+        self.taskprocs[dodelta][runidx][taskid] = newdf
+        return newdf
+
+    @staticmethod
+    def sampling_offsets(tims, starts, dt, method='interval'):
+        """
+        Find the time offset toff for each task such that adjacent samples, after the
+        first, fall in adjacent bins when binning timestamp + toff with bin width dt.
+        Offsets are chosen from the sequence 0, dtoff, 2*dtoff, ... with dtoff = min(1, dt/10)
+        and the smallest that satisfies the condition is returned.
+        Arguments:
+          tims: Array of sample times ordered by task and then time.
+          starts: Array holding the index of the first sample for each task.
+          dt: Sampling interval.
+          method: 'interval' - Offsets are taken from the feasible intervals evaluated from
+                               the sample phases for all tasks at once.
+                  'step' - Offsets are searched by stepping toff and checking all samples.
+        Returns the array of offsets and an array which is False for tasks where no offset
+        was found. These have offset 0.0.
+        """
+        tims = numpy.asarray(tims, dtype=numpy.float64)
+        starts = numpy.asarray(starts)
+        nrow = len(tims)
+        ngrp = len(starts)
+        nsams = numpy.diff(numpy.append(starts, nrow))
+        igrps = numpy.repeat(numpy.arange(ngrp), nsams)
+        # Differences are checked for samples after the second.
+        usedif = numpy.arange(nrow) - starts[igrps] >= 2
+        dtoff = min(1.0, 0.1*dt)
+        toffmax = dt/2 + 1
+        toffs = numpy.zeros(ngrp)
+        found = numpy.ones(ngrp, dtype=bool)
+        if method == 'step':
+            active = nsams > 2
+            toff = 0.0
+            while active.any():
+                difs = numpy.full(nrow, -numpy.inf)
+                difs[1:] = numpy.abs(numpy.diff(numpy.mod(tims + toff, dt)))
+                difs[~usedif] = -numpy.inf
+                maxdifs = numpy.maximum.reduceat(difs, starts)
+                ok = active & (maxdifs < dt/2)
+                toffs[ok] = toff
+                active &= ~ok
+                if toff > toffmax: break
+                toff = toff + dtoff
+            found[active] = False
+            return toffs, found
+        if method != 'interval':
+            raise Exception(f"MonDbReader::sampling_offsets: Invalid method: {method}")
+        # A pair of samples with phases a < b = a + d (modulo dt, d < dt/2) lands in
+        # non-adjacent bins when the bin edge falls between them, i.e. when the offset
+        # is in [dt - d - a, dt - a) modulo dt. Collect these forbidden intervals.
+        phas = numpy.mod(tims, dt)
+        irow2 = numpy.flatnonzero(usedif)
+        pha1 = phas[irow2 - 1]
+        pha2 = phas[irow2]
+        difs = numpy.mod(pha2 - pha1, dt)
+        isfwd = difs < dt/2
+        lens = numpy.where(isfwd, difs, dt - difs)
+        lows = numpy.where(isfwd, pha1, pha2)
+        keep = lens > 0
+        fgrps = igrps[irow2][keep]
+        fbeg = numpy.mod(dt - lens[keep] - lows[keep], dt)
+        fend = fbeg + lens[keep]
+        # Convert each forbidden interval, and its repeats in the periods of dt covered by the
+        # offset sequence, to the range [k1, k2) of forbidden offset indices k = toff/dtoff.
+        kmax = int(toffmax/dtoff) + 1
+        nk = kmax + 2
+        pers = range(-1, int((kmax*dtoff)/dt) + 1)
+        ks1 = []
+        ks2 = []
+        for iper in pers:
+            ks1.append(numpy.clip(numpy.ceil((fbeg + iper*dt)/dtoff), 0, nk - 1).astype(numpy.int64))
+            ks2.append(numpy.clip(numpy.ceil((fend + iper*dt)/dtoff), 0, nk - 1).astype(numpy.int64))
+        ks1 = numpy.concatenate(ks1)
+        ks2 = numpy.concatenate(ks2)
+        fgrps = numpy.tile(fgrps, len(pers))
+        keep = ks2 > ks1
+        # Sort the forbidden ranges by task and start and take the first index not covered:
+        # 0 if the first range starts after it, else the first gap where the next range
+        # starts past the largest end so far, else that largest end.
+        fgrps = fgrps[keep]
+        ks1 = ks1[keep]
+        ks2 = ks2[keep]
+        order = numpy.lexsort((ks1, fgrps))
+        fgrps = fgrps[order]
+        ks1 = ks1[order]
+        ks2 = ks2[order]
+        # Running maximum of the ends within each task. The task offset keeps tasks apart.
+        ends = numpy.maximum.accumulate(ks2 + fgrps*nk) - fgrps*nk
+        isfirst = numpy.ones(len(fgrps), dtype=bool)
+        isfirst[1:] = fgrps[1:] != fgrps[:-1]
+        islast = numpy.ones(len(fgrps), dtype=bool)
+        islast[:-1] = isfirst[1:]
+        prevends = numpy.zeros(len(fgrps), dtype=numpy.int64)
+        prevends[1:] = ends[:-1]
+        isgap = numpy.where(isfirst, ks1 > 0, ks1 > prevends)
+        gaps = numpy.where(isfirst, 0, prevends)
+        kfirst = numpy.zeros(ngrp, dtype=numpy.int64)
+        kfirst[fgrps[islast]] = ends[islast]
+        igaps = numpy.flatnonzero(isgap)
+        ggrps, ifirsts = numpy.unique(fgrps[igaps], return_index=True)
+        kfirst[ggrps] = gaps[igaps[ifirsts]]
+        found = kfirst <= kmax
+        toffs = numpy.where(found, kfirst*dtoff, 0.0)
+        return toffs, found
+
+    def build_taskproc_table(self, dodelta=True):
+        """
+        Build the taskproc table for all tasks in one pass over the resource table.
+        Rows are ordered by run index, task ID and timestamp. The row range for each
+        (run index, task ID) is recorded so taskproc can select the rows for one task.
+        The clock time (procsum_time_clock, or procdel_time_clock with deltas) of each sample
+        is its timestamp minus the running time of the try (run index, task ID and try ID)
+        that took the sample. It is NaN if that try has no running time.
+        Note that this changes the result for tasks with more than one try. The earlier
+        per-task build matched the task to all of its tries and so the clock times for
+        retried tasks, and their contributions to procsum with deltas, were not valid.
+        """
+        myname = self.__class__.__name__ + "::build_taskproc_table"
+        # Make sure tasks and times are already fixed so we have task indices and the starting time.
+        if 'tasks' not in self.fixed:
+            if self.dbg >= 2: print(f"""{myname}: Fixing tasks.""")
+            self.fix_tasks()
+        if len(self.workflow_time_ranges) == 0:
+            if self.dbg >= 2: print(f"""{myname}: Fixing times.""")
+            self.fix_times()
+        if self.dbg >= 2: print(f"{myname}: Building taskproc table {'with' if dodelta else 'without'} deltas.")
+        # Take the resource entries ordered by task and timestamp from the task group index.
+        # The taskproc rows for each task have the same range as in that index.
+        assert(self.table('resource') is not None)
+        grp = self.task_group_index('resource')
+        if self.dbg >= 2: print(f"""{myname}: Task count is {len(grp['starts'])}.""")
+        newdf, found = self._taskproc_rows(grp['table'], grp['starts'], dodelta)
+        self._taskproc_found = found
+        self.nwarnNoOffset = int((~found).sum())
+        if self.nwarnNoOffset and self.dbg > 2:
+            print(f"""{myname}: WARNING: Unable to find offset for {self.nwarnNoOffset} tasks. Using 0.0.""")
+        self._taskproc_tables[dodelta] = newdf
+        return newdf
+
+    def _taskproc_rows(self, olddf, starts, dodelta):
+        """
+        Return the taskproc rows for the resource rows olddf ordered by task and timestamp
+        with the first row for each task at starts. Also returns the array which is False
+        for tasks where no sampling offset was found.
+        """
+        myname = self.__class__.__name__ + "::build_taskproc_table"
         # Columns for which we keep.
         colkeeps = ['timestamp', 'run_idx', 'task_idx', 'task_id', 'try_id']
-        # Columns that we add.
-        colnews = ['toff', 'proc_time_clock', 'nsam', 'isam']
         # Columns for which we keep but rename: psutil_process --> proc
         colproc_rens = [
                 'psutil_process_pid',
@@ -473,7 +1273,7 @@ class MonDbReader:
         colproc_rens_renamed = []
         for cnam in colproc_rens:
             colproc_rens_renamed.append('proc' + cnam[14:])
-        if self.dbg >= 2: print(f"""{myname}: Renamed columns: {colproc_rens_renamed}.""")
+        if self.dbg >= 3: print(f"""{myname}: Renamed columns: {colproc_rens_renamed}.""")
         # Columns for which we may return deltas and renamed to procdel with deltas or proc without.
         colproc_dels = [
              'psutil_process_children_count',
@@ -487,73 +1287,90 @@ class MonDbReader:
         colproc_dels_renamed = []
         for cnam in colproc_dels:
             colproc_dels_renamed.append(prefix + cnam[14:])
-        if self.dbg >= 2: print(f"""{myname}: Delta columns: {colproc_dels_renamed}.""")
-        # Select rows with given IDs.
-        res = self.table('resource')
-        assert(res is not None)
-        qry = f"""run_idx=={runidx} and task_id=={taskid}"""
-        if self.dbg >= 3: print(f"""{myname}: Processing '{qry}'.""")
-        # Select entries for this task, order by timestamp and reset indices.
-        olddf = res.query(qry).sort_values(by=['timestamp'], ignore_index=True)
-        if len(olddf) == 0:
-            if self.dbg: print(f"""{myname}: ERROR: No resouce entries match {qry}.""")
-            return None
-        if self.dbg >= 2: print(f"""{myname}: Row count for ({runidx}, {taskid}) is {len(olddf)}.""")
+        if self.dbg >= 3: print(f"""{myname}: Delta columns: {colproc_dels_renamed}.""")
+        nrow = len(olddf)
+        nsams = numpy.diff(numpy.append(starts, nrow))
+        igrps = numpy.repeat(numpy.arange(len(starts)), nsams)
         # Check the monitoring period is constant.
         sint = 'resource_monitoring_interval'
         dt = self.monitoring_interval
-        if dt is None:
-            idx0 = olddf.index[0]
-            dt = olddf.at[idx0, sint]
+        if dt is None and nrow:
+            dt = olddf.at[0, sint]
             self.monitoring_interval = dt
-        if len(olddf.query(f"""{sint}!={dt}""")):
+        if (olddf[sint] != dt).any():
             raise Exception(f"""{myname}: ERROR: Inconsistent {sint} values.""")
         # Assuming binning starts at 0.0, check if adjacent samples are not in adjacent bins.
         # If so try to find an offset that fixes this if we bin in timestamp + toff.
-        toff = 0.0
-        dtoff = min(1.0, 0.1*dt)
-        while len(olddf) > 2:
-            maxdif = max(olddf.timestamp.add(toff).mod(dt).diff()[2:].abs())
-            if maxdif < dt/2: break
-            if toff > dt/2 + 1:
-                if self.dbg>2: print(f"""{myname}: WARNING: Unable to find offset for run {runidx} task {taskid}. Using 0.0.""")
-                ++self.nwarnNoOffset
-                toff = 0.0
-                break
-            toff = toff + dtoff
+        tims = olddf['timestamp'].to_numpy(dtype=numpy.float64)
+        if nrow:
+            toffs, found = self.sampling_offsets(tims, starts, dt)
+        else:
+            toffs, found = numpy.zeros(0), numpy.ones(0, dtype=bool)
         # Add clock time = time since job started.
         ttry = self.table('try')
-        ttryproc = ttry.query(qry)
-        t0 = ttryproc['task_try_time_running'].squeeze()
-        timdf = olddf['timestamp'] - t0
+        keys = ['run_idx', 'task_id', 'try_id']
+        tryidx = pandas.MultiIndex.from_frame(ttry[keys])
+        t0s = pandas.Series(ttry['task_try_time_running'].to_numpy(), index=tryidx)
+        t0s = t0s[~t0s.index.duplicated()].reindex(pandas.MultiIndex.from_frame(olddf[keys])).to_numpy(dtype=numpy.float64)
+        timdf = tims - t0s
         timlab = 'procsum_time_clock'
         if dodelta:
             if self.dbg >= 4: print(f"""{myname}: Evaluating deltas.""")
-            # To get the deltas, keep the first row and use diff for the remainder.
+            # To get the deltas, keep the first row for each task and use diff for the remainder.
             # There is a missing contribution from process activity afte the last sampling.
-            deldf = olddf[colproc_dels].diff()
-            deldf.iloc[0] = olddf[colproc_dels].iloc[0]
-            tsav = timdf.iloc[0]
-            timdf = timdf.diff()
-            timdf.iloc[0] = tsav
+            vals = olddf[colproc_dels].to_numpy(dtype=numpy.float64)
+            dels = vals.copy()
+            dels[1:] -= vals[:-1]
+            dels[starts] = vals[starts]
+            deldf = pandas.DataFrame(dels, columns=colproc_dels)
+            tdels = timdf.copy()
+            tdels[1:] -= timdf[:-1]
+            tdels[starts] = timdf[starts]
+            timdf = tdels
             timlab = 'procdel_time_clock'
         else:
             deldf = olddf[colproc_dels]
         # Build the ouput dataframe.
         newdf = olddf[colkeeps].copy()
-        newdf['toff'] = toff
+        newdf['toff'] = toffs[igrps]
         newdf[timlab] = timdf
-        nsam = len(olddf)
-        newdf['nsam'] = nsam
-        newdf['isam'] = range(0, nsam)
+        newdf['nsam'] = nsams[igrps]
+        newdf['isam'] = numpy.arange(nrow) - starts[igrps]
         newdf[colproc_rens_renamed] = olddf[colproc_rens]
         newdf[colproc_dels_renamed] = deldf[colproc_dels]
-        self.taskprocs[dodelta][runidx][taskid] = newdf
-        return newdf
+        return newdf, found
 
-    def build_procsum(self, dodelta=True):
-        """Build the procsum table which sums resources in bins of sampling time."""
+    @staged('build_procsum', label=lambda self, dodelta=True, *args, **kwargs: 'delta' if dodelta else 'nodelta',
+            rows_in=lambda self, *args, **kwargs: len(self._tables['resource']) if 'resource' in self._tables else None,
+            rows_out=lambda self, res: None if res is None else len(res))
+    def build_procsum(self, dodelta=True, chunksize=None, backend=None):
+        """
+        Build the procsum table which sums resources in bins of sampling time.
+        If chunksize (or self.chunksize) is not None, the table without deltas is built
+        reading the resource table from the DB in chunks of that many rows.
+        Otherwise the table without deltas is built with backend (or self.procsum_backend):
+          pandas - Resource table is read and binned with pandas.
+          sql - Binning is done in the DB and only the bins are read.
+        """
         myname = self.__class__.__name__ + "::build_procsum"
+        if chunksize is None and not dodelta: chunksize = self.chunksize
+        if backend is None: backend = self.procsum_backend
+        if backend not in ['pandas', 'sql']: raise Exception(f"{myname}: Invalid backend: {backend}")
+        if backend == 'sql' and not dodelta and chunksize is None:
+            if 'procsumNoDelta' not in self._tables:
+                if self.dbg >= 1: print(f"""{myname}: Building table procsum without deltas in the DB.""")
+                self._tables['procsumNoDelta'] = self._build_procsum_sql()
+            elif self.dbg >= 1: print(f"""{myname}: Table procsum without deltas was already built.""")
+            self._tables['procsum'] = self._tables['procsumNoDelta']
+            return self._tables['procsum']
+        if chunksize is not None:
+            if dodelta: raise Exception(f"{myname}: Chunked reading is not supported with deltas.")
+            if 'procsumNoDelta' not in self._tables:
+                if self.dbg >= 1: print(f"""{myname}: Building table procsum without deltas from chunks of {chunksize} rows.""")
+                self._tables['procsumNoDelta'] = self._build_procsum_chunked(chunksize)
+            elif self.dbg >= 1: print(f"""{myname}: Table procsum without deltas was already built.""")
+            self._tables['procsum'] = self._tables['procsumNoDelta']
+            return self._tables['procsum']
         # Assign an empty frame if there are no resource entries.
         res = self.table('resource')
         if res is None or len(res) == 0:
@@ -576,14 +1393,50 @@ class MonDbReader:
             self._tables['procsum'] = self._tables[savename]
             return self.table('procsum')
         if self.dbg >= 1: print(f"""{myname}: Building table procsum {msg}.""")
-        # Columns for which we keep one value in the summary.
-        colkeeps = ['run_idx']
-        # Columns for which we sum values in each time bin.
         if dodelta:
             # Make sure we have the workflow times.
             if len(self.workflow_time_ranges) == 0:
                 if self.dbg >= 2: print(f"""{myname}: Fixing times.""")
                 self.fix_times()
+        colkeeps, colproc_sums, sreps, pidnam = self._procsum_columns(dodelta)
+        if self.dbg >= 2: print(f"""{myname}: Summed columns: {colproc_sums}.""")
+        # Loop over workflow runs and append the summary info for each to the procsum table.
+        nrun = self.nrun
+        if nrun == 0:
+            if self.dbg: print(f"""{myname}: No workflow runs found.""")
+            return
+        if self.dbg: print(f"""{myname}: Building procsum for {nrun} workflow run{'s' if nrun !=1 else ''}.""")
+        if dodelta:
+            olddf = self._taskproc_tables[True]
+            if olddf is None: olddf = self.build_taskproc_table(True)
+            if self.dbg >= 1:
+                grp_runidxs = self.task_group_index('resource')['run_idx']
+                for irun in range(0, nrun):
+                    ntid = int((grp_runidxs == irun).sum())
+                    print(f"""{myname}:   Workflow {irun} has {ntid} task IDs.""")
+            if self.dbg >= 1: print(f"{myname}:   Finished processing tasks.")
+        else:
+            res = self.table('resource')
+            self.monitoring_interval = res.at[0, 'resource_monitoring_interval']
+            olddf = res[ ['timestamp', 'psutil_process_pid'] + colkeeps + colproc_sums ]
+        newdf = self._bin_procsum(olddf, colkeeps, colproc_sums, sreps, pidnam)
+        self._tables['procsum'] = newdf
+        self._tables[savename] = newdf
+        if self.nwarnNoOffset:
+            print(f"{myname}: WARNING: Count of tasks with no-offset warning: {self.nwarnNoOffset}")
+        return newdf
+
+    @staticmethod
+    def _procsum_columns(dodelta):
+        """
+        Return the columns used to build procsum:
+          colkeeps - Columns for which we keep one value in the summary.
+          colproc_sums - Columns for which we sum values in each time bin.
+          sreps - Prefixes replaced with procsum_ in the summed column names.
+          pidnam - Name of the process ID column.
+        """
+        colkeeps = ['run_idx']
+        if dodelta:
             colproc_sums = [
                     #20220304 'proc_cpu_percent',
                     'proc_memory_percent',
@@ -596,6 +1449,7 @@ class MonDbReader:
                     'procdel_disk_write'
                 ]
             sreps = ['proc_', 'procdel_']
+            pidnam = 'proc_pid'
         else:
             colproc_sums = [
                     #20220304 'psutil_process_cpu_percent',
@@ -604,37 +1458,19 @@ class MonDbReader:
                     'psutil_process_memory_virtual'
                 ]
             sreps = ['psutil_process_']
-        if self.dbg >= 2: print(f"""{myname}: Summed columns: {colproc_sums}.""")
-        # Loop over workflow runs and append the summary info for each to the procsum table.
-        nrun = self.nrun
-        if nrun == 0:
-            if self.dbg: print(f"""{myname}: No workflow runs found.""")
-            return
-        if self.dbg: print(f"""{myname}: Building procsum for {nrun} workflow run{'s' if nrun !=1 else ''}.""")
-        if dodelta:
-            mrgdfs = []
-            for irun in range(0, nrun):
-                tids = set(self.table('resource').query(f"""run_idx=={irun}""")['task_id'].tolist())
-                if self.dbg >= 1: print(f"""{myname}:   Workflow {irun} has {len(tids)} task IDs.""")
-                count = 0
-                for tid in tids:
-                    if self.dbg >= 1 and count%1000 ==0:
-                        print(f"{myname}:   {count:8}: Processing run {irun} task{tid}.")
-                    dbgsav = self.dbg
-                    self.dbg = 0
-                    mrgdfs.append(self.taskproc(irun, tid))
-                    self.dbg = dbgsav
-                    count = count + 1
-            olddf = pandas.concat(mrgdfs)
-            if self.dbg >= 1: print(f"{myname}:   Finished processing tasks.")
-            pidnam = 'proc_pid'
-        else:
-            res = self.table('resource')
-            self.monitoring_interval = res.at[0, 'resource_monitoring_interval']
-            olddf = res[ ['timestamp', 'psutil_process_pid'] + colkeeps + colproc_sums ]
             pidnam = 'psutil_process_pid'
+        return colkeeps, colproc_sums, sreps, pidnam
+
+    def _bin_procsum(self, olddf, colkeeps, colproc_sums, sreps, pidnam):
+        """
+        Sum the resource or taskproc rows olddf in bins of sampling time for build_procsum.
+        Bin edges are multiples of the monitoring interval.
+        """
         dt = self.monitoring_interval
         assert(dt is not None)
+        # Sum compact (float32) values with full precision.
+        upcols = {cnam: numpy.float64 for cnam in colproc_sums if olddf[cnam].dtype == numpy.float32}
+        if len(upcols): olddf = olddf.astype(upcols)
         t1 = int(olddf.timestamp.min()/dt)*dt
         t2 = int(olddf.timestamp.max()/dt + 1.0)*dt
         rngs = numpy.arange(t1, t2, dt)
@@ -644,7 +1480,7 @@ class MonDbReader:
         agdict = {'timestamp':['count'], pidnam:['nunique']}
         for col in colkeeps: agdict[col] = ['first']
         for col in colproc_sums: agdict[col] = 'sum'
-        newdf = olddf.groupby(bins).agg(agdict)
+        newdf = olddf.groupby(bins, observed=False).agg(agdict)
         cnams = ['nval', 'nproc'] + colkeeps
         for oldnam in colproc_sums:
             newnam = oldnam
@@ -658,14 +1494,334 @@ class MonDbReader:
         newdf.insert(0, 'timestamp', rngs[0:len(rngs)-1] + dt/2)
         newdf.index = range(0, len(newdf))
         newdf.query('nproc>0', inplace=True)
+        return newdf
+
+    def _build_procsum_chunked(self, chunksize):
+        """
+        Build procsum without deltas reading the resource table in timestamp-ordered chunks.
+        The bin aggregates are accumulated for each chunk and combined at the end so
+        memory use is set by the chunk size and the number of bins. The result is the
+        same as that from _bin_procsum for the full table.
+        """
+        myname = self.__class__.__name__ + "::build_procsum"
+        if 'times' not in self.fixed: raise Exception(f"{myname}: Times must be fixed to build procsum from chunks.")
+        colkeeps, colproc_sums, sreps, pidnam = self._procsum_columns(False)
+        where = ''
+        params = []
+        if self._run_id is not None:
+            where = " where run_id=?"
+            params.append(self._run_id)
+        # The monitoring interval is taken from the first row as in build_procsum.
+        qry = f"select resource_monitoring_interval from resource{where} order by rowid limit 1"
+        dts = pandas.read_sql_query(qry, self._con, params=params)['resource_monitoring_interval']
+        if len(dts) == 0:
+            if self.dbg >= 1: print(f"""{myname}: No resources found and so procsum table is empty.""")
+            return pandas.DataFrame()
+        self.monitoring_interval = dts.iloc[0]
+        dt = self.monitoring_interval
+        runIdToIndex = {self.run_ids[irun]: irun for irun in range(len(self.run_ids))}
+        scol = ', '.join(['timestamp', 'run_id', pidnam] + colproc_sums)
+        qry = f"select {scol} from resource{where} order by timestamp"
+        aggs = []         # Bin aggregates for each chunk.
+        nprocs = []       # Process counts for the bins completed in each chunk.
+        pend = None       # Bin and process ID pairs for the last bin of the last chunk.
+        kend = None       # Last bin of the last chunk.
+        nunordered = 0    # Number of rows in bins already completed.
+        tmin = None
+        tmax = None
+        for chunk in pandas.read_sql_query(qry, self._con, params=params, chunksize=chunksize):
+            if self.dbg >= 3: print(f"""{myname}:   Processing chunk with {len(chunk)} rows.""")
+            tims = self.times_from_strings(chunk['timestamp']) - self.t0s[0]
+            run_idxs = chunk['run_id'].map(runIdToIndex)
+            keep = tims.notna().to_numpy() & run_idxs.notna().to_numpy()
+            if not keep.any(): continue
+            tims = tims.to_numpy()[keep]
+            # Bins are closed on the right as with pandas.cut.
+            df = pandas.DataFrame({'kbin': numpy.ceil(tims/dt).astype(numpy.int64) - 1,
+                                   'nval': 1,
+                                   'run_idx': run_idxs.to_numpy()[keep].astype(numpy.int64),
+                                   pidnam: chunk[pidnam].to_numpy()[keep]})
+            for cnam in colproc_sums: df[cnam] = chunk[cnam].to_numpy()[keep].astype(numpy.float64)
+            tmin = tims.min() if tmin is None else min(tmin, tims.min())
+            tmax = tims.max() if tmax is None else max(tmax, tims.max())
+            agdict = {'nval':'sum', 'run_idx':'first'}
+            for cnam in colproc_sums: agdict[cnam] = 'sum'
+            aggs.append(df.groupby('kbin').agg(agdict))
+            # Count processes in the bins that are complete.
+            pairs = df[['kbin', pidnam]].drop_duplicates()
+            if kend is not None:
+                nunordered += (df['kbin'] < kend).sum()
+                pairs = pandas.concat([pend, pairs]).drop_duplicates()
+            kend = df['kbin'].max()
+            isend = pairs['kbin'] >= kend
+            nprocs.append(pairs[~isend].groupby('kbin').size())
+            pend = pairs[isend]
+        if tmin is None:
+            if self.dbg >= 1: print(f"""{myname}: No resources found and so procsum table is empty.""")
+            return pandas.DataFrame()
+        nprocs.append(pend.groupby('kbin').size())
+        if nunordered:
+            print(f"{myname}: WARNING: {nunordered} rows are out of time order and process counts may be too large.")
+        agdict = {'nval':'sum', 'run_idx':'first'}
+        for cnam in colproc_sums: agdict[cnam] = 'sum'
+        agg = pandas.concat(aggs).groupby(level=0).agg(agdict)
+        agg['nproc'] = pandas.concat(nprocs).groupby(level=0).sum().reindex(agg.index)
+        return self._procsum_from_bins(agg, tmin, tmax, colkeeps, colproc_sums, sreps)
+
+    def _sql_time(self, cnam):
+        """
+        Return the SQL expression that evaluates the time in time string column cnam
+        in seconds since the start of the first run as in times_from_strings.
+        """
+        return (f"(strftime('%s', substr({cnam}, 1, 19), 'utc')"
+                f" + cast('0' || substr({cnam}, 20) as real) - {float(self.t0s[0])!r})")
+
+    def _resource_where(self):
+        """Return the SQL condition and parameters that select the resource rows used for this reader."""
+        conds = ['timestamp is not null']
+        params = []
+        if self._run_id is not None:
+            conds.append("run_id=?")
+            params.append(self._run_id)
+        conds.append(f"run_id in ({', '.join('?' for rid in self.run_ids)})")
+        params += list(self.run_ids)
+        return ' and '.join(conds), params
+
+    def _build_procsum_sql(self):
+        """
+        Build procsum without deltas with the binning and sums done in the DB.
+        Only the aggregated bins are read and the result is the same as that from
+        _bin_procsum for the full resource table.
+        """
+        myname = self.__class__.__name__ + "::build_procsum"
+        if 'times' not in self.fixed: raise Exception(f"{myname}: Times must be fixed to build procsum in the DB.")
+        colkeeps, colproc_sums, sreps, pidnam = self._procsum_columns(False)
+        where, params = self._resource_where()
+        qry = f"select resource_monitoring_interval from resource where {where} order by rowid limit 1"
+        dts = pandas.read_sql_query(qry, self._con, params=params)['resource_monitoring_interval']
+        if len(dts) == 0:
+            if self.dbg >= 1: print(f"""{myname}: No resources found and so procsum table is empty.""")
+            return pandas.DataFrame()
+        self.monitoring_interval = dts.iloc[0]
+        dt = self.monitoring_interval
+        # Bin number is ceil(t/dt) - 1 so that bins are closed on the right as with pandas.cut.
+        tdt = f"(t/{float(dt)!r})"
+        kexp = f"(cast({tdt} as integer) - (case when {tdt} > cast({tdt} as integer) then 0 else 1 end))"
+        ssums = ''.join(f", total({cnam}) as {cnam}" for cnam in colproc_sums)
+        scols = ''.join(f", {cnam}" for cnam in colproc_sums)
+        qry = (f"select {kexp} as kbin, count(*) as nval, count(distinct {pidnam}) as nproc,"
+               f" min(run_id) as run_id, min(t) as tmin, max(t) as tmax{ssums}"
+               f" from (select {self._sql_time('timestamp')} as t, run_id, {pidnam}{scols}"
+               f" from resource where {where})"
+               f" group by kbin order by kbin")
+        if self.dbg >= 2: print(f"""{myname}: Query: {qry}""")
+        agg = pandas.read_sql_query(qry, self._con, params=params, index_col='kbin')
+        runIdToIndex = {self.run_ids[irun]: irun for irun in range(len(self.run_ids))}
+        agg['run_idx'] = agg['run_id'].map(runIdToIndex).astype(numpy.int64)
+        return self._procsum_from_bins(agg, agg['tmin'].min(), agg['tmax'].max(), colkeeps, colproc_sums, sreps)
+
+    def _procsum_from_bins(self, agg, tmin, tmax, colkeeps, colproc_sums, sreps):
+        """
+        Build the procsum table from bin aggregates agg indexed by bin number ceil(t/dt)-1
+        with columns nval, nproc and colkeeps and colproc_sums. Times tmin and tmax are the
+        smallest and largest sample times.
+        """
+        dt = self.monitoring_interval
+        # Index bins from the one holding the earliest time and keep the same bins as
+        # _bin_procsum. That drops rows at the lower edge of the first bin and in the
+        # bin holding the latest time.
+        k1 = int(tmin/dt)
+        nbin = len(numpy.arange(k1*dt, int(tmax/dt + 1.0)*dt, dt)) - 1
+        agg = agg[(agg.index >= k1) & (agg.index < k1 + nbin)]
+        ibins = agg.index.to_numpy() - k1
+        newdf = pandas.DataFrame(index=ibins)
+        newdf['timestamp'] = k1*dt + ibins*dt + dt/2
+        newdf['nval'] = agg['nval'].to_numpy()
+        newdf['nproc'] = agg['nproc'].to_numpy()
+        for cnam in colkeeps: newdf[cnam] = agg[cnam].to_numpy()
+        for oldnam in colproc_sums:
+            newnam = oldnam
+            for srep in sreps:
+                if oldnam[0:len(srep)] == srep:
+                    newnam = oldnam.replace(srep, 'procsum_')
+                    break;
+            newdf[newnam] = agg[oldnam].to_numpy()
+        return newdf
+
+    @staticmethod
+    def interpolate_series(tims, vals, segs, qtims, qsegs):
+        """
+        Linearly interpolate the series for many segments (e.g. tasks) to query times.
+          tims - Sample times ordered by segment and then time.
+          vals - Sample values with one row for each sample and one column for each series.
+          segs - Segment number for each sample (non-decreasing).
+          qtims - Query times.
+          qsegs - Segment number for each query.
+        Outside the time range of its segment, the value is that of the first or last sample.
+        Returns an array with one row for each query and one column for each series.
+        """
+        nsam = len(tims)
+        vals = numpy.asarray(vals, dtype=numpy.float64).reshape(nsam, -1)
+        if len(qtims) == 0: return numpy.zeros((0, vals.shape[1]))
+        # Find the last sample at or before each query by sorting samples and queries together.
+        allsegs = numpy.concatenate([segs, qsegs])
+        isqry = numpy.concatenate([numpy.zeros(nsam, dtype=numpy.int8), numpy.ones(len(qtims), dtype=numpy.int8)])
+        order = numpy.lexsort((isqry, numpy.concatenate([tims, qtims]), allsegs))
+        iprevs = numpy.maximum.accumulate(numpy.where(order < nsam, order, -1))
+        qsel = order >= nsam
+        iprev = numpy.empty(len(qtims), dtype=numpy.int64)
+        iprev[order[qsel] - nsam] = iprevs[qsel]
+        # Clamp to the samples in the segment and interpolate.
+        ifirst = numpy.searchsorted(segs, qsegs, 'left')
+        ilast = numpy.searchsorted(segs, qsegs, 'right') - 1
+        i0 = numpy.minimum(numpy.maximum(iprev, ifirst), ilast)
+        i1 = numpy.minimum(i0 + 1, ilast)
+        dts = tims[i1] - tims[i0]
+        wts = numpy.zeros(len(qtims))
+        inside = (dts > 0) & (iprev >= ifirst)
+        wts[inside] = numpy.clip((qtims[inside] - tims[i0[inside]])/dts[inside], 0.0, 1.0)
+        return vals[i0] + wts[:, None]*(vals[i1] - vals[i0])
+
+    def build_procsum_interp(self, delt=None):
+        """
+        Build the procsum table by linear interpolation of the sampled values for each task
+        try onto a grid with spacing delt (default is the monitoring interval). This avoids
+        the spikes from binning samples whose phases differ between tasks.
+        The table has one row for each grid time t in the range of each run with columns:
+          nproc - Number of task tries with samples before and after t.
+          procsum_memory_* - Sum of the interpolated memory values at t.
+          procsum_time_*, procsum_disk_* - Sum of the increases in the interpolated counters
+                                           in the interval (t - delt/2, t + delt/2]. Counters
+                                           are taken to be zero at the time the try started.
+        The table is saved as procsumInterp and procsum.
+        """
+        myname = self.__class__.__name__ + "::build_procsum_interp"
+        if delt is None:
+            if self.monitoring_interval is None: self.build_taskproc_table(False)
+            delt = self.monitoring_interval
+        if 'procsumInterp' in self._tables and delt == self._procsum_interp_delt:
+            if self.dbg >= 1: print(f"""{myname}: Table procsum with interpolation was already built.""")
+            self._tables['procsum'] = self._tables['procsumInterp']
+            return self._tables['procsum']
+        if self.dbg >= 1: print(f"""{myname}: Building table procsum with interpolation for delt = {delt}.""")
+        tp = self._taskproc_tables[False]
+        if tp is None: tp = self.build_taskproc_table(False)
+        colgauges = ['proc_memory_percent', 'proc_memory_resident', 'proc_memory_virtual']
+        colcounts = ['proc_time_user', 'proc_time_system', 'proc_disk_read', 'proc_disk_write']
+        cnams = ['nproc'] + ['procsum' + cnam[4:] for cnam in colgauges + colcounts]
+        if len(tp) == 0 or delt is None or delt <= 0:
+            if self.dbg >= 1: print(f"""{myname}: No resources found and so procsum table is empty.""")
+            newdf = pandas.DataFrame()
+            self._tables['procsumInterp'] = newdf
+            self._tables['procsum'] = newdf
+            return newdf
+        # Each segment is one try of one task.
+        nrow = len(tp)
+        runidxs = tp['run_idx'].to_numpy()
+        keys = tp[['run_idx', 'task_id', 'try_id']].to_numpy()
+        isnew = numpy.ones(nrow, dtype=bool)
+        isnew[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+        starts = numpy.flatnonzero(isnew)
+        ends = numpy.append(starts[1:], nrow)
+        segs = numpy.cumsum(isnew) - 1
+        nseg = len(starts)
+        tims = tp['timestamp'].to_numpy(dtype=numpy.float64)
+        tfirsts = tims[starts]
+        tlasts = tims[ends - 1]
+        seg_runidxs = runidxs[starts]
+        def expand(kmins, kmaxs):
+            """Return the segment and grid index for each grid point in the ranges kmins to kmaxs."""
+            nks = numpy.maximum(kmaxs - kmins + 1, 0)
+            qsegs = numpy.repeat(numpy.arange(nseg), nks)
+            offs = numpy.concatenate([[0], numpy.cumsum(nks)[:-1]])
+            return qsegs, kmins[qsegs] + numpy.arange(len(qsegs)) - offs[qsegs]
+        # Gauges are evaluated at the grid times inside the sampled range.
+        gsegs, gks = expand(numpy.ceil(tfirsts/delt).astype(numpy.int64), numpy.floor(tlasts/delt).astype(numpy.int64))
+        gvals = self.interpolate_series(tims, tp[colgauges].to_numpy(dtype=numpy.float64), segs, gks*delt, gsegs)
+        # Counters start from zero when the try starts running and are evaluated at the bin edges.
+        tanchors = tfirsts - tp['procsum_time_clock'].to_numpy(dtype=numpy.float64)[starts]
+        haveanc = numpy.isfinite(tanchors) & (tanchors < tfirsts)
+        ctims = numpy.concatenate([tims, tanchors[haveanc]])
+        csegs = numpy.concatenate([segs, numpy.flatnonzero(haveanc)])
+        cvals = numpy.concatenate([tp[colcounts].to_numpy(dtype=numpy.float64),
+                                   numpy.zeros((haveanc.sum(), len(colcounts)))])
+        corder = numpy.lexsort((ctims, csegs))
+        cfirsts = numpy.where(haveanc, tanchors, tfirsts)
+        csegs, ctims, cvals = csegs[corder], ctims[corder], cvals[corder]
+        esegs, eks = expand(numpy.floor(cfirsts/delt + 0.5).astype(numpy.int64), numpy.ceil(tlasts/delt + 0.5).astype(numpy.int64))
+        evals = self.interpolate_series(ctims, cvals, csegs, (eks - 0.5)*delt, esegs)
+        # The bin starting at each edge gets the increase to the next edge.
+        isinc = numpy.zeros(len(esegs), dtype=bool)
+        isinc[:-1] = esegs[:-1] == esegs[1:]
+        incs = evals[1:][isinc[:-1]] - evals[:-1][isinc[:-1]]
+        # Sum over segments.
+        gdf = pandas.DataFrame(gvals, columns=cnams[1:1+len(colgauges)])
+        gdf.insert(0, 'nproc', 1)
+        gdf.insert(0, 'kbin', gks)
+        gdf.insert(0, 'run_idx', seg_runidxs[gsegs])
+        cdf = pandas.DataFrame(incs, columns=cnams[1+len(colgauges):])
+        cdf.insert(0, 'kbin', eks[isinc])
+        cdf.insert(0, 'run_idx', seg_runidxs[esegs[isinc]])
+        sums = pandas.concat([gdf, cdf]).groupby(['run_idx', 'kbin']).sum()
+        # Fill the grid for the time range of each run.
+        gidxs = []
+        for irun in numpy.unique(seg_runidxs):
+            kbins = sums.loc[irun].index
+            gidxs.append(pandas.MultiIndex.from_product([[irun], numpy.arange(kbins.min(), kbins.max() + 1)]))
+        sums = sums.reindex(gidxs[0].append(gidxs[1:]), fill_value=0)
+        newdf = pandas.DataFrame({'timestamp': sums.index.get_level_values(1).to_numpy()*delt,
+                                  'run_idx': sums.index.get_level_values(0).to_numpy()})
+        for cnam in cnams: newdf[cnam] = sums[cnam].to_numpy()
+        newdf['nproc'] = newdf['nproc'].astype(numpy.int64)
+        self._procsum_interp_delt = delt
+        self._tables['procsumInterp'] = newdf
         self._tables['procsum'] = newdf
-        self._tables[savename] = newdf
-        if self.nwarnNoOffset:
-            print(f"{myname}: WARNING: Count of tasks with no-offset warning: {self.nwarnNoOffset}")
         return newdf
 
+    @classmethod
+    def fix_columns(cls, dodelta=False):
+        """
+        Return the dictionary of the columns of each table used by fix with or without deltas.
+        These are added to the columns selected for those tables.
+        """
+        cols = {tnam: list(cnams) for tnam, cnams in cls._fix_columns.items()}
+        if dodelta: cols['resource'] += cls._fix_delta_columns
+        return cols
+
+    # Columns of each table used by fix. See fix_columns.
+    _fix_columns = {
+        'workflow': ['workflow_name', 'time_began', 'time_completed'],
+        'task': ['task_func_name', 'task_stderr', 'task_time_returned'],
+        'try': ['task_try_time_launched', 'task_try_time_running', 'task_try_time_returned'],
+        'status': ['task_status_name', 'timestamp'],
+        'resource': ['timestamp', 'resource_monitoring_interval', 'psutil_process_pid',
+                     'psutil_process_memory_percent', 'psutil_process_memory_resident',
+                     'psutil_process_memory_virtual'],
+    }
+    # Resource columns also used to build procsum with deltas.
+    _fix_delta_columns = [
+        'psutil_process_status', 'psutil_process_children_count', 'psutil_process_time_user',
+        'psutil_process_time_system', 'psutil_process_disk_read', 'psutil_process_disk_write',
+    ]
+
+    def _add_fix_columns(self, dodelta):
+        """
+        Add the columns used by fix to the selected columns of each table with a selection.
+        Raise an exception naming the first missing column if a table without it has been read.
+        """
+        myname = self.__class__.__name__ + "::fix"
+        for tnam, cnams in self.fix_columns(dodelta).items():
+            if tnam not in self.select_columns: continue
+            for cnam in cnams:
+                if cnam in self.select_columns[tnam]: continue
+                if tnam in self._tables and cnam not in self._tables[tnam].columns:
+                    raise Exception(f"{myname}: Column {cnam} of table {tnam} is used by fix but was not selected.")
+                self.select_columns[tnam].append(cnam)
+
+    @staged('fix', rows_in=lambda self, *args, **kwargs: self.loaded_row_count(), rows_out=lambda self, res: self.loaded_row_count())
     def fix(self, dodelta =False):
         """Fix everything: runs, workflows, times and tasks."""
+        if len(self.fixed) == 0: self._add_fix_columns(dodelta)
         self.fix_runs()
         self.fix_workflows()
         self.fix_times()
@@ -673,6 +1829,275 @@ class MonDbReader:
         self.fix_try()
         self.build_procsum(dodelta)
 
+    # Tables that parsl updates in place and so are read again in full by refresh.
+    refresh_full_tables = ['workflow', 'task', 'try']
+
+    def refresh(self):
+        """
+        Read and fix the rows added to the DB since the last read, e.g. while a workflow is
+        running, and update the derived tables.
+        Rows are appended to the status, resource and other tables by parsl and only those
+        with SQLite rowid beyond the last one read are read. Rows in the workflow, task and
+        try tables are updated in place and so these tables (one row per task or less) are
+        read again in full.
+        The derived quantities are updated only for the tries and tasks with new rows or
+        changed times: the status columns of the try table from the new status rows, the
+        taskproc rows of the tasks with new resource rows and the taskcounts contributions
+        of the new and changed tries. The procsum tables that have been built are updated
+        by rebinning only the time bins that receive new or changed samples.
+        Runs that start after the first read are not added.
+        The stage records of each refresh replace those of the previous one so that polling
+        does not grow stage_timer.
+        Returns a dictionary with the number of new rows for each table.
+        """
+        if self._refresh_stage_start is None: self._refresh_stage_start = len(self.stage_timer)
+        self.stage_timer.clear(self._refresh_stage_start)
+        return self._refresh()
+
+    @staged('refresh', rows_out=lambda self, res: sum(res.values()))
+    def _refresh(self):
+        """Read the new rows and update the derived tables for refresh."""
+        myname = self.__class__.__name__ + "::refresh"
+        if 'times' not in self.fixed or 'tasks' not in self.fixed:
+            raise Exception(f"{myname}: Times and tasks must be fixed before refresh.")
+        nnews = {}
+        # The indexed copy must be updated and an immutable DB reopened to see the new rows.
+        if self.index_copy or self.access == 'immutable':
+            self._con.close()
+            self._con = self._open_db()
+        # Read again the tables that are updated in place.
+        oldtry = self._tables.get('try')
+        for tnam in self.refresh_full_tables:
+            if tnam not in self._tables: continue
+            tab = self._read_table(tnam)
+            if tnam == 'task': self._index_tasks(tab)
+            nnews[tnam] = len(tab) - len(self._tables[tnam])
+            self._tables[tnam] = tab
+        # Keep the resource task group index if it is up to date so it can be updated.
+        oldres = self._tables.get('resource')
+        oldgrp = self._task_groups.get('resource')
+        if oldgrp is not None and (oldres is None or oldgrp['key'] != (id(oldres), len(oldres), tuple(oldres.columns))):
+            oldgrp = None
+        # Append the new rows to the other tables.
+        newtabs = {}
+        for tnam in self.loaded_table_names():
+            if tnam in self.refresh_full_tables or tnam not in self._db_table_names: continue
+            newtab = self._read_table(tnam, self._rowid_max.get(tnam, 0))
+            nnews[tnam] = len(newtab)
+            if len(newtab) == 0: continue
+            self._tables[tnam] = pandas.concat([self._tables[tnam], newtab], ignore_index=True)
+            # Concatenation drops categories that differ.
+            if 'compact' in self.fixed: self._compact_table(tnam, self._tables[tnam])
+            newtabs[tnam] = newtab
+        if self.dbg: print(f"{myname}: New row counts: {nnews}")
+        # Update the derived quantities.
+        oldranges = self.workflow_time_ranges
+        self._set_workflow_time_ranges()
+        if 'try' in self.fixed:
+            if self._try_status is None:
+                self._try_status = self._status_counts(self.table('status'))
+            elif 'status' in newtabs:
+                self._try_status = self._merge_status_counts(self._try_status, self._status_counts(newtabs['status']))
+            self._set_try_status(self._try_status)
+        self._chain_prompt_count = None
+        self._chain_late_count = None
+        # Find the tries that are new or changed.
+        ipos = None
+        runkeys = numpy.zeros(0, dtype=numpy.int64)
+        if oldtry is not None and 'try' in self._tables:
+            ttry = self._tables['try']
+            ipos = self._try_positions(oldtry, ttry)
+            isold = ipos >= 0
+            tnew = ttry['task_try_time_running'].to_numpy(dtype=numpy.float64)
+            told = numpy.full(len(ttry), numpy.nan)
+            told[isold] = oldtry['task_try_time_running'].to_numpy(dtype=numpy.float64)[ipos[isold]]
+            chg = (tnew != told) & ~(numpy.isnan(tnew) & numpy.isnan(told))
+            runkeys = numpy.unique(self._group_keys(ttry['run_idx'].to_numpy()[chg], ttry['task_id'].to_numpy()[chg]))
+        if 'resource' in newtabs or len(runkeys):
+            self._refresh_procsum(newtabs.get('resource'), 0 if oldres is None else len(oldres), oldgrp, runkeys)
+        if len(self._taskcounts):
+            if ipos is None: self.taskcounts(delt=self.taskcount_delt, force=True)
+            else: self._refresh_taskcounts(oldtry, ipos, oldranges)
+        return nnews
+
+    @staticmethod
+    def _try_positions(oldtry, ttry):
+        """Return the position in try table oldtry of each try in ttry or -1 if it is not there."""
+        keys = ['run_idx', 'task_id', 'try_id']
+        ipos = pandas.Series(numpy.arange(len(oldtry)), index=pandas.MultiIndex.from_frame(oldtry[keys]))
+        ipos = ipos[~ipos.index.duplicated()].reindex(pandas.MultiIndex.from_frame(ttry[keys]))
+        return ipos.fillna(-1).to_numpy(dtype=numpy.int64)
+
+    def _refresh_procsum(self, newres, nold, oldgrp, runkeys):
+        """
+        Update the taskproc and procsum tables for the new resource rows newres appended at
+        position nold and for the tasks with keys runkeys (see _group_keys) whose try running
+        times changed. oldgrp is the resource task group index before the rows were appended
+        or None if it was not built.
+        """
+        for itp in range(2):
+            self.taskprocs[itp] = [{} for irun in range(len(self.workflow_time_ranges))]
+        if oldgrp is None:
+            for itp in range(2):
+                if self._taskproc_tables[itp] is not None: self.build_taskproc_table(bool(itp))
+        else:
+            oldgroups = self._update_task_group_index('resource', oldgrp, nold, runkeys)
+            found = None
+            for itp in range(2):
+                if self._taskproc_tables[itp] is not None:
+                    found = self._merge_taskproc_table(bool(itp), oldgrp, oldgroups)
+            if found is not None:
+                isold = oldgroups >= 0
+                allfound = numpy.ones(len(oldgroups), dtype=bool)
+                if self._taskproc_found is not None: allfound[isold] = self._taskproc_found[oldgroups[isold]]
+                allfound[~isold] = found
+                self._taskproc_found = allfound
+                self.nwarnNoOffset = int((~allfound).sum())
+        # Find the name of the table that procsum refers to.
+        psnam = None
+        for savename in ['procsumNoDelta', 'procsumDelta', 'procsumInterp']:
+            if savename in self._tables and self._tables.get('procsum') is self._tables[savename]:
+                if psnam is None or savename == ('procsumDelta' if self._dodelta else 'procsumNoDelta'):
+                    psnam = savename
+        # Earliest time of the new samples and of the samples for tasks with changed clock times.
+        tnew = numpy.inf if newres is None or len(newres) == 0 else newres['timestamp'].min()
+        tchg = tnew
+        for dodelta, savename in [(False, 'procsumNoDelta'), (True, 'procsumDelta')]:
+            if savename not in self._tables: continue
+            oldtab = self._tables[savename]
+            if len(oldtab) == 0 or self.monitoring_interval is None:
+                del self._tables[savename]
+                self.build_procsum(dodelta)
+                continue
+            dt = self.monitoring_interval
+            colkeeps, colproc_sums, sreps, pidnam = self._procsum_columns(dodelta)
+            if dodelta:
+                if len(runkeys):
+                    grp = self.task_group_index('resource')
+                    ichgs = numpy.flatnonzero(numpy.isin(self._group_keys(grp['run_idx'], grp['task_id']), runkeys))
+                    if len(ichgs): tchg = min(tchg, grp['table']['timestamp'].to_numpy()[grp['starts'][ichgs]].min())
+                tmin = tchg
+                olddf = self._taskproc_tables[True]
+                if olddf is None: olddf = self.build_taskproc_table(True)
+            else:
+                tmin = tnew
+                olddf = self.table('resource')
+            if tmin == numpy.inf: continue
+            # Rebin the samples in and after the first bin with new or changed samples. Bin edges
+            # are multiples of the monitoring interval. The bin holding the latest sample is
+            # dropped by _bin_procsum and so is also rebinned.
+            tcut = min((numpy.ceil(tmin/dt) - 1)*dt, oldtab['timestamp'].iloc[-1] + dt/2)
+            olddf = olddf.loc[olddf['timestamp'].to_numpy() > tcut, ['timestamp', pidnam] + colkeeps + colproc_sums]
+            newtab = self._bin_procsum(olddf, colkeeps, colproc_sums, sreps, pidnam)
+            # Use the same bin indexing as the existing table.
+            t1 = oldtab['timestamp'].iloc[0] - dt/2
+            newtab.index = numpy.rint((newtab['timestamp'].to_numpy() - dt/2 - t1)/dt).astype(numpy.int64)
+            self._tables[savename] = pandas.concat([oldtab[oldtab['timestamp'] < tcut], newtab])
+        # The interpolated table is rebuilt.
+        if 'procsumInterp' in self._tables:
+            del self._tables['procsumInterp']
+            self.build_procsum_interp(self._procsum_interp_delt)
+        if psnam is not None: self._tables['procsum'] = self._tables[psnam]
+
+    def _time_order(self, tnam, tab, tcol):
+        """
+        Return the row positions of table tab ordered by run index and then time column tcol,
+        and the run indices and times in that order. These are cached until the table changes.
+        """
+        key = (tnam, tcol)
+        if key in self._time_orders:
+            tabid, nrow, order, runidxs, tims = self._time_orders[key]
+            if tabid == id(tab) and nrow == len(tab): return order, runidxs, tims
+        runidxs = tab['run_idx'].to_numpy()
+        tims = tab[tcol].to_numpy(dtype=numpy.float64)
+        # NaN times sort to the end of each run.
+        order = numpy.lexsort((tims, runidxs))
+        runidxs = runidxs[order]
+        tims = tims[order]
+        self._time_orders[key] = (id(tab), len(tab), order, runidxs, tims)
+        return order, runidxs, tims
+
+    def _time_rows(self, tnam, tab, tcol, t1, t2, run_idx):
+        """Return the sorted positions of the rows in tab for run run_idx with t1 <= tcol <= t2."""
+        order, runidxs, tims = self._time_order(tnam, tab, tcol)
+        ir1 = numpy.searchsorted(runidxs, run_idx, 'left')
+        ir2 = numpy.searchsorted(runidxs, run_idx, 'right')
+        i1 = ir1 + numpy.searchsorted(tims[ir1:ir2], t1, 'left')
+        i2 = ir1 + numpy.searchsorted(tims[ir1:ir2], t2, 'right')
+        return numpy.sort(order[i1:i2])
+
+    def _time_string(self, tim, roundup):
+        """
+        Return the DB time string for time tim (seconds since the start of the first run)
+        rounded down or up to a whole second.
+        """
+        tim = self.t0s[0] + tim
+        tim = numpy.floor(tim) + 1 if roundup else numpy.floor(tim)
+        return datetime.datetime.fromtimestamp(tim).strftime('%Y-%m-%d %H:%M:%S')
+
+    def window(self, t1, t2, run_idx=0, delt=None):
+        """
+        Return a dictionary of the tables restricted to times t1 <= t <= t2 (seconds since
+        the start of the first run) for run index run_idx:
+          resource - Rows with timestamp in the window.
+          status - Rows with timestamp in the window.
+          try - Tries that are launched before t2 and not returned before t1.
+          procsum - Bins with timestamp in the window.
+          taskcounts - Dictionary of taskcounts tables indexed by state with times in the
+                       window. The tables are evaluated with spacing delt if that is given.
+        Rows are found with binary search on time-ordered row positions that are evaluated
+        once for each table. In lazy mode, tables that have not been read are queried in the
+        DB for the window (and so should be read with index_copy=True for large DBs).
+        Tables that do not exist are None.
+        """
+        myname = self.__class__.__name__ + "::window"
+        if 'times' not in self.fixed or 'runs' not in self.fixed:
+            raise Exception(f"{myname}: Runs and times must be fixed to use windows.")
+        if run_idx < 0 or run_idx >= len(self.run_ids):
+            raise Exception(f"{myname}: Run index {run_idx} is out of range.")
+        out = {}
+        run_id = self.run_ids[run_idx]
+        for tnam in ['resource', 'status']:
+            if tnam in self._tables:
+                tab = self._tables[tnam]
+                out[tnam] = tab.iloc[self._time_rows(tnam, tab, 'timestamp', t1, t2, run_idx)]
+            elif tnam in self._db_table_names:
+                where = "run_id=? and timestamp>=? and timestamp<=?"
+                tab = self._read_table(tnam, where=where, wparams=[run_id, self._time_string(t1, False), self._time_string(t2, True)])
+                out[tnam] = tab[(tab['timestamp'] >= t1) & (tab['timestamp'] <= t2)]
+            else:
+                out[tnam] = None
+        tnam = 'try'
+        tlau = 'task_try_time_launched'
+        tret = 'task_try_time_returned'
+        if tnam in self._tables:
+            tab = self._tables[tnam]
+            rows = self._time_rows(tnam, tab, tlau, -numpy.inf, t2, run_idx)
+            trets = tab[tret].to_numpy(dtype=numpy.float64)[rows]
+            out[tnam] = tab.iloc[rows[~(trets < t1)]]
+        elif tnam in self._db_table_names:
+            where = f"run_id=? and {tlau}<=? and ({tret} is null or {tret}>=?)"
+            tab = self._read_table(tnam, where=where, wparams=[run_id, self._time_string(t2, True), self._time_string(t1, False)])
+            out[tnam] = tab[(tab[tlau] <= t2) & ~(tab[tret] < t1)]
+        else:
+            out[tnam] = None
+        tab = self._tables.get('procsum')
+        if tab is not None and len(tab):
+            out['procsum'] = tab.iloc[self._time_rows('procsum', tab, 'timestamp', t1, t2, run_idx)]
+        else:
+            out['procsum'] = tab
+        tcs = None
+        if delt is not None: self.taskcounts(runidx=run_idx, delt=delt)
+        if run_idx < len(self._taskcounts):
+            tcs = {}
+            for snam, tab in self._taskcounts[run_idx].items():
+                tims = tab['time'].to_numpy()
+                i1 = numpy.searchsorted(tims, t1, 'left')
+                i2 = numpy.searchsorted(tims, t2, 'right')
+                tcs[snam] = tab.iloc[i1:i2]
+        out['taskcounts'] = tcs
+        return out
+
     def workflow_time_range(self, iwkf, unit='second'):
         """Return the time range for workflow iwkf."""
         wkf = self.table('workflow')
@@ -686,13 +2111,17 @@ class MonDbReader:
         t2 = fac*wkf['time_completed'][iwkf]
         return (t1, t2)
 
-    def taskcounts(self, state=None, runidx=0, delt=None, force=False):
+    def taskcounts(self, state=None, runidx=0, delt=None, force=False, engine='events'):
         """
         Return a dataframe time:0:1:...:(ntsk-1):all with the number of tasks for each
         task index for the given state and run index.
         States are ['launched', 'running', 'returned']
         The values for all states and runs are evaluated on the first call or if
         delt >0 changes.
+        The engine used to evaluate the counts is
+          events - The state times are binned and accumulated for all tries at once.
+          loop - The count for each try is added to the table in a loop over tries.
+        See taskcount_steps for a representation that does not depend on delt.
         """
         myname = 'TestMonDbReader:taskcounts'
         nrun = self.nrun
@@ -700,69 +2129,201 @@ class MonDbReader:
         if runidx >= nrun: return None
         if delt is not None and (force or len(self._taskcounts) != nrun or delt != self.taskcount_delt):
             if self.dbg > 0: print(f"{myname}: Evaluating taskcounts.")
-            ntsk = len(self.task_names)
-            snams = ['launched', 'running', 'returned']
-            tnams = list(range(ntsk))
-            cnams = ['time'] + tnams
-            nsta = len(snams)
-            self.taskcount_delt = delt
-            tcs = []
-            # Loop over runs and create zeroed task counters.
-            toff_global = 0
-            for irun in range(nrun):
-                t1 = self.workflow_time_ranges[irun][0]
-                t2 = self.workflow_time_ranges[irun][1]
-                toff = t1
-                ntim = int((t2-t1)/delt) + 1
-                empty_count = pandas.Series(ntim*[0.0], name='time')  # When task does not have time for a state, all counts are zero
-                df = pandas.DataFrame(0, index=range(ntim), columns=cnams, dtype=numpy.float64)
-                df['time'] = numpy.arange(t1-toff, t2-toff+10*delt, delt)[0:ntim]
-                tcs.append({})
-                for snam in snams:
-                    tcs[irun][snam] = df.copy()
-                toff_global = toff_global
-            # Loop over tries and fill the counters.
-            for row in self.table('try').itertuples():
-                irun = row.run_idx
-                t1 = self.workflow_time_ranges[irun][0]
-                for snam in snams:
-                    mytcss = tcs[irun]
-                    mytcs = mytcss[snam]
-                    cnam_try = 'task_try_time_' + snam
-                    cnam_tcs = row.task_idx
-                    rawtime = getattr(row, cnam_try)
-                    if rawtime is None or not rawtime==rawtime:     # Meaning the task never reached the state
-                        count = empty_count
-                    else:
-                        time = rawtime - t1
-                        count = ((mytcs['time'] + delt - time)/delt).clip(0.0,1.0)
-                    if count.isnull().sum():
-                        print(f"{myname}: ERROR: Skipping task {row.task_id} {snam} with nan values: count = \n{count}")
-                        print(mytcs)
-                        print('---------------------------------------')
-                        print(f"{myname}: delt = {delt}")
-                        print(f"{myname}: t1 = {t1}")
-                        print('---------------------------------------')
-                        print(f"time: {time}")
-                        print('---------------------------------------')
-                        print(f"Row: \n{row}")
-                        print('=======================================')
-                    else:
-                        if mytcs.loc[:, cnam_tcs].dtype != count.dtype:
-                            print(f"{myname}: WARNING: Type mismatch for column {cnam_tcs}: {mytcs.loc[:, cnam_tcs].dtype} != {count.dtype}")
+            if engine == 'events':
+                self.taskcount_delt = delt
+                self._taskcounts = self._taskcounts_from_events(delt)
+            elif engine != 'loop':
+                raise Exception(f"{myname}: Invalid engine: {engine}")
+            else:
+                ntsk = len(self.task_names)
+                snams = ['launched', 'running', 'returned']
+                tnams = list(range(ntsk))
+                cnams = ['time'] + tnams
+                nsta = len(snams)
+                self.taskcount_delt = delt
+                tcs = []
+                # Loop over runs and create zeroed task counters.
+                toff_global = 0
+                for irun in range(nrun):
+                    t1 = self.workflow_time_ranges[irun][0]
+                    t2 = self.workflow_time_ranges[irun][1]
+                    toff = t1
+                    ntim = int((t2-t1)/delt) + 1
+                    empty_count = pandas.Series(ntim*[0.0], name='time')  # When task does not have time for a state, all counts are zero
+                    df = pandas.DataFrame(0, index=range(ntim), columns=cnams, dtype=numpy.float64)
+                    df['time'] = numpy.arange(t1-toff, t2-toff+10*delt, delt)[0:ntim]
+                    tcs.append({})
+                    for snam in snams:
+                        tcs[irun][snam] = df.copy()
+                    toff_global = toff_global
+                # Loop over tries and fill the counters.
+                for row in self.table('try').itertuples():
+                    irun = row.run_idx
+                    t1 = self.workflow_time_ranges[irun][0]
+                    for snam in snams:
+                        mytcss = tcs[irun]
+                        mytcs = mytcss[snam]
+                        cnam_try = 'task_try_time_' + snam
+                        cnam_tcs = row.task_idx
+                        rawtime = getattr(row, cnam_try)
+                        if rawtime is None or not rawtime==rawtime:     # Meaning the task never reached the state
+                            count = empty_count
+                        else:
+                            time = rawtime - t1
+                            count = ((mytcs['time'] + delt - time)/delt).clip(0.0,1.0)
+                        if count.isnull().sum():
+                            print(f"{myname}: ERROR: Skipping task {row.task_id} {snam} with nan values: count = \n{count}")
                             print(mytcs)
-                            mytcs[cnam_tcs].apply(numpy.float64)
-                        mytcs.loc[:, cnam_tcs] += count
-            # Add a column with sum over tasks.
-            for irun in range(nrun):
-                for snam in snams:
-                    mytcs = tcs[irun][snam]
-                    mytcs['all'] = mytcs[tnams].sum(1)
-                    if self.dbg>=2: print(f"{myname}:irun,snam,nrow: {irun}, {snam}, {len(mytcs)}")
-            self._taskcounts = tcs
+                            print('---------------------------------------')
+                            print(f"{myname}: delt = {delt}")
+                            print(f"{myname}: t1 = {t1}")
+                            print('---------------------------------------')
+                            print(f"time: {time}")
+                            print('---------------------------------------')
+                            print(f"Row: \n{row}")
+                            print('=======================================')
+                        else:
+                            if mytcs.loc[:, cnam_tcs].dtype != count.dtype:
+                                print(f"{myname}: WARNING: Type mismatch for column {cnam_tcs}: {mytcs.loc[:, cnam_tcs].dtype} != {count.dtype}")
+                                print(mytcs)
+                                mytcs[cnam_tcs].apply(numpy.float64)
+                            mytcs.loc[:, cnam_tcs] += count
+                # Add a column with sum over tasks.
+                for irun in range(nrun):
+                    for snam in snams:
+                        mytcs = tcs[irun][snam]
+                        mytcs['all'] = mytcs[tnams].sum(axis=1)
+                        if self.dbg>=2: print(f"{myname}:irun,snam,nrow: {irun}, {snam}, {len(mytcs)}")
+                self._taskcounts = tcs
         if state is None: return
         return self._taskcounts[runidx][state]
 
+    def _taskcounts_from_events(self, delt):
+        """
+        Evaluate the taskcounts tables for all runs and states by binning the state times.
+        A try reaching a state at time x contributes (t + delt - x)/delt, clipped to [0, 1],
+        to the count at time t. This is 1 for times after x and fractional only in the bin
+        holding x so the counts are the cumulative sum of whole tries plus the fractions.
+        """
+        myname = self.__class__.__name__ + "::taskcounts"
+        nrun = self.nrun
+        ntsk = len(self.task_names)
+        snams = ['launched', 'running', 'returned']
+        tnams = list(range(ntsk))
+        ttry = self.table('try')
+        runidxs = ttry['run_idx'].to_numpy()
+        taskidxs = ttry['task_idx'].to_numpy()
+        tcs = []
+        for irun in range(nrun):
+            t1 = self.workflow_time_ranges[irun][0]
+            t2 = self.workflow_time_ranges[irun][1]
+            ntim = int((t2-t1)/delt) + 1
+            tims = numpy.arange(0.0, t2-t1+10*delt, delt)[0:ntim]
+            tcs.append({})
+            for snam in snams:
+                xs = ttry['task_try_time_' + snam].to_numpy(dtype=numpy.float64) - t1
+                sel = (runidxs == irun) & ~numpy.isnan(xs) & (taskidxs >= 0)
+                counts = self._event_counts(xs[sel], taskidxs[sel], tims, delt, ntsk)
+                df = pandas.DataFrame(counts, columns=tnams)
+                df.insert(0, 'time', tims)
+                df['all'] = df[tnams].sum(axis=1)
+                tcs[irun][snam] = df
+                if self.dbg>=2: print(f"{myname}:irun,snam,nrow: {irun}, {snam}, {len(df)}")
+        return tcs
+
+    @staticmethod
+    def _event_counts(xs, itsks, tims, delt, ntsk):
+        """
+        Return the array (time, task index) of the counts at times tims for tries reaching
+        a state at times xs with task indices itsks. See _taskcounts_from_events.
+        """
+        ntim = len(tims)
+        itsks = numpy.asarray(itsks).astype(numpy.int64)
+        # Index of the last time before each state time.
+        itims = numpy.searchsorted(tims, xs, side='left') - 1
+        counts = numpy.bincount((itims + 1)*ntsk + itsks, minlength=(ntim + 1)*ntsk)
+        counts = counts.reshape(ntim + 1, ntsk)[0:ntim].cumsum(axis=0).astype(numpy.float64)
+        ispart = itims >= 0
+        fracs = ((tims[itims[ispart]] + delt - xs[ispart])/delt).clip(0.0, 1.0)
+        counts += numpy.bincount(itims[ispart]*ntsk + itsks[ispart], weights=fracs,
+                                 minlength=ntim*ntsk).reshape(ntim, ntsk)
+        return counts
+
+    def _refresh_taskcounts(self, oldtry, ipos, oldranges):
+        """
+        Update the taskcounts tables after the try table was read again. Only the tries that
+        are new or have changed state times since oldtry are counted again for the existing
+        times and the counts for all tries are evaluated for the times added at the end.
+        ipos is the position in oldtry of each try (see _try_positions) and oldranges are
+        the workflow time ranges used for the existing tables.
+        """
+        myname = self.__class__.__name__ + "::taskcounts"
+        delt = self.taskcount_delt
+        nrun = self.nrun
+        ntsk = len(self.task_names)
+        snams = ['launched', 'running', 'returned']
+        tnams = list(range(ntsk))
+        tcs = self._taskcounts
+        # Evaluate again if the tasks or the start of a run changed or a run is shorter.
+        redo = len(tcs) != nrun or len(oldranges) != nrun
+        for irun in range(nrun):
+            if redo: break
+            t1, t2 = self.workflow_time_ranges[irun]
+            redo = list(tcs[irun][snams[0]].columns[1:-1]) != tnams or t1 != oldranges[irun][0] or \
+                   int((t2-t1)/delt) + 1 < len(tcs[irun][snams[0]])
+        if redo:
+            if self.dbg > 0: print(f"{myname}: Evaluating taskcounts.")
+            self._taskcounts = self._taskcounts_from_events(delt)
+            return
+        ttry = self.table('try')
+        runidxs = ttry['run_idx'].to_numpy()
+        taskidxs = ttry['task_idx'].to_numpy()
+        isold = ipos >= 0
+        for irun in range(nrun):
+            t1, t2 = self.workflow_time_ranges[irun]
+            ntim = int((t2-t1)/delt) + 1
+            tims = numpy.arange(0.0, t2-t1+10*delt, delt)[0:ntim]
+            for snam in snams:
+                cnam = 'task_try_time_' + snam
+                xs = ttry[cnam].to_numpy(dtype=numpy.float64) - t1
+                xolds = numpy.full(len(ttry), numpy.nan)
+                xolds[isold] = oldtry[cnam].to_numpy(dtype=numpy.float64)[ipos[isold]] - t1
+                sel = (runidxs == irun) & (taskidxs >= 0)
+                chg = sel & (xs != xolds) & ~(numpy.isnan(xs) & numpy.isnan(xolds))
+                oldcounts = tcs[irun][snam][tnams].to_numpy()
+                nold = len(oldcounts)
+                counts = numpy.empty((ntim, ntsk))
+                counts[0:nold] = oldcounts
+                for xvals, sgn in [(xs, 1.0), (xolds, -1.0)]:
+                    use = chg & ~numpy.isnan(xvals)
+                    counts[0:nold] += sgn*self._event_counts(xvals[use], taskidxs[use], tims[0:nold], delt, ntsk)
+                use = sel & ~numpy.isnan(xs)
+                counts[nold:] = self._event_counts(xs[use], taskidxs[use], tims[nold:], delt, ntsk)
+                df = pandas.DataFrame(counts, columns=tnams)
+                df.insert(0, 'time', tims)
+                df['all'] = df[tnams].sum(axis=1)
+                tcs[irun][snam] = df
+
+    def taskcount_steps(self, state, runidx=0):
+        """
+        Return a dataframe time:task_idx:count:all describing the task counts for the given
+        state and run index as step functions.
+        There is one row for each try that reached the state, ordered by time relative to the
+        start of the run. Column count is the number of tries for that task index and all is
+        the number for all task indices that have reached the state at that time.
+        The size depends only on the number of tries and not on the run duration.
+        """
+        if runidx >= self.nrun: return None
+        ttry = self.table('try')
+        t1 = self.workflow_time_ranges[runidx][0]
+        xs = ttry['task_try_time_' + state].to_numpy(dtype=numpy.float64) - t1
+        sel = (ttry['run_idx'].to_numpy() == runidx) & ~numpy.isnan(xs)
+        df = pandas.DataFrame({'time': xs[sel], 'task_idx': ttry['task_idx'].to_numpy()[sel]})
+        df.sort_values(by='time', kind='stable', ignore_index=True, inplace=True)
+        df['count'] = df.groupby('task_idx').cumcount() + 1
+        df['all'] = numpy.arange(1, len(df) + 1)
+        return df
+
     def chaintasks(self):
         """
         Build task chains with 1-1 associations between the end of one task and start of
@@ -791,29 +2352,39 @@ class MonDbReader:
         cnam2 = 'task_try_time_returned'
         ttr1 = ttr.sort_values(by=[cnam1])
         ttr2 = ttr.sort_values(by=[cnam2])
-        ttr1.reset_index()
-        loc1 = 0
-        first = True
+        t1s = ttr1[cnam1].to_numpy(dtype=numpy.float64)
+        t2s = ttr2[cnam2].to_numpy(dtype=numpy.float64)
+        ntry = len(ttr)
         self._chain_late_count = 0
         ttr['latency'] = 0.0
-        for i2, row2 in ttr2.iterrows():
-            t2 = row2[cnam2]
-            nskip = 0
-            while loc1 < len(ttr1):
-                i1 = ttr1.index[loc1]
-                t1 = ttr1.iloc[loc1][cnam1]
-                loc1 += 1
-                if t1 > t2:
-                    ttr.at[i1, 'last_try'] = i2
-                    ttr.at[i2, 'next_try'] = i1
-                    ttr.at[i1, 'latency'] = t1 - t2
-                    break
-                nskip += 1
-            if first:
-                self._chain_prompt_count = nskip
-                first = False
-            else:
-                self._chain_late_count += nskip
+        if ntry == 0: return
+        # Tries without a start time are sorted to the end and are never associated.
+        nstart = int((~numpy.isnan(t1s)).sum())
+        # Each end time is associated with the first unassociated start that follows it.
+        # With s2 the position of the first start after end i2, the position of the
+        # associated start is j2 = max(j2-1 + 1, s2) = i2 + max(s - i for i <= i2).
+        locs = numpy.searchsorted(t1s[0:nstart], t2s, side='right')
+        locs[numpy.isnan(t2s)] = nstart
+        i2s = numpy.arange(ntry)
+        locs = i2s + numpy.maximum.accumulate(locs - i2s)
+        nchain = int((locs < nstart).sum())
+        # Numbers of starts skipped for each end. After the last association, the remaining
+        # starts are skipped by the next end.
+        nskips = numpy.zeros(ntry, dtype=numpy.int64)
+        nskips[0:nchain] = locs[0:nchain] - numpy.concatenate([[0], locs[0:nchain-1] + 1])[0:nchain]
+        if nchain < ntry:
+            nskips[nchain] = ntry - (locs[nchain-1] + 1 if nchain else 0)
+        self._chain_prompt_count = int(nskips[0])
+        self._chain_late_count = int(nskips[1:].sum())
+        # Record the associations.
+        if nchain:
+            idx1s = ttr1.index[locs[0:nchain]]
+            idx2s = ttr2.index[0:nchain]
+            ttr['last_try'] = numpy.nan
+            ttr['next_try'] = numpy.nan
+            ttr.loc[idx1s, 'last_try'] = idx2s
+            ttr.loc[idx2s, 'next_try'] = idx1s
+            ttr.loc[idx1s, 'latency'] = t1s[locs[0:nchain]] - t2s[0:nchain]
 
     def taskchain_count(self, opt='all'):
         """Return the number of task chains."""
@@ -12,6 +12,7 @@ import glob
 import collections
 import pandas
 import desc.wfmon
+from desc.wfmon.stagetimer import StageTimer, staged
 
 class PerfStatLogReader:
 
@@ -30,6 +31,7 @@ class PerfStatLogReader:
         self.dict = collections.OrderedDict()
         self._table = pandas.DataFrame()
         self.allow_time_only = True  # Allow time info to be read before or without perfstat data.
+        self.stage_timer = StageTimer({'class': self.__class__.__name__})  # Time for each call of read_mondb_logs.
 
     def table(self):
         """
@@ -148,6 +150,8 @@ class PerfStatLogReader:
             return 1
 
 
+    @staged('read_mondb_logs', label=lambda self, dbr, *args, **kwargs: dbr.filename,
+            rows_in=lambda self, dbr, *args, **kwargs: len(dbr.table('task')), rows_out=lambda self, res: res['nkeep'])
     def read_mondb_logs(self, dbr, dbg=0):
         """
         Read data from logs referenced by a MondDbReader.
@@ -171,7 +175,6 @@ class PerfStatLogReader:
                 print(f"{myname}: Fixing input times.")
             dbr.fix_times()
         tsk = dbr.table('task')
-        ttr = dbr.table('try')
         nkeep = 0
         nskip = 0
         for tid in range(len(tsk)):
@@ -179,7 +182,7 @@ class PerfStatLogReader:
             for nam in ['run_idx', 'task_idx', 'task_id']: indict[nam] = tsk[nam][tid]
             sqry = f"run_idx=={indict['run_idx']} and task_id=={indict['task_id']}"
             # Find the matching row(s) in the try table and extract the run start and stop times.
-            ttrm = ttr.query(sqry)
+            ttrm = dbr.task_rows('try', indict['run_idx'], indict['task_id'])
             nttrm = len(ttrm)
             if len(ttrm) != 1:
                 print(f"{myname}: WARNING: Try count is {nttrm} for query '{sqry}' ")
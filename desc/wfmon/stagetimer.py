@@ -0,0 +1,121 @@
+# stagetimer.py
+#
+# David Adams
+# October 2026
+
+"""
+Record the wall time, CPU time, peak memory growth and row counts for processing stages.
+"""
+
+import sys
+import json
+import time
+import functools
+import contextlib
+import pandas
+try:
+    import resource
+except ImportError:    # Not available on Windows.
+    resource = None
+
+def peak_rss():
+    """Return the peak resident memory (MB) of this process or None if it is not known."""
+    if resource is None: return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The value is in bytes on macOS and KiB elsewhere.
+    return maxrss/2**20 if sys.platform == 'darwin' else maxrss/2**10
+
+class StageTimer:
+    """
+    Holds a record for each stage (call of an instrumented method) with the columns:
+      stage - Stage name, e.g. fix_times.
+      label - Label for the call, e.g. the table name for reads.
+      depth - Number of enclosing stages.
+      wall - Wall time [sec].
+      cpu - CPU time of this process [sec].
+      rss_peak_delta - Increase in the peak resident memory of this process [MB]. This is
+                       zero for stages that do not exceed the peak of earlier stages.
+      rows_in, rows_out - Numbers of input and output rows where meaningful.
+    Records are in the order the stages start so enclosing stages precede those they hold.
+    """
+
+    columns = ['stage', 'label', 'depth', 'wall', 'cpu', 'rss_peak_delta', 'rows_in', 'rows_out']
+
+    def __init__(self, info=None):
+        self.info = {} if info is None else dict(info)   # Description written with the records.
+        self.records = []     # Stage records.
+        self._depth = 0       # Number of stages in progress.
+
+    def __len__(self):
+        return len(self.records)
+
+    def start(self, stage, label=None, rows_in=None):
+        """Start a stage and return its record."""
+        rec = {'stage': stage, 'label': label, 'depth': self._depth, 'wall': time.perf_counter(),
+               'cpu': time.process_time(), 'rss_peak_delta': peak_rss(), 'rows_in': rows_in, 'rows_out': None}
+        self.records.append(rec)
+        self._depth += 1
+        return rec
+
+    def stop(self, rec, rows_out=None):
+        """End the stage with record rec."""
+        rec['wall'] = time.perf_counter() - rec['wall']
+        rec['cpu'] = time.process_time() - rec['cpu']
+        if rec['rss_peak_delta'] is not None: rec['rss_peak_delta'] = peak_rss() - rec['rss_peak_delta']
+        if rows_out is not None: rec['rows_out'] = rows_out
+        self._depth -= 1
+
+    @contextlib.contextmanager
+    def stage(self, stage, label=None, rows_in=None):
+        """
+        Context manager that records the enclosed block as a stage. It yields the record
+        so rows_out can be set in the block. The stage is ended if the block raises.
+        """
+        rec = self.start(stage, label, rows_in)
+        try:
+            yield rec
+        finally:
+            self.stop(rec)
+
+    def clear(self, istart=0):
+        """Remove the records from position istart on (all records by default)."""
+        del self.records[istart:]
+
+    def table(self):
+        """Return the records as a dataframe."""
+        return pandas.DataFrame(self.records, columns=self.columns)
+
+    def to_json(self, fnam=None):
+        """
+        Return a JSON string holding info and the records. If fnam is not None, the string
+        is also written to that file.
+        """
+        sjson = json.dumps({'info': self.info, 'stages': self.records}, indent=1, default=str)
+        if fnam is not None:
+            with open(fnam, 'w') as fout:
+                fout.write(sjson)
+        return sjson
+
+def staged(stage, label=None, rows_in=None, rows_out=None):
+    """
+    Decorator that records each call of a method as a stage with name stage in the object
+    member stage_timer. Optional functions give the other fields:
+      label(self, *args, **kwargs) - Label for the call.
+      rows_in(self, *args, **kwargs) - Number of input rows.
+      rows_out(self, result) - Number of output rows.
+    """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(self, *args, **kwargs):
+            timer = getattr(self, 'stage_timer', None)
+            if timer is None: return fun(self, *args, **kwargs)
+            rec = timer.start(stage, None if label is None else label(self, *args, **kwargs),
+                              None if rows_in is None else rows_in(self, *args, **kwargs))
+            try:
+                res = fun(self, *args, **kwargs)
+            finally:
+                timer.stop(rec)
+            if rows_out is not None: rec['rows_out'] = rows_out(self, res)
+            return res
+        return wrapper
+    return decorator
@@ -0,0 +1,317 @@
+# synthetic.py
+#
+# David Adams
+# October 2026
+
+"""
+Write synthetic parsl run directories for testing and benchmarking: a monitoring DB with
+the parsl schema plus function_data and perf stat logs for each task.
+"""
+
+import os
+import datetime
+import itertools
+import sqlite3
+import numpy
+
+# Columns and types for each table in the parsl monitoring DB.
+schema = {
+  'workflow': [('run_id', 'text'), ('workflow_name', 'text'), ('workflow_version', 'text'),
+               ('time_began', 'text'), ('time_completed', 'text'), ('host', 'text'), ('user', 'text'),
+               ('rundir', 'text'), ('tasks_failed_count', 'int'), ('tasks_completed_count', 'int')],
+  'task': [('task_id', 'int'), ('run_id', 'text'), ('task_depends', 'text'), ('task_func_name', 'text'),
+           ('task_memoize', 'int'), ('task_hashsum', 'text'), ('task_inputs', 'text'), ('task_outputs', 'text'),
+           ('task_stdin', 'text'), ('task_stdout', 'text'), ('task_stderr', 'text'), ('task_time_invoked', 'text'),
+           ('task_time_returned', 'text'), ('task_fail_count', 'int'), ('task_fail_cost', 'real')],
+  'try': [('try_id', 'int'), ('task_id', 'int'), ('run_id', 'text'), ('block_id', 'text'), ('hostname', 'text'),
+          ('task_executor', 'text'), ('task_try_time_launched', 'text'), ('task_try_time_running', 'text'),
+          ('task_try_time_returned', 'text'), ('task_fail_history', 'text'), ('task_joins', 'text')],
+  'status': [('task_id', 'int'), ('task_status_name', 'text'), ('timestamp', 'text'), ('run_id', 'text'),
+             ('try_id', 'int')],
+  'resource': [('try_id', 'int'), ('task_id', 'int'), ('run_id', 'text'), ('timestamp', 'text'),
+               ('resource_monitoring_interval', 'real'), ('psutil_process_pid', 'int'),
+               ('psutil_process_memory_percent', 'real'), ('psutil_process_children_count', 'real'),
+               ('psutil_process_time_user', 'real'), ('psutil_process_time_system', 'real'),
+               ('psutil_process_memory_virtual', 'real'), ('psutil_process_memory_resident', 'real'),
+               ('psutil_process_disk_read', 'real'), ('psutil_process_disk_write', 'real'),
+               ('psutil_process_status', 'text')],
+  'node': [('id', 'int'), ('run_id', 'text'), ('hostname', 'text'), ('uid', 'text'), ('block_id', 'text'),
+           ('cpu_count', 'int'), ('total_memory', 'int'), ('active', 'int'), ('worker_count', 'int'),
+           ('python_v', 'text'), ('timestamp', 'text'), ('last_heartbeat', 'text')],
+  'block': [('run_id', 'text'), ('executor_label', 'text'), ('block_id', 'text'), ('job_id', 'text'),
+            ('timestamp', 'text'), ('status', 'text')],
+}
+
+# States written to each function_data log with the offsets in seconds from the running
+# time of the try. The ranges are sampled uniformly. The last two are measured back from
+# the returned time.
+function_states = [('start', 0.05, 0.2), ('postimport', 1.0, 4.0), ('mainstart', 1.e-5, 1.e-4),
+                   ('loadfunction', 1.e-4, 1.e-3), ('executefunction', 0.5, 2.0)]
+function_end_states = [('dump', 0.1, 0.5), ('done', 0.01, 0.05)]
+
+def local_time_strings(tims):
+    """
+    Return an array of local time strings 'YYYY-MM-DD HH:MM:SS.ffffff' for unix times tims
+    as written by parsl. MonDbReader.times_from_strings converts these back to the same
+    times (to the microsecond).
+    """
+    usecs = numpy.round(numpy.asarray(tims, dtype=numpy.float64)*1.e6).astype(numpy.int64)
+    # Evaluate the local time offset once for each minute.
+    mins = usecs//60000000
+    umins, imins = numpy.unique(mins, return_inverse=True)
+    epoch = datetime.datetime(1970, 1, 1)
+    offs = numpy.array([(datetime.datetime.fromtimestamp(60*int(umin)) - epoch)//datetime.timedelta(microseconds=1) - 60000000*int(umin)
+                        for umin in umins], dtype=numpy.int64)
+    locs = (usecs + offs[imins.reshape(-1)]).astype('datetime64[us]')
+    return numpy.char.replace(numpy.datetime_as_string(locs, unit='us'), 'T', ' ')
+
+class SyntheticRun:
+    """
+    Simulates the tasks for one workflow run. Tasks are distributed round robin over a
+    fixed number of workers and each worker runs its tasks back to back. A fraction of the
+    tasks fail in their first try and are retried on the same worker.
+    The arrays for each try (ordered by task and then try) are:
+      task_ids, try_ids - Task and try IDs.
+      workers - Worker index.
+      tlaunch, trun, tend - Launched, running and returned times.
+      failed - True if the try fails.
+    """
+
+    def __init__(self, irun, ntask, t0, dt=5.0, nworker=64, tmean=30.0, fail_frac=0.0, jitter=0.001,
+                 funcs=('funA', 'funB', 'funC'), rng=None):
+        rng = numpy.random.default_rng(rng)
+        self.irun = irun
+        self.run_id = f"{irun:08x}-synt-{int(t0)%65536:04x}-{ntask%65536:04x}-run{irun:08d}"
+        self.ntask = ntask
+        self.t0 = t0
+        self.dt = dt
+        self.nworker = nworker
+        self.jitter = jitter
+        self.funcs = list(funcs)
+        self.rng = rng
+        ntrys = 1 + (rng.uniform(size=ntask) < fail_frac)
+        self.ntrys = ntrys
+        ntry = int(ntrys.sum())
+        self.task_ids = numpy.repeat(numpy.arange(ntask), ntrys)
+        self.try_ids = numpy.arange(ntry) - numpy.repeat(numpy.cumsum(ntrys) - ntrys, ntrys)
+        self.failed = self.try_ids < numpy.repeat(ntrys - 1, ntrys)
+        self.workers = self.task_ids%nworker
+        # Durations with a broad distribution. Failed tries stop part way through.
+        durs = tmean*rng.gamma(4.0, 0.25, ntry)
+        durs[self.failed] *= rng.uniform(0.05, 0.5, int(self.failed.sum()))
+        dlaunch = 0.2 + rng.uniform(size=ntry)
+        gaps = 0.1 + 0.5*rng.uniform(size=ntry)
+        occs = dlaunch + durs + gaps
+        # Stack the tries for each worker starting shortly after the run starts.
+        order = numpy.argsort(self.workers, kind='stable')
+        wrks = self.workers[order]
+        ends = numpy.cumsum(occs[order])
+        starts = ends - occs[order]
+        firsts = numpy.searchsorted(wrks, numpy.arange(nworker))
+        firsts = numpy.minimum(firsts, ntry - 1) if ntry else firsts
+        wstarts = t0 + 2.0 + rng.uniform(size=nworker)
+        tlaunch = numpy.empty(ntry)
+        if ntry: tlaunch[order] = wstarts[wrks] + starts - starts[firsts][wrks]
+        self.tlaunch = tlaunch + 0.05
+        self.trun = self.tlaunch + dlaunch
+        self.tend = self.trun + durs
+        self.tinvoke = t0 + 0.5 + 1.e-4*numpy.arange(ntask)
+        self.tdone = self.tend[numpy.cumsum(ntrys) - 1] + 0.05 if ntask else numpy.zeros(0)
+        self.t1 = (self.tdone.max() if ntask else t0) + 1.0
+        # Per-try process characteristics.
+        self.pids = 1000 + numpy.arange(ntry)
+        self.cpu_fracs = rng.uniform(0.6, 1.0, ntry)
+        self.mems = rng.uniform(1.e8, 2.e9, ntry)
+        self.read_rates = rng.uniform(1.e3, 1.e6, ntry)
+        self.write_rates = rng.uniform(1.e3, 1.e6, ntry)
+
+    def last_tries(self):
+        """Return the index of the last try for each task."""
+        return numpy.cumsum(self.ntrys) - 1
+
+    def resource_samples(self):
+        """
+        Return (itrys, tims) with the try index and time for each resource sample.
+        Samples are taken every dt seconds from a random offset after the try starts
+        running, with spacing varying by the fraction jitter.
+        """
+        rng = self.rng
+        ntry = len(self.trun)
+        offs = self.dt*rng.uniform(size=ntry)
+        nsams = numpy.maximum(numpy.floor((self.tend - self.trun - offs)/self.dt).astype(numpy.int64) + 1, 0)
+        itrys = numpy.repeat(numpy.arange(ntry), nsams)
+        isams = numpy.arange(len(itrys)) - numpy.repeat(numpy.cumsum(nsams) - nsams, nsams)
+        tims = self.trun[itrys] + offs[itrys] + self.dt*(isams + self.jitter*(rng.uniform(size=len(itrys)) - 0.5))
+        return itrys, numpy.minimum(tims, self.tend[itrys])
+
+    def tables(self, rundir, total_memory=2.56e11, workers_per_node=64):
+        """
+        Return a dictionary indexed by table name of the column values for this run.
+        Each column is an array or list with a value for each row or a single value for all rows.
+        """
+        rng = self.rng
+        rid = self.run_id
+        ntask = self.ntask
+        ntry = len(self.task_ids)
+        irun = self.irun
+        tabs = {}
+        tstr = local_time_strings
+        tasknams = numpy.array(self.funcs)[numpy.arange(ntask)%len(self.funcs)]
+        errs = [self.stderr_name(rundir, tid, fnam) for tid, fnam in enumerate(tasknams)]
+        tabs['workflow'] = [[rid], ['synthetic'], [tstr([self.t0])[0]], [tstr([self.t0])[0]], [tstr([self.t1])[0]],
+                            ['localhost'], ['wfmon'], [os.path.join(rundir, 'runinfo', f"{irun:03d}")],
+                            [int((self.ntrys > 1).sum())], [ntask]]
+        tabs['task'] = [numpy.arange(ntask), rid, '', tasknams, 0, '', '', '', '', '', errs, tstr(self.tinvoke),
+                        tstr(self.tdone), self.ntrys - 1, 0.0]
+        nodes = self.workers//workers_per_node
+        hosts = [f"nid{inod:06d}" for inod in range(int(nodes.max()) + 1 if ntry else 0)]
+        tabs['try'] = [self.try_ids, self.task_ids, rid, nodes.astype(str), numpy.array(hosts)[nodes], 'htex',
+                       tstr(self.tlaunch), tstr(self.trun), tstr(self.tend), '', '']
+        # Status: pending, launched, running, running_ended and exec_done or fail_retryable for each try.
+        tpend = numpy.where(self.try_ids == 0, self.tinvoke[self.task_ids], numpy.roll(self.tend, 1) + 0.02)
+        tfin = self.tend + 0.05
+        stims = numpy.concatenate([tpend, self.tlaunch, self.trun, self.tend, tfin])
+        snams = numpy.concatenate([numpy.full(ntry, 'pending'), numpy.full(ntry, 'launched'), numpy.full(ntry, 'running'),
+                                   numpy.full(ntry, 'running_ended'), numpy.where(self.failed, 'fail_retryable', 'exec_done')])
+        stry = numpy.tile(numpy.arange(ntry), 5)
+        order = numpy.argsort(stims, kind='stable')
+        stry = stry[order]
+        tabs['status'] = [self.task_ids[stry], snams[order], tstr(stims[order]), rid, self.try_ids[stry]]
+        # Resource samples.
+        itrys, tims = self.resource_samples()
+        order = numpy.argsort(tims, kind='stable')
+        itrys = itrys[order]
+        tims = tims[order]
+        truns = tims - self.trun[itrys]
+        tuser = self.cpu_fracs[itrys]*truns
+        mems = self.mems[itrys]*(1.0 + 0.05*rng.uniform(size=len(itrys)))
+        tabs['resource'] = [self.try_ids[itrys], self.task_ids[itrys], rid, tstr(tims), float(self.dt), self.pids[itrys],
+                            100.0*mems/total_memory, 0.0, tuser, 0.05*tuser, 2.0*mems + 1.e9, mems,
+                            self.read_rates[itrys]*truns, self.write_rates[itrys]*truns, 'running']
+        # Nodes and the blocks that hold them.
+        nnod = len(hosts)
+        sbeg = tstr([self.t0 + 1.0])[0]
+        tabs['node'] = [list(range(nnod)), nnod*[rid], hosts, [f"{inod:016x}" for inod in range(nnod)],
+                        [str(inod) for inod in range(nnod)], nnod*[256], nnod*[int(total_memory)], nnod*[1],
+                        [int(min(workers_per_node, self.nworker - inod*workers_per_node)) for inod in range(nnod)],
+                        nnod*['3.10.4'], nnod*[sbeg], nnod*[tstr([self.t1])[0]]]
+        tabs['block'] = [2*nnod*[rid], 2*nnod*['htex'], 2*[str(inod) for inod in range(nnod)],
+                         2*[str(1000000 + inod) for inod in range(nnod)], nnod*[tstr([self.t0])[0]] + nnod*[sbeg],
+                         nnod*['PENDING'] + nnod*['RUNNING']]
+        return tabs
+
+    def stderr_name(self, rundir, tid, fnam):
+        """Return the stderr log name for a task following the parsl convention."""
+        return os.path.join(rundir, 'runinfo', f"{self.irun:03d}", 'task_logs', f"{tid//10000:04d}",
+                            f"task_{tid:04d}_{fnam}.stderr")
+
+    def write_function_data(self, rundir):
+        """Write the function_data log for each task using the times for its last try."""
+        rng = self.rng
+        itrys = self.last_tries()
+        tims = []
+        tim = self.trun[itrys]
+        for nam, dmin, dmax in function_states:
+            tim = tim + rng.uniform(dmin, dmax, len(itrys))
+            tims.append((nam, tim))
+        tim = self.tend[itrys]
+        etims = []
+        for nam, dmin, dmax in reversed(function_end_states):
+            tim = tim - rng.uniform(dmin, dmax, len(itrys))
+            etims.insert(0, (nam, tim))
+        tims += etims
+        fddir = os.path.join(rundir, 'runinfo', f"{self.irun:03d}", 'function_data')
+        for tid in range(self.ntask):
+            tdir = os.path.join(fddir, f"{tid:04d}")
+            os.makedirs(tdir, exist_ok=True)
+            with open(os.path.join(tdir, 'log'), 'w') as fout:
+                fout.write(''.join(f"{tim[tid]:.6f} {nam}\n" for nam, tim in tims))
+
+    def write_perfstat_logs(self, rundir, errs):
+        """Write a perf stat report for the last try of each task to the stderr logs errs."""
+        rng = self.rng
+        itrys = self.last_tries()
+        ntask = len(itrys)
+        telap = self.tend[itrys] - self.trun[itrys]
+        tuser = self.cpu_fracs[itrys]*telap
+        tsys = 0.05*tuser
+        clocks = 1000.0*(tuser + tsys)
+        cycles = (1.e-3*clocks*rng.uniform(2.0e9, 3.5e9, ntask)).astype(numpy.int64)
+        instrs = (cycles*rng.uniform(0.8, 2.5, ntask)).astype(numpy.int64)
+        for itsk, fnam in enumerate(errs):
+            os.makedirs(os.path.dirname(fnam), exist_ok=True)
+            with open(fnam, 'w') as fout:
+                fout.write(f"Running task {itsk}\n\n"
+                           f" Performance counter stats for 'python3 task_{itsk}.py':\n\n"
+                           f"{clocks[itsk]:18,.2f} msec task-clock:u              #    {(tuser[itsk] + tsys[itsk])/telap[itsk]:.3f} CPUs utilized\n"
+                           f"{0:18,d}      context-switches:u        #    0.000 /sec\n"
+                           f"{cycles[itsk]:18,d}      cycles:u                  #    {cycles[itsk]/clocks[itsk]*1.e-6:.3f} GHz\n"
+                           f"{instrs[itsk]:18,d}      instructions:u            #    {instrs[itsk]/cycles[itsk]:.2f}  insn per cycle\n"
+                           f"{'<not supported>':>18}      branches:u\n\n"
+                           f"{telap[itsk]:18.9f} seconds time elapsed\n\n"
+                           f"{tuser[itsk]:18.9f} seconds user\n"
+                           f"{tsys[itsk]:18.9f} seconds sys\n\n")
+
+def insert_rows(con, tnam, cols, chunksize=100000):
+    """
+    Insert rows into table tnam with DB connection con. Each column in cols is an array or
+    list with a value for each row or a single value for all rows. Rows are converted and
+    inserted chunksize at a time to limit the memory used for large tables.
+    Returns the number of rows.
+    """
+    nrow = max([len(col) for col in cols if numpy.ndim(col)], default=1)
+    sqry = f"insert into {tnam} values ({', '.join(len(cols)*['?'])})"
+    for irow in range(0, nrow, chunksize):
+        jrow = min(irow + chunksize, nrow)
+        vals = [itertools.repeat(col, jrow - irow) if numpy.ndim(col) == 0 else
+                col[irow:jrow].tolist() if isinstance(col, numpy.ndarray) else col[irow:jrow] for col in cols]
+        con.executemany(sqry, zip(*vals))
+    return nrow
+
+def make_rundir(rundir, ntask=1000, nrun=1, dt=5.0, nworker=64, tmean=30.0, fail_frac=0.0, jitter=0.001,
+                function_data=True, perfstat=True, t0=1650000000.0, seed=1, dbg=0):
+    """
+    Write a synthetic parsl run directory with the monitoring DB runinfo/monitoring.db and,
+    for each run NNN, the function data logs runinfo/NNN/function_data/<task_id>/log and
+    the task stderr logs with perf stat reports under runinfo/NNN/task_logs.
+    Arguments:
+      rundir - Run directory. It is created if it does not exist. An existing DB is replaced.
+      ntask - Number of tasks in each run.
+      nrun - Number of runs.
+      dt - Resource sampling interval [sec]. A list gives the value for each run.
+      nworker - Number of workers.
+      tmean - Mean task duration [sec].
+      fail_frac - Fraction of tasks that fail in the first try and are retried.
+      jitter - Fractional variation in the spacing between resource samples.
+      function_data - If true, the function data logs are written.
+      perfstat - If true, the perf stat logs are written.
+      t0 - Unix time for the start of the first run.
+      seed - Random number seed.
+      dbg - 0 for silent
+    Returns the DB file name.
+    """
+    myname = 'make_rundir'
+    rng = numpy.random.default_rng(seed)
+    dts = list(dt) if numpy.ndim(dt) else nrun*[dt]
+    if len(dts) != nrun: raise Exception(f"{myname}: Sampling interval count {len(dts)} != run count {nrun}.")
+    idir = os.path.join(rundir, 'runinfo')
+    os.makedirs(idir, exist_ok=True)
+    dbnam = os.path.join(idir, 'monitoring.db')
+    if os.path.exists(dbnam): os.remove(dbnam)
+    con = sqlite3.connect(dbnam)
+    for tnam, cols in schema.items():
+        con.execute(f"create table {tnam} ({', '.join(f'{cnam} {ctyp}' for cnam, ctyp in cols)})")
+    for irun in range(nrun):
+        run = SyntheticRun(irun, ntask, t0, dts[irun], nworker, tmean, fail_frac, jitter, rng=rng)
+        tabs = run.tables(rundir)
+        for tnam, cols in tabs.items():
+            nrow = insert_rows(con, tnam, cols)
+            if dbg >= 2: print(f"{myname}: Run {irun} table {tnam} has {nrow} rows.")
+        con.commit()
+        if function_data: run.write_function_data(rundir)
+        if perfstat: run.write_perfstat_logs(rundir, tabs['task'][10])
+        if dbg: print(f"{myname}: Run {irun} has {ntask} tasks, {len(run.task_ids)} tries and {len(tabs['resource'][0])} resource samples.")
+        del tabs
+        t0 = run.t1 + 100.0
+    con.close()
+    return dbnam
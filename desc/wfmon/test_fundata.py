@@ -7,8 +7,14 @@
 Testing for FunData.
 """
 
+import os
+import tempfile
 import unittest
+import numpy
+import pandas
 from desc.wfmon import FunctionData
+from desc.wfmon.fundata import function_data_logs
+from desc.wfmon.synthetic import make_rundir
 
 class TestFunctionData(unittest.TestCase):
     """
@@ -20,8 +26,132 @@ class TestFunctionData(unittest.TestCase):
 
     def test_build(self, dbg=0):
         myname = 'TestFunctionData:init'
-        prefix = '/global/homes/d/dladams/desc/rundirs/ptest05/'
-        fdat = FunctionData(prefix, dbg=dbg)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            prefix = tmpdir + '/'
+            make_rundir(prefix, ntask=25, nworker=4, perfstat=False)
+            fdat = FunctionData(prefix, dbg=dbg)
         print(fdat.data)
-        self.assertTrue(len(fdat.data))
+        self.assertEqual(len(fdat.data), 25)
+        self.assertEqual(sorted(fdat.data['taskid']), list(range(25)))
+        for cnam in ['start', 'postimport', 'mainstart', 'loadfunction', 'executefunction', 'dump', 'done']:
+            self.assertIn(cnam, fdat.data.columns)
+        self.assertTrue((fdat.data['done'] > fdat.data['start']).all())
+        self.assertEqual(list(fdat.stage_timer.table()['rows_out']), [25, 25])
+        self.assertEqual((fdat.nread, fdat.nreuse), (25, 0))
+        self.assertEqual(fdat.data['taskid'].dtype, numpy.int64)
+        self.assertEqual(fdat.data['run'].dtype, numpy.int64)
+        self.assertTrue((fdat.data.dtypes.iloc[2:] == numpy.float64).all())
         print(f"{myname}: Done.")
+
+    def test_missing_states(self):
+        """Check logs with different states and bad task directories."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            prefix = tmpdir + '/'
+            logs = {'0000': "10.5 start\n11.5 done\n", '0001': "20.5 start\nbad line here\n21.0 Dump\n",
+                    'xyz': "1.0 start\n", '0010': ""}
+            for sdir, text in logs.items():
+                os.makedirs(os.path.join(tmpdir, 'runinfo', '000', 'function_data', sdir))
+                with open(os.path.join(tmpdir, 'runinfo', '000', 'function_data', sdir, 'log'), 'w') as fout:
+                    fout.write(text)
+            fdat = FunctionData(prefix)
+            fdats = [FunctionData(prefix, pool=pool, nworker=2) for pool in ['thread', 'process']]
+        self.assertEqual(list(fdat.data.columns), ['taskid', 'run', 'start', 'done', 'dump'])
+        self.assertEqual(fdat.state_names(), ['start', 'done', 'dump'])
+        self.assertEqual(list(fdat.data['taskid']), [0, 1, 10])
+        self.assertTrue(numpy.array_equal(fdat.data['start'], [10.5, 20.5, numpy.nan], equal_nan=True))
+        self.assertTrue(numpy.array_equal(fdat.data['dump'], [numpy.nan, 21.0, numpy.nan], equal_nan=True))
+        self.assertEqual(len(fdat.errors), 1)
+        self.assertIn('xyz', fdat.errors[0][0])
+        for pdat in fdats:
+            pandas.testing.assert_frame_equal(pdat.data, fdat.data)
+            self.assertEqual(pdat.errors, fdat.errors)
+
+    def test_manifest(self):
+        """Check a rescan with the manifest reads only new and changed logs."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            prefix = tmpdir + '/'
+            make_rundir(prefix, ntask=20, nworker=4, perfstat=False)
+            fdat = FunctionData(prefix, cache=True)
+            self.assertEqual((fdat.nread, fdat.nreuse), (20, 0))
+            self.assertTrue(os.path.exists(fdat.manifest_name))
+            self.assertNotIn('stat', list(fdat.stage_timer.table()['stage']))
+            fdat2 = FunctionData(prefix, cache=True)
+            self.assertEqual((fdat2.nread, fdat2.nreuse), (0, 20))
+            self.assertIn('stat', list(fdat2.stage_timer.table()['stage']))
+            pandas.testing.assert_frame_equal(fdat2.data, fdat.data)
+            # Change one log and add another.
+            fddir = os.path.join(tmpdir, 'runinfo', '000', 'function_data')
+            with open(os.path.join(fddir, '0003', 'log'), 'a') as fout:
+                fout.write("1650009999.0 extra\n")
+            os.makedirs(os.path.join(fddir, '0020'))
+            with open(os.path.join(fddir, '0020', 'log'), 'w') as fout:
+                fout.write("1650009000.0 start\n")
+            self.assertEqual(fdat2.rescan(), 2)
+            self.assertEqual(fdat2.nreuse, 20 - 1)
+            pandas.testing.assert_frame_equal(fdat2.data, FunctionData(prefix).data)
+            self.assertEqual(fdat2.data['extra'].notna().sum(), 1)
+            self.assertEqual(FunctionData(prefix, cache=True).nread, 0)
+
+    def test_scandir(self):
+        """Check the logs are found in numeric order of run and task and match those from glob."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            prefix = tmpdir + '/'
+            for srun, stids in [('001', ['9', '100', '10']), ('000', ['0002', '0001']), ('abc', ['5'])]:
+                for stid in stids:
+                    os.makedirs(os.path.join(tmpdir, 'runinfo', srun, 'function_data', stid))
+                    with open(os.path.join(tmpdir, 'runinfo', srun, 'function_data', stid, 'log'), 'w') as fout:
+                        fout.write(f"{stid}.5 start\n")
+            os.makedirs(os.path.join(tmpdir, 'runinfo', '001', 'function_data', '11'))
+            logs = list(function_data_logs(prefix))
+            # The directory without a log is listed and skipped when the logs are read.
+            self.assertEqual([log[0:2] for log in logs], [(0, 1), (0, 2), (1, 9), (1, 10), (1, 11), (1, 100), (-1, 5)])
+            self.assertEqual([log[0:2] for log in function_data_logs(prefix, ['001'])], [(1, 9), (1, 10), (1, 11), (1, 100)])
+            self.assertEqual([log[0:2] for log in function_data_logs(prefix, [0])], [(0, 1), (0, 2)])
+            fdat = FunctionData(prefix)
+            gdat = FunctionData(prefix, pattern='runinfo/*/function_data/*/log')
+            rdat = FunctionData(prefix, rundirs=[1])
+        self.assertEqual(list(fdat.data['taskid']), [5, 1, 2, 9, 10, 100])
+        self.assertEqual(list(fdat.data['run']), [-1, 0, 0, 1, 1, 1])
+        self.assertEqual((fdat.nread, fdat.errors), (6, []))
+        self.assertEqual(fdat.stage_timer.records[0]['stage'], 'scandir')
+        pandas.testing.assert_frame_equal(gdat.data, fdat.data)
+        self.assertEqual(list(rdat.data['taskid']), [9, 10, 100])
+
+    def test_join_mondb(self):
+        """Check the function_data times are aligned with the last try of each task in the monitoring DB."""
+        from desc.wfmon import MonDbReader
+        from desc.wfmon.collection import db_run_ids
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = make_rundir(tmpdir, ntask=200, nrun=2, nworker=8, fail_frac=0.2, perfstat=False)
+            dbr = MonDbReader(dbfile, run_id=db_run_ids(dbfile)[1])
+            fdat = FunctionData(tmpdir + '/')
+            tab = fdat.join_mondb(dbr)
+            with self.assertRaises(Exception):
+                fdat.join_mondb(dbr, runs=[0, 1])
+            summ = fdat.latency_summary(tab, task_names=dbr.task_names)
+            # Without a rundir, the run number must be given.
+            dbr._tables['workflow'] = dbr['workflow'].drop(columns='rundir')
+            with self.assertRaises(Exception):
+                fdat.join_mondb(dbr)
+            pandas.testing.assert_frame_equal(fdat.join_mondb(dbr, runs=[1]), tab)
+        self.assertEqual(len(tab), 200)
+        self.assertTrue((tab['ntry'] > 1).any())
+        self.assertEqual(list(tab['try_id']), list(tab['ntry'] - 1))
+        # Function data is from the second run directory and falls within the running try.
+        self.assertTrue(tab['start'].notna().all())
+        self.assertTrue((tab['dt_start'] >= 0).all())
+        self.assertTrue((tab['dt_returned'] >= 0).all())
+        dtcols = [cnam for cnam in tab.columns if cnam.startswith('dt_')]
+        self.assertEqual(dtcols[0], 'dt_launched')
+        self.assertEqual(dtcols[-1], 'dt_result')
+        numpy.testing.assert_allclose(tab[dtcols].sum(axis=1), tab['result'] - tab['invoked'], atol=1.e-6)
+        # Percentiles for each task index and for all tasks.
+        self.assertEqual(len(summ), (len(dbr.task_names) + 1)*len(dtcols))
+        row = summ[(summ['task_idx'] == 1) & (summ['stage'] == 'dump')].iloc[0]
+        vals = tab.loc[tab['task_idx'] == 1, 'dt_dump']
+        self.assertEqual(row['task_name'], dbr.task_names[1])
+        self.assertEqual(row['count'], len(vals))
+        self.assertAlmostEqual(row['p50'], numpy.percentile(vals, 50))
+        self.assertAlmostEqual(row['p99'], numpy.percentile(vals, 99))
+        row = summ[(summ['task_idx'] == -1) & (summ['stage'] == 'dump')].iloc[0]
+        self.assertAlmostEqual(row['mean'], tab['dt_dump'].mean())
@@ -0,0 +1,595 @@
+# test_mondb.py
+#
+# David Adams
+# October 2026
+
+"""
+Testing for MonDbReader that does not require an existing monitoring DB.
+"""
+
+import os
+import json
+import shutil
+import time
+import datetime
+import sqlite3
+import tempfile
+import unittest
+import numpy
+import pandas
+from desc.wfmon import MonDbReader, MonDbCollection, PerfStatLogReader
+from desc.wfmon.synthetic import make_rundir, local_time_strings
+from desc.wfmon.stagetimer import StageTimer
+
+def make_test_db(fnam, ntask=40, nworker=4, dt=5.0, seed=1):
+    """Write a small monitoring DB for one run to file fnam."""
+    rng = numpy.random.default_rng(seed)
+    def tstr(t): return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')
+    con = sqlite3.connect(fnam)
+    con.execute("create table workflow (run_id text, workflow_name text, workflow_version text, time_began text, time_completed text)")
+    con.execute("create table task (task_id int, run_id text, task_func_name text, task_stderr text, task_time_invoked text, task_time_returned text)")
+    con.execute("create table try (try_id int, task_id int, run_id text, hostname text, task_try_time_launched text, task_try_time_running text, task_try_time_returned text)")
+    con.execute("create table status (task_id int, task_status_name text, timestamp text, run_id text, try_id int)")
+    con.execute("create table resource (try_id int, task_id int, run_id text, timestamp text, resource_monitoring_interval real, "
+                "psutil_process_pid int, psutil_process_status text, psutil_process_children_count real, psutil_process_memory_percent real, psutil_process_time_user real, psutil_process_time_system real, "
+                "psutil_process_memory_virtual real, psutil_process_memory_resident real, psutil_process_disk_read real, psutil_process_disk_write real)")
+    rid = 'run-test'
+    tb = 1650000000.0
+    workers = tb + 2.0 + rng.uniform(size=nworker)
+    for tid in range(ntask):
+        iwrk = numpy.argmin(workers)
+        tl = workers[iwrk] + 0.05
+        tr = tl + 0.2 + rng.uniform()
+        te = tr + 5 + 40*rng.uniform()
+        workers[iwrk] = te + 0.1 + 0.5*rng.uniform()
+        con.execute("insert into task values (?,?,?,?,?,?)", (tid, rid, ['funA', 'funB'][tid%2], f"{tid}.err", tstr(tb + 0.5), tstr(te + 0.05)))
+        con.execute("insert into try values (?,?,?,?,?,?,?)", (0, tid, rid, 'node1', tstr(tl), tstr(tr), tstr(te)))
+        for snam, tst in [('pending', tb + 0.5), ('launched', tl), ('running', tr), ('running_ended', te), ('exec_done', te + 0.05)]:
+            con.execute("insert into status values (?,?,?,?,?)", (tid, snam, tstr(tst), rid, 0))
+        tim = tr + dt*rng.uniform()
+        tuser = 0.0
+        while tim < te:
+            tuser += 0.9*dt
+            con.execute("insert into resource values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                        (0, tid, rid, tstr(tim), dt, 1000 + tid, 'running', 0, 1.0 + rng.uniform(), tuser, 0.1*tuser, 1.e9,
+                         5.e8 + 1.e6*rng.uniform(), 1.e4*tuser, 2.e4*tuser))
+            tim += dt*(1 + 0.001*(rng.uniform() - 0.5))
+    con.execute("insert into workflow values (?,?,?,?,?)", (rid, 'wftest', 'v1', tstr(tb), tstr(workers.max() + 1.0)))
+    con.commit()
+    con.close()
+
+def copy_db_until(src, dst, tcut=None):
+    """
+    Copy monitoring DB src to dst as it would be while parsl is writing it at time string
+    tcut. Rows of the append-only tables are written in time order. The first call (dst
+    does not exist) writes the rows up to tcut with the later try, task and workflow times
+    set to null. Later calls append the rows after tcut (or up to the new tcut) and replace
+    the try, task and workflow tables as parsl updates them in place.
+    """
+    scon = sqlite3.connect(src)
+    tnams = [row[0] for row in scon.execute("select name from sqlite_master where type='table'")]
+    isnew = not os.path.exists(dst)
+    con = sqlite3.connect(dst)
+    tmax = '9999' if tcut is None else tcut
+    for tnam in tnams:
+        cols = [row[1] for row in scon.execute(f"pragma table_info('{tnam}')")]
+        if isnew:
+            con.execute(scon.execute("select sql from sqlite_master where name=?", [tnam]).fetchone()[0])
+        if 'timestamp' in cols and tnam in ['status', 'resource']:
+            tlast = con.execute(f"select max(timestamp) from {tnam}").fetchone()[0] or ''
+            rows = scon.execute(f"select * from {tnam} where timestamp > ? and timestamp <= ? order by timestamp, rowid", [tlast, tmax]).fetchall()
+        else:
+            con.execute(f"delete from {tnam}")
+            rows = scon.execute(f"select * from {tnam} order by rowid").fetchall()
+            if tnam == 'try':
+                rows = [row for row in rows if row[cols.index('task_try_time_launched')] <= tmax]
+            tcols = [icol for icol, cnam in enumerate(cols) if cnam[0:4] == 'time' or 'time_' in cnam]
+            rows = [tuple(None if icol in tcols and val is not None and val > tmax else val for icol, val in enumerate(row)) for row in rows]
+        con.executemany(f"insert into {tnam} values ({', '.join(len(cols)*'?')})", rows)
+    con.commit()
+    con.close()
+    scon.close()
+
+def make_retry_db(rundir):
+    """
+    Write a synthetic DB for one run with retried tries and edit it to have a status row
+    for an unknown task, a missing and a repeated status row and tries without running or
+    returned times. Returns the DB file name.
+    """
+    fnam = make_rundir(rundir, ntask=60, nworker=5, fail_frac=0.3, function_data=False, perfstat=False)
+    con = sqlite3.connect(fnam)
+    rid = con.execute("select run_id from workflow").fetchone()[0]
+    con.execute("insert into status select 999, task_status_name, timestamp, run_id, try_id from status where task_id=0")
+    con.execute("delete from status where task_id=5 and try_id=0 and task_status_name='running'")
+    con.execute("insert into status select * from status where task_id=6 and try_id=0 and task_status_name='launched'")
+    con.execute("update try set task_try_time_running=null where task_id=7")
+    con.execute("update try set task_try_time_returned=null where task_id=8")
+    con.commit()
+    con.close()
+    return fnam
+
+def chaintasks_reference(ttr):
+    """
+    Return the try table with the chain columns and the prompt and late chain counts from
+    the loop over tries in order of end time used before chaintasks was vectorized.
+    """
+    ttr = ttr.copy()
+    cnam1 = 'task_try_time_running'
+    cnam2 = 'task_try_time_returned'
+    ttr1 = ttr.sort_values(by=[cnam1])
+    ttr2 = ttr.sort_values(by=[cnam2])
+    loc1 = 0
+    nprompt = None
+    nlate = 0
+    ttr['latency'] = 0.0
+    for i2, row2 in ttr2.iterrows():
+        t2 = row2[cnam2]
+        nskip = 0
+        while loc1 < len(ttr1):
+            i1 = ttr1.index[loc1]
+            t1 = ttr1.iloc[loc1][cnam1]
+            loc1 += 1
+            if t1 > t2:
+                ttr.at[i1, 'last_try'] = i2
+                ttr.at[i2, 'next_try'] = i1
+                ttr.at[i1, 'latency'] = t1 - t2
+                break
+            nskip += 1
+        if nprompt is None: nprompt = nskip
+        else: nlate += nskip
+    return ttr, nprompt, nlate
+
+class TestMonDbReaderLocal(unittest.TestCase):
+    """
+    Class to test MonDbReader without an input DB. Tests that need one write a small
+    DB to a temporary directory. Run with
+      > pytest -v test_mondb.py
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.dbname = os.path.join(cls.tmpdir.name, 'monitoring.db')
+        make_test_db(cls.dbname)
+        cls.retryname = make_retry_db(os.path.join(cls.tmpdir.name, 'retry'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    stims = [
+        '2022-03-04 12:34:56.123456',
+        '2022-03-04 12:34:56',
+        None,
+        '2022-03-13 02:30:00.5',
+        '2022-11-06 01:30:00.000001',
+        '2021-12-31 23:59:59.999999',
+        '1999-07-01 00:00:00.0100',
+    ]
+
+    def check_times(self):
+        tims = MonDbReader.times_from_strings(self.stims)
+        self.assertEqual(len(tims), len(self.stims))
+        for stim, tim in zip(self.stims, tims):
+            if stim is None:
+                self.assertTrue(numpy.isnan(tim))
+            else:
+                self.assertEqual(tim, MonDbReader.time_from_string(stim))
+
+    def test_times_from_strings(self):
+        self.check_times()
+
+    def test_times_from_strings_dst(self):
+        """Check local time offsets across daylight saving transitions."""
+        tzsav = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/Los_Angeles'
+        time.tzset()
+        try:
+            self.check_times()
+        finally:
+            if tzsav is None: del os.environ['TZ']
+            else: os.environ['TZ'] = tzsav
+            time.tzset()
+
+    def test_times_from_strings_empty(self):
+        tims = MonDbReader.times_from_strings([None, None])
+        self.assertTrue(tims.isna().all())
+
+    def test_fix_times_columns(self):
+        """Check the fixed time columns match time_from_string for each value."""
+        raw = MonDbReader(self.dbname, fix=False)
+        dbr = MonDbReader(self.dbname)
+        t0 = MonDbReader.time_from_string(raw['workflow']['time_began'][0])
+        for tnam, cnam in [('task', 'task_time_returned'), ('try', 'task_try_time_running'), ('status', 'timestamp')]:
+            exp = [MonDbReader.time_from_string(stim) - t0 for stim in raw[tnam][cnam]]
+            self.assertTrue(numpy.array_equal(dbr[tnam][cnam].to_numpy(), exp))
+
+    def test_fix_tasks_reference(self):
+        """Check the task indices match those assigned row by row, including unknown tasks."""
+        raw = MonDbReader(self.retryname, fix=False)
+        raw.fix_runs()
+        names = []
+        task_index = [[] for rid in raw.run_ids]
+        for row in raw['task'].itertuples():
+            if row.task_func_name not in names: names.append(row.task_func_name)
+            self.assertEqual(row.task_id, len(task_index[row.run_idx]))
+            task_index[row.run_idx].append(names.index(row.task_func_name))
+        exps = {}
+        for tnam in ['try', 'status', 'resource']:
+            exps[tnam] = [task_index[row.run_idx][row.task_id] if row.task_id < len(task_index[row.run_idx]) else -1
+                          for row in raw[tnam].itertuples()]
+        logs = list(raw['task']['task_stderr'])
+        raw.fix_tasks()
+        self.assertEqual(raw.task_names, names)
+        self.assertEqual(raw.task_index, task_index)
+        self.assertEqual(raw.task_name_counts, [sum(tidx == itsk for tidxs in task_index for tidx in tidxs) for itsk in range(len(names))])
+        self.assertEqual(raw.task_logs, logs)
+        self.assertEqual(list(raw['task']['task_idx']), [tidx for tidxs in task_index for tidx in tidxs])
+        self.assertIn(-1, exps['status'])
+        for tnam, exp in exps.items():
+            self.assertEqual(list(raw[tnam]['task_idx']), exp)
+
+    def test_fix_try_reference(self):
+        """Check the try status columns match those found try by try in the status table."""
+        dbr = MonDbReader(self.retryname)
+        tsta = dbr['status']
+        cnams = {'pending': 'status_pending', 'launched': 'status_launched', 'running': 'status_running',
+                 'running_ended': 'status_rundone', 'exec_done': 'status_alldone'}
+        ttry = dbr['try']
+        self.assertGreater(ttry['try_id'].max(), 0)
+        for snam, cnam in cnams.items():
+            ssta = tsta[tsta['task_status_name'] == snam]
+            exp = []
+            for row in ttry.itertuples():
+                tims = ssta['timestamp'][(ssta['run_idx'] == row.run_idx) & (ssta['task_id'] == row.task_id) & (ssta['try_id'] == row.try_id)]
+                exp.append(tims.iloc[0] if len(tims) == 1 else numpy.nan)
+            self.assertTrue(numpy.array_equal(ttry[cnam].to_numpy(dtype=numpy.float64), exp, equal_nan=True))
+        self.assertTrue(numpy.isnan(ttry.loc[(ttry['task_id'] == 5) & (ttry['try_id'] == 0), 'status_running']).all())
+        self.assertTrue(numpy.isnan(ttry.loc[(ttry['task_id'] == 6) & (ttry['try_id'] == 0), 'status_launched']).all())
+
+    def test_taskcounts_engines(self):
+        """Check the event taskcounts engine matches the loop over tries, including retries."""
+        dbr = MonDbReader(self.retryname)
+        dbl = MonDbReader(self.retryname)
+        for delt in [0.7, 5.0]:
+            dbr.taskcounts(delt=delt)
+            dbl.taskcounts(delt=delt, engine='loop')
+            for snam in ['launched', 'running', 'returned']:
+                tcr = dbr.taskcounts(snam)
+                pandas.testing.assert_frame_equal(tcr, dbl.taskcounts(snam), rtol=1.e-12)
+                ntry = dbr['try']['task_try_time_' + snam].notna().sum()
+                self.assertEqual(tcr['all'].iloc[-1], ntry)
+        steps = dbr.taskcount_steps('returned')
+        self.assertEqual(steps['all'].iloc[-1], dbr['try']['task_try_time_returned'].notna().sum())
+
+    def test_chaintasks_reference(self):
+        """Check the chains match those from the loop over tries, including retries and missing times."""
+        for fnam in [self.dbname, self.retryname]:
+            dbr = MonDbReader(fnam)
+            exp, nprompt, nlate = chaintasks_reference(dbr['try'])
+            dbr.chaintasks()
+            ttr = dbr['try']
+            for cnam in ['last_try', 'next_try', 'latency']:
+                self.assertTrue(numpy.array_equal(ttr[cnam].to_numpy(dtype=numpy.float64),
+                                                  exp[cnam].to_numpy(dtype=numpy.float64), equal_nan=True))
+            self.assertEqual(dbr.taskchain_count('prompt'), nprompt)
+            self.assertEqual(dbr.taskchain_count('late'), nlate)
+            self.assertGreater(ttr['next_try'].notna().sum(), 0)
+
+    def test_taskproc_retries(self):
+        """Check the clock time of each sample is taken from the running time of its own try."""
+        dbr = MonDbReader(self.retryname)
+        ttry = dbr['try']
+        trun = {(row.run_idx, row.task_id, row.try_id): row.task_try_time_running for row in ttry.itertuples()}
+        tp = dbr.build_taskproc_table(False)
+        exp = numpy.array([row.timestamp - trun[(row.run_idx, row.task_id, row.try_id)] for row in tp.itertuples()])
+        self.assertTrue(numpy.array_equal(tp['procsum_time_clock'].to_numpy(), exp, equal_nan=True))
+        # Retried tasks have valid clock times for every try. Only task 7 has no running time.
+        retried = ttry['task_id'][ttry['try_id'] > 0].unique()
+        self.assertGreater(len(retried), 0)
+        tpr = tp[tp['task_id'].isin(retried)]
+        self.assertGreater(tpr['try_id'].max(), 0)
+        self.assertTrue((tpr['procsum_time_clock'] > 0).all())
+        self.assertEqual(set(tp['task_id'][tp['procsum_time_clock'].isna()]), {7})
+        # With deltas, the first sample of each task has the clock time and the others the change.
+        tpd = dbr.build_taskproc_table(True)
+        first = tpd['isam'].to_numpy() == 0
+        expd = exp.copy()
+        expd[1:] -= exp[:-1]
+        expd[first] = exp[first]
+        self.assertTrue(numpy.allclose(tpd['procdel_time_clock'].to_numpy(), expd, rtol=0, atol=1.e-9, equal_nan=True))
+        # The deltas for each task sum to the clock time of its last sample.
+        sums = tpd.groupby(['run_idx', 'task_id'])['procdel_time_clock'].agg(lambda vals: vals.to_numpy().sum())
+        lasts = tp.groupby(['run_idx', 'task_id'])['procsum_time_clock'].last()
+        self.assertTrue(numpy.allclose(sums.to_numpy(), lasts.to_numpy(), rtol=0, atol=1.e-6, equal_nan=True))
+
+    def check_refresh(self, reader_args, tnams=None):
+        """
+        Check the tables of a reader that is opened while the DB is being written and then
+        refreshed match those of a reader opened after all rows are written.
+        """
+        tsplits = ['2022-04-15 05:21:00', '2022-04-15 05:21:01', '2022-04-15 05:23:30', None]
+        src = os.path.join(self.tmpdir.name, 'retry', 'runinfo', 'monitoring.db')
+        fnam = os.path.join(self.tmpdir.name, 'refresh', 'monitoring.db')
+        if os.path.exists(os.path.dirname(fnam)): shutil.rmtree(os.path.dirname(fnam))
+        os.makedirs(os.path.dirname(fnam))
+        copy_db_until(src, fnam, tsplits[0])
+        dbr = MonDbReader(fnam, **reader_args)
+        if reader_args.get('cache', False):
+            dbr = MonDbReader(fnam, **reader_args)
+            self.assertEqual(dbr.stage_table()['stage'].iloc[0], 'load_cache')
+        dbr.taskcounts(delt=5.0)
+        for dodelta in [False, True]: dbr.build_taskproc_table(dodelta)
+        for tsplit in tsplits[1:]:
+            copy_db_until(src, fnam, tsplit)
+            nnews = dbr.refresh()
+            exp = MonDbReader(fnam, **dict(reader_args, cache=False))
+            exp.taskcounts(delt=5.0)
+            for dodelta in [False, True]:
+                pandas.testing.assert_frame_equal(dbr._taskproc_tables[dodelta], exp.build_taskproc_table(dodelta))
+            pandas.testing.assert_frame_equal(dbr.task_group_index('resource')['table'], exp.task_group_index('resource')['table'])
+            self.assertEqual(dbr.nwarnNoOffset, exp.nwarnNoOffset)
+            for tnam in exp.table_names() if tnams is None else tnams:
+                pandas.testing.assert_frame_equal(dbr[tnam].reset_index(drop=True), exp[tnam].reset_index(drop=True), obj=tnam)
+            for snam in ['launched', 'running', 'returned']:
+                pandas.testing.assert_frame_equal(dbr.taskcounts(snam), exp.taskcounts(snam))
+        self.assertGreater(nnews['resource'], 0)
+        # Only the stages of the last refresh are kept.
+        self.assertEqual((dbr.stage_table()['stage'] == 'refresh').sum(), 1)
+        return dbr
+
+    def test_refresh(self):
+        """Check refresh while the DB is written matches a fresh read, with and without deltas."""
+        for dodelta in [False, True]:
+            self.check_refresh(dict(dodelta=dodelta))
+
+    def test_refresh_cache(self):
+        """Check refresh of a reader opened from the cache matches a fresh read."""
+        for dodelta in [False, True]:
+            dbr = self.check_refresh(dict(cache=True, dodelta=dodelta))
+            self.assertIs(dbr['procsum'], dbr['procsumDelta' if dodelta else 'procsumNoDelta'])
+
+    def test_sampling_offsets(self):
+        """Check the interval evaluation of sampling offsets matches the stepping search."""
+        rng = numpy.random.default_rng(11)
+        for dt in [1.0, 5.0, 60.0]:
+            for jitter in [0.05, 0.3, 0.8]:
+                nsams = rng.integers(1, 30, 500)
+                starts = numpy.concatenate([[0], numpy.cumsum(nsams)[:-1]])
+                tims = numpy.concatenate([rng.uniform(0, 100) + numpy.cumsum(dt*(1 + jitter*(rng.uniform(size=nsam) - 0.5)))
+                                          for nsam in nsams])
+                toffs, found = MonDbReader.sampling_offsets(tims, starts, dt)
+                stoffs, sfound = MonDbReader.sampling_offsets(tims, starts, dt, 'step')
+                self.assertTrue((found == sfound).all())
+                self.assertTrue(numpy.allclose(toffs, stoffs, rtol=0, atol=1.e-9))
+
+    def test_lazy_columns(self):
+        """Check lazy tables are read on first access with the selected columns."""
+        full = MonDbReader(self.dbname, fix=False)
+        cols = {'resource': ['timestamp', 'psutil_process_pid']}
+        dbr = MonDbReader(self.dbname, lazy=True, fix=False, columns=cols)
+        self.assertEqual(dbr.loaded_table_names(), [])
+        self.assertEqual(len(dbr), len(full))
+        res = dbr['resource']
+        self.assertEqual(dbr.loaded_table_names(), ['resource'])
+        self.assertEqual(list(res.columns), ['run_id', 'task_id', 'try_id', 'timestamp', 'psutil_process_pid'])
+        pandas.testing.assert_frame_equal(res, full['resource'][res.columns])
+        self.assertIs(dbr['resource'], res)
+        pandas.testing.assert_frame_equal(dbr['task'], full['task'])
+        self.assertEqual(cols, {'resource': ['timestamp', 'psutil_process_pid']})
+        # Fixing needs columns that were not read.
+        dbn = MonDbReader(self.dbname, fix=False, columns=cols)
+        with self.assertRaisesRegex(Exception, 'resource_monitoring_interval'):
+            dbn.fix()
+        # The columns used by fix are added to the selection.
+        dbf = MonDbReader(self.dbname)
+        for dodelta in [False, True]:
+            dbc = MonDbReader(self.dbname, lazy=True, dodelta=dodelta, columns=cols)
+            ccols = dbc['resource'].columns
+            self.assertIn('resource_monitoring_interval', ccols)
+            self.assertEqual('psutil_process_time_user' in ccols, dodelta)
+            pandas.testing.assert_frame_equal(dbc['procsum'], dbf.build_procsum(dodelta))
+
+    def test_procsum_chunked(self):
+        """Check procsum built from resource chunks matches that built from the full table."""
+        dbr = MonDbReader(self.dbname)
+        psfull = dbr.table('procsumNoDelta')
+        self.assertGreater(len(psfull), 0)
+        for chunksize in [7, 100, 100000]:
+            dbc = MonDbReader(self.dbname, lazy=True, chunksize=chunksize)
+            self.assertNotIn('resource', dbc.loaded_table_names())
+            pandas.testing.assert_frame_equal(dbc.table('procsum'), psfull, check_index_type=False)
+
+    def test_procsum_sql(self):
+        """Check procsum built in the DB matches that built with pandas."""
+        dbr = MonDbReader(self.dbname)
+        dbs = MonDbReader(self.dbname, lazy=True, procsum_backend='sql')
+        self.assertNotIn('resource', dbs.loaded_table_names())
+        pandas.testing.assert_frame_equal(dbs.table('procsum'), dbr.table('procsumNoDelta'), check_index_type=False)
+
+    def test_interpolate_series(self):
+        tims = numpy.array([0.0, 10.0, 20.0, 5.0, 6.0])
+        vals = numpy.array([0.0, 10.0, 0.0, 1.0, 3.0])
+        segs = numpy.array([0, 0, 0, 1, 1])
+        qtims = numpy.array([-1.0, 5.0, 10.0, 15.0, 25.0, 5.5, 4.0, 7.0])
+        qsegs = numpy.array([0, 0, 0, 0, 0, 1, 1, 1])
+        qvals = MonDbReader.interpolate_series(tims, vals, segs, qtims, qsegs)
+        self.assertTrue(numpy.allclose(qvals[:, 0], [0.0, 5.0, 10.0, 5.0, 0.0, 2.0, 1.0, 3.0]))
+
+    def test_procsum_interp(self):
+        """Check the interpolated procsum conserves the counters for any grid spacing."""
+        dbr = MonDbReader(self.dbname)
+        tp = dbr.build_taskproc_table(False)
+        cpu = tp.groupby(['task_id', 'try_id'])['proc_time_user'].last().sum()
+        for delt in [0.5, 5.0, 13.0]:
+            ps = dbr.build_procsum_interp(delt)
+            self.assertIs(dbr.table('procsum'), ps)
+            self.assertTrue(numpy.allclose(numpy.diff(ps['timestamp']), delt))
+            self.assertAlmostEqual(ps['procsum_time_user'].sum(), cpu, delta=1.e-9*cpu)
+            self.assertLessEqual(ps['nproc'].max(), 4)
+
+    def test_compact(self):
+        """Check compact mode reduces memory and gives the same results."""
+        dbr = MonDbReader(self.dbname)
+        dbc = MonDbReader(self.dbname, compact=True)
+        self.assertIn('compact', dbc.fixed)
+        for tnam in ['task', 'try', 'status', 'resource']:
+            self.assertLess(dbc.table_memory(tnam), dbr.table_memory(tnam))
+            self.assertEqual(dbc._memory_before[tnam], dbr.table_memory(tnam))
+        self.assertEqual(dbc['status']['task_status_name'].dtype, 'category')
+        self.assertEqual(dbc['resource']['task_id'].dtype, numpy.int32)
+        self.assertEqual(dbc['resource']['psutil_process_memory_resident'].dtype, numpy.float32)
+        self.assertEqual(dbc['resource']['timestamp'].dtype, numpy.float64)
+        pandas.testing.assert_frame_equal(dbc['try'], dbr['try'], check_dtype=False, check_categorical=False)
+        pandas.testing.assert_frame_equal(dbc.build_procsum(True), dbr.build_procsum(True), check_dtype=False, rtol=1.e-6)
+
+    def test_compact_counters(self):
+        """Check compact mode keeps the deltas of large cumulative counters."""
+        fnam = os.path.join(self.tmpdir.name, 'counters', 'monitoring.db')
+        os.makedirs(os.path.dirname(fnam))
+        shutil.copy(self.dbname, fnam)
+        con = sqlite3.connect(fnam)
+        con.execute("update resource set psutil_process_disk_read = psutil_process_disk_read + 1.e12, "
+                    "psutil_process_disk_write = psutil_process_disk_write + 2.e12")
+        con.commit()
+        con.close()
+        dbr = MonDbReader(fnam)
+        dbc = MonDbReader(fnam, compact=True)
+        for cnam in ['psutil_process_disk_read', 'psutil_process_disk_write', 'psutil_process_time_user']:
+            self.assertEqual(dbc['resource'][cnam].dtype, numpy.float64)
+        tp = dbc.build_taskproc_table(True)
+        exp = dbr.build_taskproc_table(True)
+        later = tp['isam'] > 0
+        self.assertTrue(numpy.allclose(tp.loc[later, 'procdel_disk_read'], exp.loc[later, 'procdel_disk_read'], rtol=1.e-9, atol=0))
+        pandas.testing.assert_frame_equal(dbc.build_procsum(True), dbr.build_procsum(True), check_dtype=False, rtol=1.e-6)
+
+    def test_access(self):
+        """Check the access modes and indexed copy give the same tables."""
+        dbr = MonDbReader(self.dbname, access='rw')
+        for kwargs in [dict(access='ro'), dict(access='immutable'), dict(index_copy=True)]:
+            dbx = MonDbReader(self.dbname, **kwargs)
+            for tnam in ['task', 'try', 'status', 'resource', 'procsum']:
+                pandas.testing.assert_frame_equal(dbx[tnam], dbr[tnam])
+        fnam = dbx.index_copy_name()
+        self.assertTrue(os.path.exists(fnam))
+        self.assertEqual(dbx.update_index_copy(), fnam)
+        plan = dbx._con.execute("explain query plan select * from resource where run_id=? and task_id=?", ['run-test', 3]).fetchall()
+        self.assertIn('wfmon_resource_run_id_task_id_try_id_timestamp', str(plan))
+
+    def test_window(self):
+        """Check window matches selection with queries in memory and in the DB."""
+        dbr = MonDbReader(self.dbname)
+        dbr.taskcounts(delt=5.0)
+        dbl = MonDbReader(self.dbname, lazy=True)
+        # Drop the tables so the window is found in the DB.
+        for tnam in ['resource', 'status', 'try']: del dbl._tables[tnam]
+        t1, t2 = 60.0, 95.5
+        win = dbr.window(t1, t2)
+        winl = dbl.window(t1, t2)
+        for tnam in ['resource', 'status']:
+            tab = dbr[tnam]
+            exp = tab.query(f"timestamp >= {t1} and timestamp <= {t2}")
+            self.assertGreater(len(exp), 0)
+            pandas.testing.assert_frame_equal(win[tnam], exp)
+            pandas.testing.assert_frame_equal(winl[tnam].reset_index(drop=True), exp.reset_index(drop=True))
+        tab = dbr['try']
+        exp = tab[(tab['task_try_time_launched'] <= t2) & ~(tab['task_try_time_returned'] < t1)]
+        pandas.testing.assert_frame_equal(win['try'], exp)
+        pandas.testing.assert_frame_equal(winl['try'].reset_index(drop=True), exp[winl['try'].columns].reset_index(drop=True))
+        tab = dbr['procsum']
+        pandas.testing.assert_frame_equal(win['procsum'], tab.query(f"timestamp >= {t1} and timestamp <= {t2}"))
+        tab = dbr.taskcounts('running', delt=5.0)
+        pandas.testing.assert_frame_equal(win['taskcounts']['running'], tab.query(f"time >= {t1} and time <= {t2}"))
+
+    def test_task_rows(self):
+        """Check the task group index gives the rows for each task."""
+        dbr = MonDbReader(self.dbname)
+        for tnam, tcol in [('resource', 'timestamp'), ('status', 'timestamp'), ('try', 'try_id')]:
+            tab = dbr[tnam]
+            for tid in [0, 7, 39]:
+                exp = tab[(tab['run_idx'] == 0) & (tab['task_id'] == tid)].sort_values(tcol, kind='stable')
+                rows = dbr.task_rows(tnam, 0, tid)
+                self.assertGreater(len(rows), 0)
+                pandas.testing.assert_frame_equal(rows.reset_index(drop=True), exp.reset_index(drop=True))
+                self.assertTrue(numpy.array_equal(dbr.task_group_index(tnam)['order'][dbr.task_row_range(tnam, 0, tid)[0]:][:len(exp)], exp.index))
+            self.assertEqual(len(dbr.task_rows(tnam, 0, 1000)), 0)
+            self.assertEqual(len(dbr.task_rows(tnam, 1, 0)), 0)
+
+    def test_synthetic_rundir(self):
+        """Check a synthetic run directory is read as generated."""
+        tims = numpy.array([1650000000.123456, 1667725200.5, 1647162000.25])
+        self.assertTrue(numpy.array_equal(MonDbReader.times_from_strings(local_time_strings(tims)), tims))
+        ntask, nworker = 60, 5
+        rundir = os.path.join(self.tmpdir.name, 'synthetic')
+        dbnam = make_rundir(rundir, ntask=ntask, nrun=2, dt=[5.0, 2.0], nworker=nworker, fail_frac=0.2)
+        run_ids = [row[0] for row in sqlite3.connect(dbnam).execute("select run_id from workflow")]
+        self.assertEqual(len(run_ids), 2)
+        dbr = MonDbReader(dbnam, run_id=run_ids[1])
+        ttry = dbr['try']
+        self.assertEqual(len(dbr['task']), ntask)
+        self.assertGreater(len(ttry), ntask)
+        self.assertEqual(ttry['status_alldone'].notna().sum(), ntask)
+        self.assertTrue((ttry['task_try_time_running'] < ttry['task_try_time_returned']).all())
+        nrun = dbr.taskcounts('running', delt=1.0)['all'] - dbr.taskcounts('returned')['all']
+        self.assertLessEqual(nrun.max(), nworker)
+        dbr.chaintasks()
+        self.assertEqual(dbr.taskchain_count('late'), 0)
+        self.assertTrue(numpy.allclose(numpy.diff(dbr.task_rows('resource', 0, 3)['timestamp']), 2.0, rtol=0.01))
+        psr = PerfStatLogReader()
+        self.assertEqual(psr.read_mondb_logs(dbr), {'nkeep': ntask, 'nskip': 0})
+        self.assertTrue((psr.table()['speed'] > 1.e6).all())
+
+    def test_stage_table(self):
+        """Check the stages are recorded for the reads and fix steps."""
+        dbr = MonDbReader(self.dbname)
+        stab = dbr.stage_table()
+        stages = list(stab['stage'])
+        for stage in ['connect', 'read', 'fix', 'fix_runs', 'fix_times', 'fix_tasks', 'fix_try', 'build_procsum']:
+            self.assertIn(stage, stages)
+        reads = stab[stab['stage'] == 'read']
+        self.assertEqual(sorted(reads['label']), sorted(dbr._db_table_names))
+        self.assertTrue((reads['depth'] == 1).all())
+        self.assertEqual(reads.set_index('label').loc['resource', 'rows_out'], len(dbr['resource']))
+        self.assertTrue((stab['wall'] >= 0).all() and (stab['cpu'] >= 0).all())
+        fix = stab[stab['stage'] == 'fix'].iloc[0]
+        self.assertGreaterEqual(fix['wall'], stab[stab['stage'].str.startswith('fix_')]['wall'].sum())
+        self.assertEqual(stab[stab['stage'] == 'build_procsum']['rows_out'].iloc[0], len(dbr['procsum']))
+        fnam = os.path.join(self.tmpdir.name, 'stages.json')
+        dbr.stage_timer.to_json(fnam)
+        with open(fnam) as fin:
+            rec = json.load(fin)
+        self.assertEqual(rec['info']['filename'], self.dbname)
+        self.assertEqual(len(rec['stages']), len(stab))
+        # A stage recorded with the context manager is ended when the block raises.
+        timer = StageTimer()
+        with self.assertRaises(ValueError):
+            with timer.stage('outer', 'test', 3) as rec:
+                rec['rows_out'] = 2
+                raise ValueError('test')
+        with timer.stage('next'): pass
+        self.assertEqual(list(timer.table()['depth']), [0, 0])
+        self.assertEqual(list(timer.table()['rows_out'])[0], 2)
+
+    def test_collection(self):
+        """Check the collection tables match those read for each run."""
+        dbnams = [make_rundir(os.path.join(self.tmpdir.name, f"coll{idb}"), ntask=30, nrun=idb + 1, nworker=3,
+                              function_data=False, perfstat=False, seed=idb) for idb in range(2)]
+        for nproc in [1, 2]:
+            coll = MonDbCollection(dbnams, nproc=nproc)
+            self.assertEqual(len(coll), 3)
+            self.assertEqual(coll.db_idxs, [0, 1, 1])
+            self.assertEqual(len(coll.errors), 0)
+            ttry = coll['try']
+            for irun, (idb, dbnam, rid) in enumerate(coll.sources):
+                dbr = MonDbReader(dbnam, run_id=rid)
+                exp = dbr['try'].assign(run_idx=irun)
+                exp.insert(0, 'db_idx', idb)
+                exp['task_idx'] = [coll.task_names.index(dbr.task_names[tidx]) for tidx in dbr['try']['task_idx']]
+                pandas.testing.assert_frame_equal(ttry[ttry['run_idx'] == irun].reset_index(drop=True), exp, check_dtype=False)
+                self.assertEqual(coll.t0s[irun], dbr.t0)
+            self.assertIs(coll['procsum'], coll['procsumNoDelta'])
+            self.assertEqual(list(coll.run_table()['ntask']), [30, 30, 30])
+        coll = MonDbCollection(dbnams + [os.path.join(self.tmpdir.name, 'coll0', 'runinfo', 'monitoring.db')],
+                               run_ids=[None, None, ['bad-run-id']], nproc=1)
+        self.assertEqual(list(coll.errors.keys()), [3])
+        self.assertEqual(coll['try']['run_idx'].max(), 2)